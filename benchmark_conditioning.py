@@ -0,0 +1,85 @@
+import time
+import argparse
+import numpy as np
+from absl import logging
+from ddsp_piano.utils.midi_encoders import \
+    MIDIRoll2Conditioning, EventMIDIRoll2Conditioning
+from ddsp_piano.utils.pianoroll_utils import load_midi_as_pianoroll
+
+
+def process_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the frame-wise and event-driven MIDI roll to "
+                    "conditioning converters."
+    )
+    parser.add_argument('-fr', '--frame_rate', type=int, default=250,
+                        help="Frame rate for conditioning. (default: %(default)s)")
+    parser.add_argument('-p', '--polyphony', type=int, default=16,
+                        help="Maximum polyphony for conditioning. (default: %(default)s)")
+    parser.add_argument('-d', '--duration', type=float, default=600.,
+                        help="Duration of the random pianoroll, if no MIDI file is given (in s). \
+                        (default: %(default)s)")
+    parser.add_argument('-n', '--n_notes', type=int, default=8000,
+                        help="Number of notes in the random pianoroll. (default: %(default)s)")
+    parser.add_argument('midi_files', type=str, nargs='*',
+                        help="MIDI files to benchmark on.")
+    return parser.parse_args()
+
+
+def random_pianoroll(n_frames, n_notes, max_note_frames=500, seed=0):
+    """Random active and onset velocity pianorolls, note_seq style.
+    Returns:
+        - roll (n_frames, 88, 2): stacked active and onset velocity pianorolls.
+    """
+    rng = np.random.default_rng(seed)
+    roll = np.zeros((n_frames, 88, 2), dtype=np.float32)
+
+    keys = rng.integers(0, 88, size=n_notes)
+    starts = rng.integers(0, n_frames, size=n_notes)
+    ends = np.minimum(starts + rng.integers(1, max_note_frames, size=n_notes),
+                      n_frames)
+    velocities = rng.integers(1, 128, size=n_notes) / 127.
+
+    for key, start, end, velocity in zip(keys, starts, ends, velocities):
+        roll[start: end, key, 0] = 1.
+        roll[start, key, 1] = velocity
+    return roll
+
+
+def load_pianoroll(mid_path, frame_rate=250):
+    active, onset_velocities, _, _ = load_midi_as_pianoroll(mid_path, frame_rate)
+    return np.stack((active, onset_velocities), axis=-1)
+
+
+def time_converter(converter, roll):
+    start = time.perf_counter()
+    conditioning, polyphony = converter(roll.copy())
+    return time.perf_counter() - start, conditioning, polyphony
+
+
+def main(args):
+    logging.set_verbosity(logging.INFO)
+
+    if args.midi_files:
+        rolls = {f: load_pianoroll(f, args.frame_rate) for f in args.midi_files}
+    else:
+        rolls = {'random': random_pianoroll(int(args.duration * args.frame_rate),
+                                            args.n_notes)}
+
+    for name, roll in rolls.items():
+        ref_time, ref_cond, ref_poly = time_converter(
+            MIDIRoll2Conditioning(args.polyphony), roll)
+        event_time, event_cond, event_poly = time_converter(
+            EventMIDIRoll2Conditioning(args.polyphony), roll)
+
+        identical = np.array_equal(ref_cond, event_cond) \
+            and np.array_equal(ref_poly, event_poly)
+        logging.info(f"{name} ({len(roll)} frames): "
+                     f"frame-wise {ref_time:.3f} s, "
+                     f"event-driven {event_time:.3f} s "
+                     f"(x{ref_time / event_time:.1f}), "
+                     f"identical outputs: {identical}")
+
+
+if __name__ == '__main__':
+    main(process_args())
@@ -0,0 +1,200 @@
+import sys
+import json
+import time
+import resource
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from absl import logging
+from os.path import join
+from ddsp_piano.data_pipeline import get_dataset, get_preprocessed_dataset, get_padded_shapes, \
+    split_tracks_into_segments, get_shards_dir, get_track_mixing
+from ddsp_piano.utils import io_utils
+from ddsp_piano.utils.pool_utils import close_decode_pools
+
+
+def process_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the training data pipeline, end to end and stage by stage."
+    )
+    parser.add_argument('-n', '--n_batches', type=int, default=50,
+                        help="Number of batches of the end to end run. (default: %(default)s)")
+    parser.add_argument('-b', '--batch_size', type=int, default=6,
+                        help="Number of elements per batch. (default: %(default)s)")
+    parser.add_argument('-sr', '--sample_rate', type=int, default=24000,
+                        help="Sample rate of the model. (default: %(default)s)")
+    parser.add_argument('-fr', '--frame_rate', type=int, default=250,
+                        help="Frame rate for conditioning. (default: %(default)s)")
+    parser.add_argument('-p', '--polyphony', type=int, default=16,
+                        help="Polyphonic capacity of the model. (default: %(default)s)")
+    parser.add_argument('-d', '--duration', type=float, default=3,
+                        help="Duration of segments (in s). (default: %(default)s)")
+    parser.add_argument('--split', type=str, default='train',
+                        help="Dataset split. (default: %(default)s)")
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="Folder for caching converted MIDI files and decoded audio. \
+                        (default: %(default)s)")
+    parser.add_argument('--decode_workers', type=int, default=0,
+                        help="Number of processes decoding full tracks. (default: %(default)s)")
+    parser.add_argument('--segment_index', action='store_true',
+                        help="Read segments lazily from an index instead of splitting full tracks.")
+    parser.add_argument('--shuffle', action='store_true',
+                        help="Shuffle the end to end run as in training, to measure how it mixes tracks.")
+    parser.add_argument('--shuffle_buffer_mb', type=int, default=512,
+                        help="Memory budget of the segments shuffle buffer, in MB. (default: %(default)s)")
+    parser.add_argument('--open_tracks', type=int, default=8,
+                        help="Number of tracks interleaved when shuffling segments. (default: %(default)s)")
+    parser.add_argument('-r', '--repeats', type=int, default=3,
+                        help="Number of runs of each stage, keeping the fastest one. (default: %(default)s)")
+    parser.add_argument('--output', '-o', type=str, default=None,
+                        help="JSON file of the results, printed on stdout if None. (default: %(default)s)")
+    parser.add_argument('dataset_path', type=str,
+                        help="Path to the MAESTRO dataset folder, a preprocessed .tfrecord, or shards.")
+    return parser.parse_args()
+
+
+def get_rss_mb():
+    """Resident memory of the process (in MB), or its peak if unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        scale = 1 if sys.platform == 'darwin' else 2 ** 10
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def get_bytes_read():
+    """Bytes read by the process through system calls (None if unavailable)."""
+    try:
+        with open('/proc/self/io') as f:
+            return int(dict(line.split(': ') for line in f.read().splitlines())['rchar'])
+    except (OSError, KeyError):
+        return None
+
+
+def run(dataset, n_elements=None):
+    """Iterate over a dataset.
+    Returns:
+        - stats (dict): number of elements, wall time, bytes of the produced
+        elements, bytes read and resident memory after the run.
+        - filenames (list): 'filename' entries of the produced elements.
+    """
+    if n_elements is not None:
+        dataset = dataset.take(n_elements)
+    n, output_bytes, filenames = 0, 0, []
+    bytes_read = get_bytes_read()
+    start = time.perf_counter()
+    for x in dataset:
+        n += 1
+        output_bytes += sum(np.asarray(v.numpy()).nbytes for v in x.values())
+        if 'filename' in x:
+            filenames += [f.decode() for f in x['filename'].numpy().ravel()]
+    seconds = time.perf_counter() - start
+    if bytes_read is not None:
+        bytes_read = get_bytes_read() - bytes_read
+    return {'elements': n,
+            'seconds': seconds,
+            'output_mb': output_bytes / 2 ** 20,
+            'bytes_read': bytes_read,
+            'rss_mb': get_rss_mb()}, filenames
+
+
+def get_stages(args, n_tracks):
+    """Cumulative prefixes of the get_dataset() pipeline splitting full tracks,
+    run over its first tracks."""
+    stages = []
+    if ".tfrecord" in args.dataset_path:
+        tracks = tf.data.Dataset.load(args.dataset_path).take(n_tracks)
+        stages.append(('load_tfrecord', tracks))
+    else:
+        csv, _, _ = io_utils.dataset_from_csv(join(args.dataset_path, "maestro-v3.0.0.csv"),
+                                              split=args.split)
+        stages.append(('read_csv', csv.take(n_tracks)))
+        tracks = get_preprocessed_dataset(args.dataset_path,
+                                          split=args.split,
+                                          sample_rate=args.sample_rate,
+                                          frame_rate=args.frame_rate,
+                                          max_polyphony=args.polyphony,
+                                          cache_dir=args.cache_dir,
+                                          decode_workers=args.decode_workers,
+                                          n_tracks=n_tracks)
+        stages.append(('load_data', tracks))
+
+    segments = split_tracks_into_segments(tracks,
+                                          duration=args.duration,
+                                          sample_rate=args.sample_rate,
+                                          frame_rate=args.frame_rate)
+    stages.append(('split_segments', segments))
+
+    segments = segments.filter(lambda x: tf.reduce_max(x["polyphony"]) <= args.polyphony)
+    stages.append(('filter', segments))
+
+    keys = ['audio', 'conditioning', 'pedal', 'piano_model', 'filename']
+    batches = segments.map(lambda x: {k: x[k] for k in keys}).padded_batch(
+        args.batch_size,
+        padded_shapes=get_padded_shapes(args.duration, args.sample_rate, args.frame_rate, args.polyphony),
+        drop_remainder=True)
+    stages.append(('padded_batch', batches))
+    return stages
+
+
+def main(args):
+    logging.set_verbosity(logging.INFO)
+
+    # End to end, in training order without shuffling unless required
+    dataset = get_dataset(args.dataset_path,
+                          split=args.split,
+                          duration=args.duration,
+                          batch_size=args.batch_size,
+                          shuffle=args.shuffle,
+                          sample_rate=args.sample_rate,
+                          frame_rate=args.frame_rate,
+                          max_polyphony=args.polyphony,
+                          cache_dir=args.cache_dir,
+                          segment_index=args.segment_index,
+                          decode_workers=args.decode_workers,
+                          shuffle_buffer_size=args.shuffle_buffer_mb * 2 ** 20,
+                          open_tracks=args.open_tracks)
+    end_to_end, filenames = run(dataset, args.n_batches)
+    n_segments = end_to_end['elements'] * args.batch_size
+    end_to_end.update(batches=end_to_end.pop('elements'),
+                      segments=n_segments,
+                      segments_per_second=n_segments / end_to_end['seconds'],
+                      **get_track_mixing(filenames, args.batch_size))
+    logging.info(f"End to end: {end_to_end['batches']} batches in {end_to_end['seconds']:.2f}s, "
+                 f"{end_to_end['segments_per_second']:.1f} segments/s, "
+                 f"{(end_to_end['bytes_read'] or 0) / 2 ** 20:.1f} MB read, "
+                 f"{end_to_end['tracks_per_batch']:.2f} tracks per batch, "
+                 f"{end_to_end['same_track_neighbors']:.2f} of consecutive segments from a same track")
+
+    # Time of each stage, as the difference between consecutive prefixes of
+    # the pipeline over the tracks read by the end to end run (bytes read are
+    # cumulative)
+    stages = []
+    if get_shards_dir(args.dataset_path, args.split) is None and not args.segment_index:
+        n_tracks = len({f.rsplit('_', 1)[0] for f in filenames})
+        previous = 0.
+        for name, stage in get_stages(args, n_tracks):
+            stats = min((run(stage)[0] for _ in range(args.repeats)), key=lambda x: x['seconds'])
+            stats.update(name=name,
+                         cumulative_seconds=stats['seconds'],
+                         seconds=max(stats['seconds'] - previous, 0.))
+            previous = stats['cumulative_seconds']
+            stages.append(stats)
+            logging.info(f"{name:>16}: {stats['seconds']:.2f}s, {stats['elements']} elements, "
+                         f"{stats['output_mb']:.1f} MB out, {stats['rss_mb']:.0f} MB resident")
+    else:
+        logging.info("Stage breakdown is only available for pipelines splitting full tracks.")
+    close_decode_pools()
+
+    results = json.dumps({'config': vars(args), 'end_to_end': end_to_end, 'stages': stages}, indent=2)
+    if args.output is None:
+        print(results)
+    else:
+        with tf.io.gfile.GFile(args.output, 'w') as f:
+            f.write(results)
+
+
+if __name__ == '__main__':
+    main(process_args())
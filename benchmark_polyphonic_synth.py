@@ -0,0 +1,152 @@
+import json
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from absl import logging
+from ddsp import effects, processors
+from ddsp_piano.modules.inharm_synth import MultiInharmonic
+from ddsp_piano.modules.filtered_noise_synth import DynamicSizeFilteredNoise
+from ddsp_piano.modules.polyphonic_dag import polyphonic_dag, vectorized_polyphonic_dag
+
+ADDITIVE_CONTROLS = ['amplitudes', 'harmonic_distribution', 'inharm_coef', 'f0_hz']
+NOISE_CONTROLS = ['magnitudes']
+
+
+def process_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the polyphonic synthesis of a processor group unrolled over voices \
+        (polyphonic_dag) against a single vectorized call (vectorized_polyphonic_dag)."
+    )
+    parser.add_argument('-b', '--batch_size', type=int, default=6,
+                        help="Number of elements per batch. (default: %(default)s)")
+    parser.add_argument('-p', '--polyphony', type=int, default=16,
+                        help="Polyphonic capacity of the model. (default: %(default)s)")
+    parser.add_argument('-d', '--duration', type=float, default=3,
+                        help="Duration of segments (in s). (default: %(default)s)")
+    parser.add_argument('-sr', '--sample_rate', type=int, default=24000,
+                        help="Sample rate of the model. (default: %(default)s)")
+    parser.add_argument('-fr', '--frame_rate', type=int, default=250,
+                        help="Frame rate for conditioning. (default: %(default)s)")
+    parser.add_argument('--n_harmonics', type=int, default=96,
+                        help="Number of partials of each voice. (default: %(default)s)")
+    parser.add_argument('--n_substrings', type=int, default=2,
+                        help="Number of detuned substrings of each voice. (default: %(default)s)")
+    parser.add_argument('--n_bands', type=int, default=64,
+                        help="Number of noise filter bands. (default: %(default)s)")
+    parser.add_argument('--training', action='store_true',
+                        help="Also compute the gradients of the signal with respect to the controls.")
+    parser.add_argument('-r', '--repeats', type=int, default=5,
+                        help="Number of runs of each synthesis, keeping the fastest one. (default: %(default)s)")
+    parser.add_argument('--output', '-o', type=str, default=None,
+                        help="JSON file of the results, printed on stdout if None. (default: %(default)s)")
+    return parser.parse_args()
+
+
+def get_controls(args):
+    """Random controls stacked along the polyphony axis (n_voices, batch, ...)
+    and a reverb impulse response."""
+    n_frames = int(args.duration * args.frame_rate)
+    shape = [args.polyphony, args.batch_size, n_frames]
+    f0_hz = tf.random.uniform(shape + [1], 30., 2000.)
+    detuning = tf.random.uniform(shape + [args.n_substrings], 0.99, 1.01)
+    return {'amplitudes': tf.random.normal(shape + [1]),
+            'harmonic_distribution': tf.random.normal(shape + [args.n_harmonics]),
+            'inharm_coef': tf.random.uniform(shape + [1], 0., 1e-3),
+            'f0_hz': f0_hz * detuning,
+            'magnitudes': tf.random.normal(shape + [args.n_bands]),
+            'reverb_ir': tf.random.normal([args.batch_size, args.sample_rate // 2]) * 1e-3}
+
+
+def get_processor_group(args, vectorized):
+    additive = MultiInharmonic(name='additive',
+                               frame_rate=args.frame_rate,
+                               sample_rate=args.sample_rate)
+    noise = DynamicSizeFilteredNoise(name='noise',
+                                     frame_rate=args.frame_rate,
+                                     sample_rate=args.sample_rate)
+    reverb = effects.Reverb(trainable=False)
+    if vectorized:
+        dag = vectorized_polyphonic_dag(additive, noise, reverb,
+                                        additive_controls=ADDITIVE_CONTROLS,
+                                        noise_controls=NOISE_CONTROLS,
+                                        reverb_controls=['reverb_ir'])
+    else:
+        dag = polyphonic_dag(additive, noise, reverb,
+                             additive_controls=ADDITIVE_CONTROLS,
+                             noise_controls=NOISE_CONTROLS,
+                             reverb_controls=['reverb_ir'],
+                             n_synths=args.polyphony)
+    return processors.ProcessorGroup(dag=dag)
+
+
+def get_inputs(controls, vectorized):
+    """Processor group inputs, with one control per voice for a
+    polyphonic_dag()."""
+    if vectorized:
+        return dict(controls)
+    inputs = {'reverb_ir': controls['reverb_ir']}
+    for k in ADDITIVE_CONTROLS + NOISE_CONTROLS:
+        for i in range(controls[k].shape[0]):
+            inputs[k + f'_{i}'] = controls[k][i]
+    return inputs
+
+
+def benchmark(args, controls, vectorized):
+    """Trace and run the synthesis of a processor group.
+    Returns:
+        - stats (dict): number of graph operations, tracing and run time.
+        - signal (np.ndarray): synthesized audio.
+    """
+    processor_group = get_processor_group(args, vectorized)
+    inputs = get_inputs(controls, vectorized)
+
+    @tf.function
+    def synthesize(inputs):
+        if not args.training:
+            return processor_group(inputs), []
+        with tf.GradientTape() as tape:
+            tape.watch(inputs)
+            signal = processor_group(inputs)
+        return signal, tape.gradient(tf.reduce_sum(signal), inputs)
+
+    start = time.perf_counter()
+    concrete_function = synthesize.get_concrete_function(inputs)
+    trace_seconds = time.perf_counter() - start
+
+    signal = synthesize(inputs)[0]
+    seconds = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        tf.nest.map_structure(lambda x: x.numpy(), synthesize(inputs))
+        seconds.append(time.perf_counter() - start)
+
+    return {'graph_ops': len(concrete_function.graph.get_operations()),
+            'trace_seconds': trace_seconds,
+            'seconds': min(seconds)}, signal.numpy()
+
+
+def main(args):
+    logging.set_verbosity(logging.INFO)
+    tf.random.set_seed(0)
+    controls = get_controls(args)
+
+    results = {'config': vars(args)}
+    for name, vectorized in (('polyphonic_dag', False), ('vectorized', True)):
+        results[name], signal = benchmark(args, controls, vectorized)
+        logging.info(f"{name:>16}: {results[name]['graph_ops']} ops, traced in "
+                     f"{results[name]['trace_seconds']:.2f}s, run in {results[name]['seconds']:.3f}s")
+        results[name]['rms'] = float(np.sqrt(np.mean(signal ** 2)))
+    results['speedup'] = results['polyphonic_dag']['seconds'] / results['vectorized']['seconds']
+
+    results = json.dumps(results, indent=2)
+    if args.output is None:
+        print(results)
+    else:
+        with tf.io.gfile.GFile(args.output, 'w') as f:
+            f.write(results)
+
+
+if __name__ == '__main__':
+    main(process_args())
@@ -0,0 +1,117 @@
+import argparse
+import tensorflow as tf
+
+from absl import logging
+from ddsp_piano.data_pipeline import get_training_dataset, get_shards_dir
+
+service = tf.data.experimental.service
+
+
+def process_args():
+    parser = argparse.ArgumentParser(
+        description="Run the training data pipeline as a tf.data service, shared by several trainers."
+    )
+    parser.add_argument('--port', type=int, default=5050,
+                        help="Port of the dispatcher. (default: %(default)s)")
+    parser.add_argument('--workers', '-w', type=int, default=1,
+                        help="Number of worker servers started in this process. (default: %(default)s)")
+    parser.add_argument('--dispatcher_address', type=str, default=None,
+                        help="Only start workers for the dispatcher at this host:port. Remote workers \
+                        can only process datasets read from shards, as decoding MAESTRO files \
+                        relies on Python functions of the dispatcher process. \
+                        (default: %(default)s)")
+    parser.add_argument('--host', type=str, default='localhost',
+                        help="Host name under which workers are reachable. (default: %(default)s)")
+    parser.add_argument('--dataset_id', type=str, default='train',
+                        help="Id of the registered training dataset. (default: %(default)s)")
+
+    parser.add_argument('--batch_size', '-b', type=int, default=6,
+                        help="Number of elements per batch. (default: %(default)s)")
+    parser.add_argument('-sr', '--sample_rate', type=int, default=24000,
+                        help="Sample rate of the model. (default: %(default)s)")
+    parser.add_argument('-p', '--polyphony', type=int, default=16,
+                        help="Polyphonic capacity of the model. (default: %(default)s)")
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="Folder for caching converted MIDI files and decoded audio. \
+                        (default: %(default)s)")
+    parser.add_argument('--decode_workers', type=int, default=0,
+                        help="Number of processes decoding full tracks. (default: %(default)s)")
+    parser.add_argument('--segment_index', action='store_true',
+                        help="Read segments lazily from an index instead of splitting full tracks.")
+    parser.add_argument('--random_offsets', action='store_true',
+                        help="Draw training segments at random offsets (requires --segment_index).")
+    parser.add_argument('--drop_silent', action='store_true',
+                        help="Skip training segments where no note is played.")
+    parser.add_argument('--silent_weight', type=float, default=1.,
+                        help="Probability of drawing near-silent training segments in an epoch, 0 to drop \
+                        them. (default: %(default)s)")
+    parser.add_argument('--min_active_ratio', type=float, default=0.1,
+                        help="Segments holding notes over a smaller ratio of their frames are near-silent. \
+                        (default: %(default)s)")
+    parser.add_argument('--min_rms', type=float, default=None,
+                        help="Segments with a lower audio RMS are near-silent. (default: %(default)s)")
+    parser.add_argument('--polyphony_buckets', type=int, nargs='+', default=None,
+                        help="Batch training segments by number of voices, with these bucket sizes \
+                        (trainers need the same option). (default: %(default)s)")
+    parser.add_argument('--lowest_free_voice', action='store_true',
+                        help="Assign new notes to the lowest free conditioning voice instead of the next one \
+                        in round-robin order (always on with --polyphony_buckets, trainers need the same \
+                        option).")
+    parser.add_argument('maestro_path', type=str, nargs='?', default=None,
+                        help="Path to the MAESTRO dataset folder, or to preprocessed shards.")
+    return parser.parse_args()
+
+
+def main(args):
+    logging.set_verbosity(logging.INFO)
+
+    dispatcher = None
+    dispatcher_address = args.dispatcher_address
+    if dispatcher_address is None:
+        if args.maestro_path is None:
+            raise ValueError("A dataset path is required to start a dispatcher.")
+        dispatcher = service.DispatchServer(service.DispatcherConfig(port=args.port))
+        dispatcher_address = dispatcher.target.split('://')[-1]
+        logging.info(f"Dispatcher running at {dispatcher.target}")
+
+        # Workers process disjoint parts of the dataset only when it is split
+        # from shard files or from a fixed segment index, otherwise they
+        # would all produce the same shuffled stream.
+        splittable = get_shards_dir(args.maestro_path) is not None or \
+            (args.segment_index and not args.random_offsets)
+        if not splittable and args.workers > 1:
+            logging.warning("This dataset cannot be split between workers, starting a single worker "
+                            "(use --decode_workers to decode tracks in parallel).")
+            args.workers = 1
+
+    workers = [service.WorkerServer(service.WorkerConfig(dispatcher_address=dispatcher_address,
+                                                         worker_address=f"{args.host}:%port%"))
+               for _ in range(args.workers)]
+    logging.info(f"{len(workers)} workers connected to {dispatcher_address}")
+
+    if dispatcher is None:
+        workers[0].join()
+        return
+
+    dataset = get_training_dataset(args.maestro_path,
+                                   batch_size=args.batch_size,
+                                   max_polyphony=args.polyphony,
+                                   sample_rate=args.sample_rate,
+                                   cache_dir=args.cache_dir,
+                                   segment_index=args.segment_index,
+                                   random_offsets=args.random_offsets,
+                                   drop_silent=args.drop_silent,
+                                   silent_weight=args.silent_weight,
+                                   min_active_ratio=args.min_active_ratio,
+                                   min_rms=args.min_rms,
+                                   decode_workers=args.decode_workers,
+                                   polyphony_buckets=args.polyphony_buckets,
+                                   lowest_free_voice=args.lowest_free_voice or bool(args.polyphony_buckets))
+    service.register_dataset(dispatcher.target, dataset, dataset_id=args.dataset_id)
+    logging.info(f"Training dataset registered as '{args.dataset_id}', trainers can use "
+                 f"--data_service {dispatcher.target}")
+    dispatcher.join()
+
+
+if __name__ == '__main__':
+    main(process_args())
@@ -1,7 +1,15 @@
+import time
+import numpy as np
+import pandas as pd
 import tensorflow as tf
 import ddsp_piano.utils.io_utils as io_utils
 
+from absl import logging
 from os.path import join
+from functools import partial
+from ddsp_piano.utils import shard_utils, store_utils
+from ddsp_piano.utils.pool_utils import get_decode_pool, imap_unordered
+from ddsp_piano.utils.cache_utils import ArrayCache, AudioCache
 
 
 def get_dummy_data(batch_size=6,
@@ -64,6 +72,26 @@ def get_test_dataset(*args, duration=10, overlap=0., **kwargs):
                        **kwargs)
 
 
+def get_caches(cache_dir=None, cache_max_size=None, cache_audio_dtype='float32'):
+    """Build the converted MIDI and decoded audio caches (None if no cache_dir).
+    """
+    if cache_dir is None:
+        return None, None
+    midi_cache = ArrayCache(join(cache_dir, 'midi'), max_size=cache_max_size)
+    audio_cache = AudioCache(join(cache_dir, 'audio'),
+                             max_size=cache_max_size,
+                             dtype=cache_audio_dtype)
+    return midi_cache, audio_cache
+
+
+def get_resampler(dataset_dir, resampler=None):
+    """Audio resampler of a maestro-v3.0.0/ folder: the polyphase filter of
+    io_utils.resample_audio() for a rate-agnostic store, pydub otherwise."""
+    if resampler is not None:
+        return resampler
+    return 'polyphase' if store_utils.is_store(dataset_dir) else 'pydub'
+
+
 def get_preprocessed_dataset(dataset_dir,
                              split='train',
                              year=None,
@@ -71,6 +99,14 @@ def get_preprocessed_dataset(dataset_dir,
                              frame_rate=250,
                              max_polyphony=16,
                              num_parallel_calls=8,
+                             cache_dir=None,
+                             cache_max_size=None,
+                             cache_audio_dtype='float32',
+                             shuffle=False,
+                             decode_workers=0,
+                             n_tracks=None,
+                             lowest_free_voice=False,
+                             resampler=None,
                              **kwargs):
     """Extract audio and midi data from the .csv metadata file.
     Args:
@@ -83,7 +119,34 @@ def get_preprocessed_dataset(dataset_dir,
         than the model polyphonic capacity. Does not filter anything if set to
         `None`.
         - num_parallel_calls (int): number of threads.
+        - cache_dir (path): folder for caching converted MIDI files and decoded
+        audio across epochs and runs (no caching if None).
+        - cache_max_size (int): size budget of each cache (in bytes).
+        - cache_audio_dtype ('float32' or 'int16'): decoded audio storage.
+        - shuffle (bool): shuffle the tracks order, before any decoding.
+        - decode_workers (int): number of processes decoding audio and MIDI
+        files (decoding in the main process if 0, one per core if None), shared
+        by the datasets of a same configuration until
+        pool_utils.close_decode_pools() is called.
+        - n_tracks (int): only process the first tracks (all if None).
+        - lowest_free_voice (bool): assign new notes to the lowest free
+        conditioning voice instead of the next one in round-robin order.
+        - resampler ('pydub' or 'polyphase'): audio resampler, polyphase for
+        a store written by preprocess_data_into_store() and pydub otherwise if
+        None.
     """
+    midi_cache, audio_cache = get_caches(cache_dir, cache_max_size, cache_audio_dtype)
+    resampler = get_resampler(dataset_dir, resampler)
+    decode_pool = None
+    if decode_workers != 0:
+        # Shared with other datasets of the same configuration
+        decode_pool = get_decode_pool(decode_workers,
+                                      cache_dir=cache_dir,
+                                      cache_max_size=cache_max_size,
+                                      cache_audio_dtype=cache_audio_dtype)
+        # One decoding call in flight per worker
+        num_parallel_calls = max(num_parallel_calls, decode_pool.n_workers)
+
     # Init tf.dataset from .csv file
     dataset, n_examples, piano_models = io_utils.dataset_from_csv(
         join(dataset_dir, "maestro-v3.0.0.csv"),
@@ -91,6 +154,14 @@ def get_preprocessed_dataset(dataset_dir,
         year=year,
         **kwargs
     )
+    if n_tracks is not None:
+        dataset = dataset.take(n_tracks)
+        n_examples = min(n_examples, n_tracks)
+    # Shuffle on tracks metadata, which is cheap to buffer
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=n_examples,
+                                  seed=0,
+                                  reshuffle_each_iteration=True)
     # Encode piano model as one-hot
     dataset = dataset.map(
         lambda sample: dict(
@@ -108,12 +179,648 @@ def get_preprocessed_dataset(dataset_dir,
                 tf.strings.join([dataset_dir, sample['midi_filename']]),
                 max_polyphony,
                 sample_rate,
-                frame_rate)),
+                frame_rate,
+                midi_cache=midi_cache,
+                audio_cache=audio_cache,
+                decode_pool=decode_pool,
+                lowest_free_voice=lowest_free_voice,
+                resampler=resampler)),
         num_parallel_calls=num_parallel_calls
     )
     return dataset
 
 
+def get_segment_index(track_durations, duration=3, overlap=0.5, frame_rate=250):
+    """List segments of the split_sequence_tf() layout as (track_id,
+    frame_offset) pairs.
+    Args:
+        - track_durations (n_tracks,): duration of each track (in s).
+        - duration (float): duration of segments (in s).
+        - overlap (float): overlap ratio between consecutive segments.
+        - frame_rate (int): number of conditioning frames per second.
+    Returns:
+        - track_ids (n_segments,): track of each segment.
+        - frame_offsets (n_segments,): first conditioning frame of each segment.
+        - segment_ids (n_segments,): position of each segment in its track.
+    """
+    n_frames = int(duration * frame_rate)
+    hop_size = int(n_frames * (1 - overlap))
+    track_frames = (np.asarray(track_durations) * frame_rate).astype(np.int64)
+
+    n_segments = np.where(track_frames >= n_frames,
+                          (track_frames - n_frames) // hop_size + 1,
+                          0)
+    track_ids = np.repeat(np.arange(len(track_frames)), n_segments)
+    # Position of each segment within its track
+    segment_ids = np.arange(len(track_ids)) - np.repeat(np.cumsum(n_segments) - n_segments,
+                                                        n_segments)
+    return track_ids, segment_ids * hop_size, segment_ids
+
+
+def get_segment_dataset(dataset_dir,
+                        split='train',
+                        year=None,
+                        duration=3,
+                        overlap=0.5,
+                        shuffle=True,
+                        random_offsets=False,
+                        sample_rate=16000,
+                        frame_rate=250,
+                        max_polyphony=16,
+                        filter_over_polyphony=True,
+                        drop_silent=False,
+                        silent_weight=1.,
+                        min_active_ratio=0.1,
+                        min_rms=None,
+                        num_parallel_calls=8,
+                        cache_dir=None,
+                        cache_max_size=None,
+                        cache_audio_dtype='float32',
+                        lowest_free_voice=False,
+                        resampler=None,
+                        **kwargs):
+    """Dataset of segments read lazily from a lightweight index of (track_id,
+    frame_offset) pairs, instead of splitting full tracks into overlapping
+    segment tensors. Shuffling only involves the index, and segments are
+    filtered out from their MIDI data before loading any audio.
+    Args:
+        - random_offsets (bool): draw segments indefinitely at random offsets,
+        uniformly over the dataset duration, instead of following the
+        `overlap` layout.
+        - drop_silent (bool): filter out segments where no note is played.
+        - silent_weight, min_active_ratio, min_rms: near-silent segments
+        sampling policy, see get_segment_weights().
+        Other arguments are the same as for get_preprocessed_dataset() and
+        get_dataset().
+    Returns:
+        - dataset (tf.data.Dataset): segments dataset
+    """
+    midi_cache, audio_cache = get_caches(cache_dir, cache_max_size, cache_audio_dtype)
+    resampler = get_resampler(dataset_dir, resampler)
+
+    # Tracks metadata
+    df = io_utils.metadata_from_csv(join(dataset_dir, "maestro-v3.0.0.csv"),
+                                    split=split,
+                                    year=year,
+                                    **kwargs)
+    piano_models = np.sort(df['year'].unique())
+    tracks = {
+        'audio_filename': tf.constant(df['audio_filename'].values),
+        'midi_filename': tf.constant(df['midi_filename'].values),
+        'piano_model': tf.constant(np.searchsorted(piano_models, df['year'].values))
+    }
+    n_frames = int(duration * frame_rate)
+
+    policy = dict(max_polyphony=max_polyphony if filter_over_polyphony else None,
+                  drop_silent=drop_silent,
+                  silent_weight=silent_weight,
+                  min_active_ratio=min_active_ratio,
+                  min_rms=min_rms)
+    # Random segments are filtered out from their MIDI data, and from their
+    # audio only if the sampling depends on it
+    audio_policy = random_offsets and silent_weight < 1 and min_rms is not None
+
+    if random_offsets:
+        dataset = get_random_segments(df['duration'].values, n_frames, frame_rate,
+                                      num_parallel_calls=num_parallel_calls)
+    else:
+        index = get_segment_metadata(dataset_dir, df,
+                                     duration=duration,
+                                     overlap=overlap,
+                                     frame_rate=frame_rate,
+                                     max_polyphony=max_polyphony,
+                                     midi_cache=midi_cache,
+                                     with_rms=silent_weight < 1 and min_rms is not None,
+                                     sample_rate=sample_rate,
+                                     audio_cache=audio_cache,
+                                     lowest_free_voice=lowest_free_voice,
+                                     resampler=resampler)
+        # Filter out segments before any loading
+        dataset = get_indexed_segments(index, n_frames, shuffle=shuffle, **policy)
+
+    # Load segments of MIDI data
+    def load_midi(index):
+        track = {k: v[index['track_id']] for k, v in tracks.items()}
+        start = tf.cast(index['frame_offset'], tf.float64) / frame_rate
+        segment = io_utils.load_midi_segment_tf(
+            tf.strings.join([dataset_dir, track['midi_filename']]),
+            start,
+            duration,
+            max_polyphony,
+            frame_rate,
+            midi_cache=midi_cache,
+            lowest_free_voice=lowest_free_voice)
+        return dict(
+            segment,
+            start=start,
+            audio_path=tf.strings.join([dataset_dir, track['audio_filename']]),
+            piano_model=track['piano_model'][tf.newaxis],
+            filename=tf.strings.join([track['audio_filename'] + "_",
+                                      tf.as_string(index['segment_id'])])[tf.newaxis])
+
+    dataset = dataset.map(load_midi, num_parallel_calls=num_parallel_calls)
+    if random_offsets:
+        # Sampling depending on the audio is applied once it is loaded
+        dataset = filter_segments(dataset, n_frames,
+                                  **dict(policy, silent_weight=1.) if audio_policy else policy)
+
+    # Load audio of the remaining segments
+    dataset = dataset.map(
+        lambda x: dict(x, audio=io_utils.load_audio_segment_tf(x['audio_path'],
+                                                               x['start'],
+                                                               duration,
+                                                               sample_rate,
+                                                               audio_cache=audio_cache,
+                                                               resampler=resampler)),
+        num_parallel_calls=num_parallel_calls)
+    if audio_policy:
+        dataset = filter_segments(dataset, n_frames, **policy)
+    return dataset
+
+
+def get_random_segments(track_durations, n_frames, frame_rate=250, num_parallel_calls=8):
+    """Draw segment positions indefinitely, uniformly over the tracks duration.
+    Args:
+        - track_durations (n_tracks,): duration of each track (in s).
+        - n_frames (int): number of conditioning frames of the segments.
+        - frame_rate (int): number of conditioning frames per second.
+        - num_parallel_calls (int): number of threads.
+    Returns:
+        - dataset (tf.data.Dataset): 'track_id', 'frame_offset' and
+        'segment_id' of random segments.
+    """
+    # Number of valid offsets in each track
+    n_offsets = np.maximum((np.asarray(track_durations) * frame_rate).astype(np.int64) - n_frames,
+                           0) + 1
+    last_offsets = tf.constant(np.cumsum(n_offsets))
+    first_offsets = last_offsets - n_offsets
+
+    # Map random integers to a track and an offset within this track
+    def draw_segment(random_int):
+        position = random_int % last_offsets[-1]
+        track_id = tf.searchsorted(last_offsets, position[tf.newaxis], side='right')[0]
+        frame_offset = position - first_offsets[track_id]
+        return {'track_id': track_id,
+                'frame_offset': frame_offset,
+                'segment_id': frame_offset}
+
+    return tf.data.Dataset.random(seed=0).map(draw_segment,
+                                              num_parallel_calls=num_parallel_calls)
+
+
+def get_indexed_segments(index, n_frames, shuffle=True, **kwargs):
+    """Positions of the indexed segments drawn in each epoch.
+    Args:
+        - index (dict): segments index, from get_segment_metadata().
+        - n_frames (int): number of conditioning frames of the segments.
+        - shuffle (bool): shuffle the segment positions.
+        Other arguments are the same as for get_segment_weights().
+    Returns:
+        - dataset (tf.data.Dataset): 'track_id', 'frame_offset', 'segment_id'
+        and sampling 'weight' of the segments.
+    """
+    weights = get_index_weights(index, n_frames, **kwargs)
+    keep = weights > 0
+    dataset = tf.data.Dataset.from_tensor_slices(
+        dict({k: index[k][keep] for k in ('track_id', 'frame_offset', 'segment_id')},
+             weight=weights[keep]))
+    # Shuffle on segment indices
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=int(keep.sum()),
+                                  seed=0,
+                                  reshuffle_each_iteration=True)
+    # Draw down-weighted segments for this epoch
+    if np.any((weights > 0) & (weights < 1)):
+        dataset = dataset.filter(lambda x: keep_sampled(x['weight']))
+    return dataset
+
+
+def get_segment_metadata(dataset_dir,
+                         tracks,
+                         duration=3,
+                         overlap=0.5,
+                         frame_rate=250,
+                         max_polyphony=16,
+                         midi_cache=None,
+                         with_rms=False,
+                         sample_rate=16000,
+                         audio_cache=None,
+                         lowest_free_voice=False,
+                         resampler='pydub'):
+    """Index of the segments of a set of tracks, along with their properties
+    computed from the MIDI files only. Segments are laid out over the audio
+    duration of the tracks metadata, and those going beyond the conditioning
+    end are dropped, as in split_tracks_into_segments().
+    Args:
+        - dataset_dir (path): folder location of maestro-v3.0.0/
+        - tracks (pandas.DataFrame): metadata of the tracks.
+        - midi_cache (ArrayCache): optional cache of converted MIDI files.
+        - with_rms (bool): also decode the audio files for the segments RMS.
+        - sample_rate (int): audio sample rate for the RMS.
+        - audio_cache (AudioCache): optional cache of decoded audio files.
+        - lowest_free_voice (bool): assign new notes to the lowest free
+        conditioning voice instead of the next one in round-robin order.
+        - resampler ('pydub' or 'polyphase'): audio resampler for the RMS.
+        Other arguments are the same as for get_segment_index().
+    Returns:
+        - index (dict): 'track_id', 'frame_offset' and 'segment_id' of the
+        segments, and their 'max_polyphony', 'n_notes', 'active_frames',
+        'silent' and optional 'rms' properties.
+    """
+    track_ids, frame_offsets, segment_ids = get_segment_index(
+        tracks['duration'].values, duration, overlap, frame_rate)
+    n_frames = int(duration * frame_rate)
+
+    # Segment offsets of each track
+    n_segments = np.bincount(track_ids, minlength=len(tracks))
+    track_offsets = np.split(frame_offsets, np.cumsum(n_segments)[:-1])
+
+    properties = {'max_polyphony': [], 'n_notes': [], 'active_frames': [], 'silent': []}
+    if with_rms:
+        properties['rms'] = []
+    fits = []
+    for audio_filename, midi_filename, offsets in zip(tracks['audio_filename'].values,
+                                                      tracks['midi_filename'].values,
+                                                      track_offsets):
+        if len(offsets) == 0:
+            continue
+        midi = io_utils.load_midi_data(join(dataset_dir, midi_filename),
+                                       max_polyphony=max_polyphony,
+                                       frame_rate=frame_rate,
+                                       midi_cache=midi_cache,
+                                       lowest_free_voice=lowest_free_voice)
+        # Drop segments beyond the conditioning end
+        fits.append(offsets + n_frames <= len(midi['polyphony']))
+        offsets = offsets[fits[-1]]
+        if len(offsets) == 0:
+            continue
+        track_properties = io_utils.get_segment_properties(
+            midi['conditioning'], midi['polyphony'], offsets, n_frames)
+        if with_rms:
+            audio = io_utils.load_audio_as_signal(join(dataset_dir, audio_filename),
+                                                  sample_rate=sample_rate,
+                                                  audio_cache=audio_cache,
+                                                  resampler=resampler)
+            track_properties['rms'] = io_utils.get_audio_rms(
+                audio,
+                np.round(offsets * sample_rate / frame_rate).astype(np.int64),
+                int(duration * sample_rate))
+        for k in properties:
+            properties[k].append(track_properties[k])
+
+    index = {k: np.concatenate(v) if len(v) else np.zeros(0) for k, v in properties.items()}
+    fits = np.concatenate(fits) if len(fits) else np.zeros(0, dtype=bool)
+    index.update(track_id=track_ids[fits], frame_offset=frame_offsets[fits], segment_id=segment_ids[fits])
+    return index
+
+
+def get_segment_weights(segments,
+                        n_frames,
+                        max_polyphony=None,
+                        drop_silent=False,
+                        silent_weight=1.,
+                        min_active_ratio=0.1,
+                        min_rms=None):
+    """Probability of drawing segments in an epoch, where segments are filtered
+    out by their polyphony, and near-silent segments are dropped or down-
+    weighted. Same policy for indexed segments and segments of a tf.data
+    pipeline.
+    Args:
+        - segments (dict): 'max_polyphony', 'active_frames' and optional 'rms'
+        properties, as arrays of indexed segments (see
+        io_utils.get_segment_properties()) or tensors of a single segment.
+        - n_frames (int): number of conditioning frames of the segments.
+        - max_polyphony (int): filter out segments with more simultaneous
+        notes (no filtering if None).
+        - drop_silent (bool): filter out segments where no note is played.
+        - silent_weight (float): sampling probability of near-silent segments
+        (1 keeps them all, 0 drops them).
+        - min_active_ratio (float): segments holding notes over a smaller
+        ratio of their frames (e.g. only release tails) are near-silent.
+        - min_rms (float): segments with a lower audio RMS are near-silent
+        (unused if None).
+    Returns:
+        - weights (tf.Tensor): sampling probability of the segments, 0 for
+        filtered out ones.
+    """
+    keep = tf.ones_like(segments['max_polyphony'], dtype=tf.bool)
+    if max_polyphony is not None:
+        keep &= segments['max_polyphony'] <= max_polyphony
+    if drop_silent:
+        keep &= segments['max_polyphony'] > 0
+    weights = tf.cast(keep, tf.float32)
+
+    if silent_weight < 1:
+        near_silent = tf.cast(segments['active_frames'], tf.float32) < min_active_ratio * n_frames
+        if min_rms is not None:
+            near_silent |= segments['rms'] < min_rms
+        weights = tf.where(near_silent, silent_weight * weights, weights)
+    return weights
+
+
+def get_index_weights(index,
+                      n_frames,
+                      max_polyphony=None,
+                      drop_silent=False,
+                      silent_weight=1.,
+                      min_active_ratio=0.1,
+                      min_rms=None):
+    """get_segment_weights() of indexed segments, as a NumPy array.
+    Args:
+        - index (dict): segment properties, as from get_segment_metadata().
+        Other arguments are the same as for get_segment_weights().
+    Returns:
+        - weights (n_segments,): sampling probability of each segment.
+    """
+    if silent_weight < 1 and ('active_frames' not in index or (min_rms is not None and 'rms' not in index)):
+        raise ValueError("Segment activity statistics are missing from the index, "
+                         "preprocess the segment shards again.")
+    weights = get_segment_weights(index, n_frames, max_polyphony, drop_silent,
+                                  silent_weight, min_active_ratio, min_rms).numpy()
+    if silent_weight < 1:
+        eligible = get_segment_weights(index, n_frames, max_polyphony, drop_silent).numpy() > 0
+        log_sampling_savings(weights, eligible)
+    return weights
+
+
+def filter_segments(dataset,
+                    n_frames,
+                    max_polyphony=None,
+                    drop_silent=False,
+                    silent_weight=1.,
+                    min_active_ratio=0.1,
+                    min_rms=None):
+    """Draw the segments of a dataset with get_segment_weights(), computed from
+    their 'polyphony' and, for a `min_rms` policy, their 'audio'.
+    Args:
+        - dataset (tf.data.Dataset): segments dataset.
+        - n_frames (int): number of conditioning frames of the segments.
+        Other arguments are the same as for get_segment_weights().
+    Returns:
+        - dataset (tf.data.Dataset): remaining segments.
+    """
+    if max_polyphony is None and not drop_silent and silent_weight >= 1:
+        return dataset
+    with_rms = silent_weight < 1 and min_rms is not None
+
+    def get_weight(segment):
+        polyphony = segment['polyphony']
+        properties = {'max_polyphony': tf.reduce_max(polyphony),
+                      'active_frames': tf.reduce_sum(tf.cast(polyphony > 0, tf.int32))}
+        if with_rms:
+            properties['rms'] = tf.sqrt(tf.reduce_mean(tf.square(segment['audio'])))
+        return get_segment_weights(properties, n_frames, max_polyphony, drop_silent,
+                                   silent_weight, min_active_ratio, min_rms)
+
+    return dataset.filter(lambda x: keep_sampled(get_weight(x)))
+
+
+def keep_sampled(weight):
+    """Randomly keep a segment with probability `weight`."""
+    return tf.logical_or(weight >= 1., tf.random.uniform([], seed=0) < weight)
+
+
+def log_sampling_savings(weights, keep):
+    """Log the share of eligible segments skipped by the sampling policy in
+    each epoch, which saves the same share of the model and loss compute."""
+    n_eligible = int(keep.sum())
+    n_sampled = float(weights[keep].sum())
+    saved = 1. - n_sampled / n_eligible if n_eligible else 0.
+    logging.info(f"Silence-aware sampling: {n_sampled:.0f} of {n_eligible} segments "
+                 f"processed per epoch, saving {100 * saved:.1f}% of the compute.")
+
+
+def split_tracks_into_segments(dataset,
+                               duration=3,
+                               overlap=0.5,
+                               sample_rate=16000,
+                               frame_rate=250,
+                               num_parallel_calls=8,
+                               open_tracks=1):
+    """Split a dataset of full tracks into a dataset of segments.
+    Args:
+        - open_tracks (int): number of tracks whose segments are interleaved
+        (segments are read track after track if 1).
+    """
+    # Split tracks into segments, as many in audio and conditioning signals
+    def split_track(x):
+        n_segments = tf.minimum(
+            io_utils.get_n_segments(tf.shape(x['audio'])[0], duration, sample_rate, overlap),
+            io_utils.get_n_segments(tf.shape(x['conditioning'])[0], duration, frame_rate, overlap))
+        return dict(
+            x,
+            n_segments=n_segments,
+            audio=io_utils.split_sequence_tf(x['audio'], duration, sample_rate, overlap, n_segments),
+            **{k: io_utils.split_sequence_tf(x[k], duration, frame_rate, overlap, n_segments)
+               for k in ('conditioning', 'pedal', 'polyphony')})
+
+    dataset = dataset.map(split_track, num_parallel_calls=num_parallel_calls)
+
+    # Flatten the dataset with segments list into a dataset of segments
+    dataset = dataset.interleave(
+        lambda sample: tf.data.Dataset.zip(dict(
+            audio=tf.data.Dataset.from_tensor_slices(sample["audio"]),
+            conditioning=tf.data.Dataset.from_tensor_slices(sample["conditioning"]),
+            pedal=tf.data.Dataset.from_tensor_slices(sample["pedal"]),
+            polyphony=tf.data.Dataset.from_tensor_slices(sample["polyphony"]),
+            piano_model=tf.data.Dataset.from_tensor_slices(
+                tf.repeat(sample["piano_model"],
+                          repeats=sample["n_segments"])[..., tf.newaxis]
+            ),
+            filename=tf.data.Dataset.from_tensor_slices(
+                tf.strings.join([
+                    tf.repeat(
+                        sample["audio_filename"] + "_",
+                        repeats=sample["n_segments"]
+                    ),
+                    tf.as_string(tf.range(sample["n_segments"], dtype=tf.int32))
+                ])[..., tf.newaxis]
+            )
+        )),
+        cycle_length=open_tracks,
+        block_length=1
+    )
+    return dataset
+
+
+def get_segment_size(duration=3, sample_rate=16000, frame_rate=250, n_synths=16):
+    """Memory size of a segment of split_tracks_into_segments() (in bytes)."""
+    n_frames = int(duration * frame_rate)
+    n_samples = int(duration * sample_rate)
+    # float32 audio, conditioning and pedal, int32 polyphony
+    return 4 * (n_samples + n_frames * (2 * n_synths + 4 + 1))
+
+
+def get_track_mixing(filenames, batch_size=6):
+    """Measure how much a stream of segments mixes tracks.
+    Args:
+        - filenames (list): 'filename' entries of consecutive segments, as
+        '<track>_<segment index>' strings or bytes.
+        - batch_size (int): number of segments per batch.
+    Returns:
+        - mixing (dict): mean number of distinct tracks per batch
+        ('tracks_per_batch'), and ratio of consecutive segments coming from the
+        same track ('same_track_neighbors').
+    """
+    tracks = [(f.decode() if isinstance(f, bytes) else f).rsplit('_', 1)[0]
+              for f in np.ravel(filenames)]
+    n_batches = len(tracks) // batch_size
+    tracks_per_batch = [len(set(tracks[i * batch_size: (i + 1) * batch_size]))
+                        for i in range(n_batches)]
+    same_track = [a == b for a, b in zip(tracks[:-1], tracks[1:])]
+    return {'tracks_per_batch': float(np.mean(tracks_per_batch)) if n_batches else float('nan'),
+            'same_track_neighbors': float(np.mean(same_track)) if same_track else float('nan')}
+
+
+def get_shards_dir(filename, split='train'):
+    """Folder of the sharded segments of `split` if `filename` is a sharded
+    dataset (None otherwise)."""
+    for shards_dir in (join(filename, split), filename):
+        if shard_utils.is_sharded_dataset(shards_dir):
+            return shards_dir
+    return None
+
+
+def get_sharded_dataset(shards_dir,
+                        duration=3,
+                        shuffle=True,
+                        sample_rate=16000,
+                        frame_rate=250,
+                        max_polyphony=16,
+                        filter_over_polyphony=True,
+                        drop_silent=False,
+                        silent_weight=1.,
+                        min_active_ratio=0.1,
+                        min_rms=None,
+                        num_parallel_calls=8,
+                        num_workers=1,
+                        worker_index=0,
+                        lowest_free_voice=False):
+    """Read pre-cut segments from TFRecord shards, written by
+    preprocess_data_into_shards(), with parallel interleaved reads. Segments
+    filtered out from the shards index are skipped before being parsed.
+    Args:
+        - shards_dir (path): folder of the shards and their metadata.
+        - num_workers (int): number of workers reading the dataset.
+        - worker_index (int): index of this worker, which only reads its
+        deterministic subset of the shards.
+        Other arguments are the same as for get_dataset(), and must match the
+        preprocessing ones.
+    Returns:
+        - dataset (tf.data.Dataset): segments dataset
+    """
+    metadata = shard_utils.read_metadata(shards_dir)
+    expected = {'duration': duration,
+                'sample_rate': sample_rate,
+                'frame_rate': frame_rate,
+                'max_polyphony': max_polyphony,
+                'lowest_free_voice': lowest_free_voice}
+    # Shards of earlier versions were assigned voices in round-robin order
+    metadata.setdefault('lowest_free_voice', False)
+    for k, v in expected.items():
+        if metadata[k] != v:
+            raise ValueError(f"Shards in {shards_dir} were preprocessed with "
+                             f"{k}={metadata[k]}, but {k}={v} was requested.")
+
+    # Eligible segments, in writing order
+    segments_per_shard = metadata['segments_per_shard']
+    shards = shard_utils.list_shards(shards_dir)
+    index = shard_utils.read_index(shards_dir)
+    weights = np.ones(metadata['n_segments'], dtype=np.float32)
+    if index is not None:
+        weights = get_index_weights(index, int(duration * frame_rate),
+                                    max_polyphony=max_polyphony if filter_over_polyphony else None,
+                                    drop_silent=drop_silent,
+                                    silent_weight=silent_weight,
+                                    min_active_ratio=min_active_ratio,
+                                    min_rms=min_rms)
+    elif silent_weight < 1:
+        raise ValueError(f"Silence-aware sampling requires the index of {shards_dir}.")
+    weights = np.pad(weights, (0, len(shards) * segments_per_shard - len(weights)))
+    # Skip shards without any eligible segment
+    shard_ids = np.flatnonzero((weights > 0).reshape(len(shards), segments_per_shard).any(axis=-1))
+
+    files = tf.data.Dataset.from_tensor_slices((np.array(shards)[shard_ids], shard_ids))
+    # Each worker reads a fixed subset of shards
+    if num_workers > 1:
+        files = files.shard(num_workers, worker_index)
+    if shuffle:
+        files = files.shuffle(buffer_size=len(shard_ids),
+                              seed=0,
+                              reshuffle_each_iteration=True)
+
+    weights = tf.constant(weights)
+    dataset = files.interleave(
+        lambda shard, shard_id: tf.data.TFRecordDataset(shard).enumerate().filter(
+            lambda i, _: keep_sampled(weights[shard_id * segments_per_shard + i])).map(lambda _, x: x),
+        cycle_length=num_parallel_calls,
+        num_parallel_calls=num_parallel_calls,
+        deterministic=not shuffle)
+    dataset = dataset.map(
+        partial(shard_utils.parse_segment,
+                n_samples=int(duration * sample_rate),
+                n_frames=int(duration * frame_rate),
+                n_synths=max_polyphony),
+        num_parallel_calls=num_parallel_calls)
+
+    # Mix segments of the interleaved shards
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=metadata['segments_per_shard'],
+                                  seed=0,
+                                  reshuffle_each_iteration=True)
+    return dataset
+
+
+def get_padded_shapes(duration=3, sample_rate=16000, frame_rate=250, max_polyphony=16):
+    """Shapes of the segment entries batched by get_dataset()."""
+    n_frames  = int(duration * frame_rate)
+    n_samples = int(duration * sample_rate)
+    return {"conditioning": tf.TensorShape([n_frames, max_polyphony, 2]),
+            "pedal": tf.TensorShape([n_frames, 4]),
+            "audio": tf.TensorShape([n_samples, ]),
+            "piano_model": tf.TensorShape([1, ]),
+            "filename": tf.TensorShape([1, ])}
+
+
+def get_n_voices(conditioning):
+    """Number of voices used in a segment conditioning, up to the last one
+    playing a note."""
+    n_synths = tf.shape(conditioning)[1]
+    used = tf.reduce_any(conditioning[..., 0] > 0, axis=0)
+    return tf.reduce_max(tf.where(used, tf.range(1, n_synths + 1), 0))
+
+
+def batch_by_polyphony(dataset, batch_size, buckets, max_polyphony, padded_shapes):
+    """Group segments into batches of a same polyphony bucket, where voices
+    beyond the bucket size are cropped from the conditioning.
+    Args:
+        - dataset (tf.data.Dataset): segments dataset.
+        - batch_size (int): number of segments per batch.
+        - buckets (list): numbers of voices of the buckets.
+        - max_polyphony (int): number of voices of the segments conditioning.
+        - padded_shapes (dict): segments shapes, as for padded_batch().
+    Returns:
+        - dataset (tf.data.Dataset): batches with a variable voices axis.
+    """
+    buckets = sorted({min(b, max_polyphony) for b in buckets} | {max_polyphony})
+    buckets = tf.constant(buckets, dtype=tf.int32)
+
+    def get_bucket(segment):
+        n_voices = get_n_voices(segment['conditioning'])
+        return tf.cast(tf.searchsorted(buckets, n_voices[tf.newaxis])[0], tf.int64)
+
+    def make_batch(bucket, segments):
+        segments = segments.padded_batch(batch_size,
+                                         padded_shapes=padded_shapes,
+                                         drop_remainder=True)
+        return segments.map(
+            lambda x: dict(x, conditioning=x['conditioning'][:, :, :buckets[bucket]]))
+
+    return dataset.group_by_window(key_func=get_bucket,
+                                   reduce_func=make_batch,
+                                   window_size=batch_size)
+
+
 def get_dataset(filename,
                 split='train',
                 year=None,
@@ -127,18 +834,36 @@ def get_dataset(filename,
                 max_polyphony=16,
                 filter_over_polyphony=True,
                 num_parallel_calls=8,
+                cache_dir=None,
+                cache_max_size=None,
+                cache_audio_dtype='float32',
+                segment_index=False,
+                random_offsets=False,
+                num_workers=1,
+                worker_index=0,
+                drop_silent=False,
+                silent_weight=1.,
+                min_active_ratio=0.1,
+                min_rms=None,
+                shuffle_buffer_size=512 * 2 ** 20,
+                open_tracks=8,
+                decode_workers=0,
+                batch_cache=None,
+                polyphony_buckets=None,
+                lowest_free_voice=None,
+                resampler=None,
                 **kwargs):
     """Tensorflow dataset pipeline for feeding the training with conditioning
     MIDI inputs and audio target outputs. Automatically splits full tracks into
     segments.
     Args:
         - filename (str): path to the maestro-v3.0.0/ folder OR a preprocessed
-        .tfrecord file.
+        .tfrecord file OR a folder of preprocessed segment shards.
         - split (str): which dataset subset to use (among 'train', 'validation'
         and 'test').
         - duration (float): duration of audio segments (in s).
         - batch_size (int): number of segments per batch.
-        - shuffle (bool): apply shuffling between tracks.
+        - shuffle (bool): apply shuffling between tracks and segments.
         - infinite_generator (bool): provide data indefinitely.
         - sample_rate (int): number of audio samples per second.
         - frame_rate (int): number of conditioning input frames per second.
@@ -146,19 +871,165 @@ def get_dataset(filename,
         than the model polyphonic capacity. Does not filter anything if set to
         `None`.
         - num_parallel_calls (int): number of threads.
+        - cache_dir (path): folder for caching converted MIDI files and decoded
+        audio across epochs and runs (no caching if None).
+        - cache_max_size (int): size budget of each cache (in bytes).
+        - cache_audio_dtype ('float32' or 'int16'): decoded audio storage.
+        - segment_index (bool): read segments lazily from an index of segment
+        positions instead of splitting full tracks (maestro folder only).
+        - random_offsets (bool): with segment_index and infinite_generator,
+        draw segments at random offsets instead of the `overlap` layout.
+        - num_workers (int): number of workers reading segment shards.
+        - worker_index (int): index of this worker among them.
+        - drop_silent (bool): filter out segments where no note is played.
+        - silent_weight (float): probability of drawing near-silent segments
+        in an epoch, i.e. segments holding notes over less than
+        min_active_ratio of their frames or with an audio RMS below min_rms
+        (1 keeps them all, 0 drops them).
+        - min_active_ratio (float): active frames ratio of near-silent segments.
+        - min_rms (float): audio RMS of near-silent segments (unused if None).
+        - shuffle_buffer_size (int): memory budget of the segments shuffle
+        buffer when splitting full tracks (in bytes).
+        - open_tracks (int): number of tracks interleaved when shuffling
+        segments of full tracks.
+        - decode_workers (int): number of processes decoding full tracks
+        (decoding in the main process if 0, one per core if None).
+        - batch_cache ('memory' or path): keep the batches of a finite and
+        unshuffled dataset after its first pass, in memory or in a cache file
+        of this folder keyed by the dataset configuration (no caching if None).
+        - polyphony_buckets (list): group segments into batches by number of
+        used voices, and crop the conditioning voices axis to the smallest
+        bucket size holding them (e.g. (4, 8, 16)).
+        - lowest_free_voice (bool): assign new notes to the lowest free
+        conditioning voice instead of the next one in round-robin order, so
+        that segments only use as many voices as their polyphony requires
+        (enabled with polyphony_buckets if None). Preprocessed shards and
+        .tfrecord files must be written with the same option.
+        - resampler ('pydub' or 'polyphase'): audio resampler, polyphase for
+        a store written by preprocess_data_into_store() and pydub otherwise if
+        None.
     Returns:
         - dataset (tf.data.Dataset): segments dataset
     """
-    # Shapes definition
-    n_frames  = int(duration * frame_rate)
-    n_samples = int(duration * sample_rate)
-
-    conditioning_shape = [n_frames, max_polyphony, 2]
-    pedal_shape        = [n_frames, 4]
-    piano_model_shape  = [1, ]
-    audio_shape        = [n_samples, ]
+    if lowest_free_voice is None:
+        lowest_free_voice = bool(polyphony_buckets)
+    policy = dict(max_polyphony=max_polyphony,
+                  filter_over_polyphony=filter_over_polyphony,
+                  drop_silent=drop_silent,
+                  silent_weight=silent_weight,
+                  min_active_ratio=min_active_ratio,
+                  min_rms=min_rms)
 
     # Data loading
+    shards_dir = get_shards_dir(filename, split)
+    if shards_dir is not None:
+        # Read pre-cut segments from shards
+        dataset = get_sharded_dataset(shards_dir,
+                                      duration=duration,
+                                      shuffle=shuffle,
+                                      sample_rate=sample_rate,
+                                      frame_rate=frame_rate,
+                                      num_parallel_calls=num_parallel_calls,
+                                      num_workers=num_workers,
+                                      worker_index=worker_index,
+                                      lowest_free_voice=lowest_free_voice,
+                                      **policy)
+    elif segment_index and ".tfrecord" not in filename:
+        # Slice segments lazily from an index of segment positions
+        dataset = get_segment_dataset(
+            dataset_dir=filename,
+            split=split,
+            year=year,
+            duration=duration,
+            overlap=overlap,
+            shuffle=shuffle,
+            random_offsets=random_offsets and infinite_generator,
+            sample_rate=sample_rate,
+            frame_rate=frame_rate,
+            num_parallel_calls=num_parallel_calls,
+            cache_dir=cache_dir,
+            cache_max_size=cache_max_size,
+            cache_audio_dtype=cache_audio_dtype,
+            lowest_free_voice=lowest_free_voice,
+            resampler=resampler,
+            **policy,
+            **kwargs
+        )
+    else:
+        # Split full tracks into segments
+        dataset = get_track_segments_dataset(
+            filename,
+            split=split,
+            year=year,
+            duration=duration,
+            overlap=overlap,
+            shuffle=shuffle,
+            sample_rate=sample_rate,
+            frame_rate=frame_rate,
+            num_parallel_calls=num_parallel_calls,
+            cache_dir=cache_dir,
+            cache_max_size=cache_max_size,
+            cache_audio_dtype=cache_audio_dtype,
+            shuffle_buffer_size=shuffle_buffer_size,
+            open_tracks=open_tracks,
+            decode_workers=decode_workers,
+            lowest_free_voice=lowest_free_voice,
+            resampler=resampler,
+            **policy,
+            **kwargs
+        )
+
+    dataset = batch_segments(dataset,
+                             batch_size,
+                             get_padded_shapes(duration, sample_rate, frame_rate, max_polyphony),
+                             infinite_generator=infinite_generator,
+                             polyphony_buckets=polyphony_buckets,
+                             max_polyphony=max_polyphony,
+                             num_parallel_calls=num_parallel_calls)
+    # Cache batches of deterministic pipelines
+    if batch_cache is not None:
+        if shuffle or infinite_generator or 0 < silent_weight < 1:
+            raise ValueError("Only finite, unshuffled and unsampled datasets can be cached.")
+        key = ArrayCache.get_key(filename, split, year, duration, overlap, batch_size,
+                                 sample_rate, frame_rate, max_polyphony,
+                                 filter_over_polyphony, drop_silent, segment_index,
+                                 silent_weight, min_active_ratio, min_rms,
+                                 lowest_free_voice, resampler)
+        dataset = cache_batches(dataset, batch_cache, f"{split}_{key}")
+
+    # Prefetch next batches
+    dataset = dataset.prefetch(4)
+    return dataset.with_options(get_sharding_options(shards_dir is not None, num_workers))
+
+
+def get_track_segments_dataset(filename,
+                               split='train',
+                               year=None,
+                               duration=3,
+                               overlap=0.5,
+                               shuffle=True,
+                               sample_rate=16000,
+                               frame_rate=250,
+                               max_polyphony=16,
+                               filter_over_polyphony=True,
+                               drop_silent=False,
+                               silent_weight=1.,
+                               min_active_ratio=0.1,
+                               min_rms=None,
+                               num_parallel_calls=8,
+                               shuffle_buffer_size=512 * 2 ** 20,
+                               open_tracks=8,
+                               **kwargs):
+    """Dataset of segments split from full tracks, loaded from a preprocessed
+    .tfrecord file or processed on the fly from a maestro-v3.0.0/ folder.
+    Args:
+        - filename (str): path to the maestro-v3.0.0/ folder OR a preprocessed
+        .tfrecord file.
+        Other arguments are the same as for get_preprocessed_dataset() and
+        get_dataset().
+    Returns:
+        - dataset (tf.data.Dataset): segments dataset
+    """
     if ".tfrecord" in filename:
         # Load preprocessed data from the .tfrecord
         dataset = tf.data.Dataset.load(filename)
@@ -172,74 +1043,59 @@ def get_dataset(filename,
             frame_rate=frame_rate,
             max_polyphony=max_polyphony,
             num_parallel_calls=num_parallel_calls,
+            shuffle=shuffle,
             **kwargs
         )
-    # Shuffle on tracks
+    # Split tracks into segments, interleaved between a few open tracks
+    dataset = split_tracks_into_segments(dataset,
+                                         duration=duration,
+                                         overlap=overlap,
+                                         sample_rate=sample_rate,
+                                         frame_rate=frame_rate,
+                                         num_parallel_calls=num_parallel_calls,
+                                         open_tracks=open_tracks if shuffle else 1)
+
+    # Filter out segments by polyphony, and drop or down-weight near-silent
+    # segments
+    dataset = filter_segments(dataset, int(duration * frame_rate),
+                              max_polyphony=max_polyphony if filter_over_polyphony else None,
+                              drop_silent=drop_silent,
+                              silent_weight=silent_weight,
+                              min_active_ratio=min_active_ratio,
+                              min_rms=min_rms)
+
+    # Shuffle on segments, within a fixed memory budget
     if shuffle:
-        dataset = dataset.shuffle(buffer_size=len(dataset) // 2,
+        segment_size = get_segment_size(duration, sample_rate, frame_rate, max_polyphony)
+        buffer_size = max(1, shuffle_buffer_size // segment_size)
+        logging.info(f"Segments shuffle buffer: {buffer_size} segments "
+                     f"({buffer_size * segment_size / 2 ** 20:.1f} MB), "
+                     f"interleaved from {open_tracks} tracks.")
+        dataset = dataset.shuffle(buffer_size=buffer_size,
                                   seed=0,
                                   reshuffle_each_iteration=True)
+    return dataset
 
-    # Split tracks into segments
-    dataset = dataset.map(
-        lambda x: dict(
-            x,
-            audio=io_utils.split_sequence_tf(x['audio'], duration, sample_rate, overlap=overlap),
-            conditioning=io_utils.split_sequence_tf(x['conditioning'], duration, frame_rate, overlap=overlap),
-            pedal=io_utils.split_sequence_tf(x['pedal'], duration, frame_rate, overlap=overlap),
-            polyphony=io_utils.split_sequence_tf(x['polyphony'], duration, frame_rate, overlap=overlap)),
-        num_parallel_calls=num_parallel_calls)
-
-    # Fix border issue
-    dataset = dataset.map(
-        lambda sample: dict(
-            sample,
-            n_segments=tf.reduce_min([len(sample["audio"]),
-                                      len(sample["conditioning"])])),
-        num_parallel_calls=num_parallel_calls)
-
-    # Flatten the dataset with segments list into a dataset of segments
-    dataset = dataset.flat_map(
-        lambda sample: tf.data.Dataset.zip(dict(
-            audio=tf.data.Dataset.from_tensor_slices(
-                sample["audio"][:sample["n_segments"]]
-            ),
-            conditioning=tf.data.Dataset.from_tensor_slices(
-                sample["conditioning"][:sample["n_segments"]]
-            ),
-            pedal=tf.data.Dataset.from_tensor_slices(
-                sample["pedal"][:sample["n_segments"]]
-            ),
-            polyphony=tf.data.Dataset.from_tensor_slices(
-                sample["polyphony"][:sample["n_segments"]]
-            ),
-            piano_model=tf.data.Dataset.from_tensor_slices(
-                tf.repeat(sample["piano_model"],
-                          repeats=sample["n_segments"])[..., tf.newaxis]
-            ),
-            filename=tf.data.Dataset.from_tensor_slices(
-                tf.strings.join([
-                    tf.repeat(
-                        sample["audio_filename"] + "_",
-                        repeats=sample["n_segments"]
-                    ),
-                    tf.as_string(tf.range(sample["n_segments"], dtype=tf.int32))
-                ])[..., tf.newaxis]
-            )
-        ))
-    )
-    # Filter out segments with polyphony exceeding supported polyphony
-    if filter_over_polyphony:
-        dataset = dataset.filter(
-            lambda x: tf.reduce_max(x["polyphony"]) <= max_polyphony)
 
+def batch_segments(dataset,
+                   batch_size,
+                   padded_shapes,
+                   infinite_generator=True,
+                   polyphony_buckets=None,
+                   max_polyphony=16,
+                   num_parallel_calls=8):
+    """Batch the model entries of a segments dataset.
+    Args:
+        - dataset (tf.data.Dataset): segments dataset.
+        - batch_size (int): number of segments per batch.
+        - padded_shapes (dict): segments shapes, from get_padded_shapes().
+        Other arguments are the same as for get_dataset().
+    Returns:
+        - dataset (tf.data.Dataset): batches dataset.
+    """
     # Keep relevant entries
     dataset = dataset.map(
-        lambda x: {k: x[k] for k in ['audio',
-                                     'conditioning',
-                                     'pedal',
-                                     'piano_model',
-                                     'filename']},
+        lambda x: {k: x[k] for k in padded_shapes},
         num_parallel_calls=num_parallel_calls)
 
     # Infinite generator
@@ -247,24 +1103,75 @@ def get_dataset(filename,
         dataset = dataset.repeat(count=-1)
 
     # Make batch
-    dataset = dataset.padded_batch(
+    if polyphony_buckets:
+        return batch_by_polyphony(dataset,
+                                  batch_size,
+                                  buckets=polyphony_buckets,
+                                  max_polyphony=max_polyphony,
+                                  padded_shapes=padded_shapes)
+    return dataset.padded_batch(
         batch_size,
-        padded_shapes={"conditioning": tf.TensorShape(conditioning_shape),
-                       "pedal": tf.TensorShape(pedal_shape),
-                       "audio": tf.TensorShape(audio_shape),
-                       "piano_model": tf.TensorShape(piano_model_shape),
-                       "filename": tf.TensorShape([1, ])},
+        padded_shapes=padded_shapes,
         drop_remainder=True
     )
-    # Prefetch next batches
-    dataset = dataset.prefetch(4)
 
-    # Sharding options
+
+def cache_batches(dataset, batch_cache, name):
+    """Keep the batches of a dataset after its first pass, in memory if
+    `batch_cache` is 'memory', otherwise in the `name` cache file of the
+    `batch_cache` folder."""
+    if batch_cache == 'memory':
+        return dataset.cache()
+    tf.io.gfile.makedirs(batch_cache)
+    return dataset.cache(join(batch_cache, name))
+
+
+def get_sharding_options(sharded, num_workers=1):
+    """Distribution options of a dataset: shards are split by file between
+    workers, unless already split by worker_index, and other datasets are
+    split by data."""
     options = tf.data.Options()
-    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
-    dataset = dataset.with_options(options)
+    if not sharded:
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+    elif num_workers > 1:
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    else:
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.FILE
+    return options
 
-    return dataset
+
+def get_service_dataset(service_address,
+                        dataset_id='train',
+                        job_name=None,
+                        trainer_id=None):
+    """Read batches from a dataset registered on a tf.data service (see
+    data_service.py) instead of processing them locally. The dispatcher hands
+    out disjoint parts of the dataset (shard files or index entries) to its
+    workers.
+    Args:
+        - service_address (str): dispatcher address, as 'grpc://host:port'.
+        - dataset_id (str): id of the registered dataset.
+        - job_name (str): trainers of a same job share the dataset processing.
+        - trainer_id (str): unique id of the trainer among those sharing the
+        job. With a trainer id, each trainer reads all batches from a shared
+        cache (e.g. for hyperparameter sweeps), otherwise batches are split
+        between trainers.
+    Returns:
+        - dataset (tf.data.Dataset): batches dataset.
+    """
+    cross_trainer_cache = None
+    if trainer_id is not None:
+        if job_name is None:
+            raise ValueError("A job_name is required for sharing batches between trainers.")
+        cross_trainer_cache = tf.data.experimental.service.CrossTrainerCache(trainer_id)
+
+    dataset = tf.data.experimental.service.from_dataset_id(
+        processing_mode=tf.data.experimental.service.ShardingPolicy.DYNAMIC,
+        service=service_address,
+        dataset_id=dataset_id,
+        job_name=job_name,
+        cross_trainer_cache=cross_trainer_cache)
+    return dataset.prefetch(4)
 
 
 def single_track_dataset(midi_filename,
@@ -296,20 +1203,15 @@ def single_track_dataset(midi_filename,
     )
     # Split track into multiple segments
     if len(conditioning) / float(frame_rate) > duration:
-        audio        = io_utils.split_sequence_tf(audio, duration, sample_rate)
-        conditioning = io_utils.split_sequence_tf(conditioning, duration, frame_rate)
-        pedal        = io_utils.split_sequence_tf(pedal, duration, frame_rate)
-        polyphony    = io_utils.split_sequence_tf(polyphony, duration, frame_rate)
+        n_segments = min(io_utils.get_n_segments(len(audio), duration, sample_rate),
+                         io_utils.get_n_segments(len(conditioning), duration, frame_rate))
 
-        n_segments = min(len(audio), len(conditioning))
-
-        dataset = {"audio": audio,
-                   "conditioning": conditioning,
-                   "pedal": pedal,
-                   "polyphony": polyphony}
-        # Fix border issue
-        for k in dataset.keys():
-            dataset[k] = dataset[k][:n_segments]
+        dataset = {"audio": io_utils.split_sequence_tf(audio, duration, sample_rate, n_segments=n_segments),
+                   "conditioning": io_utils.split_sequence_tf(conditioning, duration, frame_rate,
+                                                              n_segments=n_segments),
+                   "pedal": io_utils.split_sequence_tf(pedal, duration, frame_rate, n_segments=n_segments),
+                   "polyphony": io_utils.split_sequence_tf(polyphony, duration, frame_rate,
+                                                           n_segments=n_segments)}
 
     else:  # Single segment available
         dataset = {"audio": [io_utils.ensure_sequence_length(audio, int(duration * sample_rate)), ],
@@ -365,3 +1267,132 @@ def preprocess_data_into_tfrecord(filename, **kwargs):
     ``` """
     dataset = get_preprocessed_dataset(**kwargs)
     dataset.save(filename)
+
+
+def preprocess_data_into_shards(out_dir,
+                                dataset_dir,
+                                split='train',
+                                duration=3,
+                                overlap=0.5,
+                                sample_rate=16000,
+                                frame_rate=250,
+                                max_polyphony=16,
+                                segments_per_shard=512,
+                                num_parallel_calls=8,
+                                lowest_free_voice=False,
+                                **kwargs):
+    """Cut a maestro dataset split into segments, and save them into fixed-size
+    TFRecord shards along with an index of their properties.
+    Typical usage would be:
+    ```
+    preprocess_data_into_shards(
+        </export/path/split>,
+        dataset_dir=<path/to/base_dataset>,
+        split='train',
+        ...
+    )
+    ```
+    Returns:
+        - n_segments (int): number of written segments.
+    """
+    dataset = get_preprocessed_dataset(dataset_dir,
+                                       split=split,
+                                       sample_rate=sample_rate,
+                                       frame_rate=frame_rate,
+                                       max_polyphony=max_polyphony,
+                                       num_parallel_calls=num_parallel_calls,
+                                       lowest_free_voice=lowest_free_voice,
+                                       **kwargs)
+    dataset = split_tracks_into_segments(dataset,
+                                         duration=duration,
+                                         overlap=overlap,
+                                         sample_rate=sample_rate,
+                                         frame_rate=frame_rate,
+                                         num_parallel_calls=num_parallel_calls)
+    writer = shard_utils.ShardWriter(out_dir,
+                                     segments_per_shard=segments_per_shard,
+                                     metadata={'split': split,
+                                               'duration': duration,
+                                               'overlap': overlap,
+                                               'sample_rate': sample_rate,
+                                               'frame_rate': frame_rate,
+                                               'max_polyphony': max_polyphony,
+                                               'lowest_free_voice': lowest_free_voice})
+    for segment in dataset.as_numpy_iterator():
+        properties = io_utils.get_segment_properties(segment['conditioning'],
+                                                     segment['polyphony'])
+        properties['rms'] = io_utils.get_audio_rms(segment['audio'])
+        writer.write(dict(segment, **{k: v[0] for k, v in properties.items()}))
+    writer.close()
+    return writer.n_segments
+
+
+def preprocess_data_into_store(out_dir, dataset_dir, split=None, year=None, workers=None, **kwargs):
+    """Convert maestro tracks into a rate-agnostic store: mono PCM audio at its
+    original sample rate, and MIDI notes (with sustain applied) and control
+    changes as events. The store is read as a maestro-v3.0.0/ folder by
+    get_dataset(), where audio is resampled and conditioning is built at the
+    requested sample_rate and frame_rate.
+    Tracks are converted in parallel, and recorded in a manifest along with the
+    hashes of their source files as soon as they are done. Running again on an
+    existing store only converts tracks that are new, changed, or were not
+    finished by an interrupted run.
+    Typical usage would be:
+    ```
+    preprocess_data_into_store(
+        </export/path>,
+        dataset_dir=<path/to/base_dataset>,
+        ...
+    )
+    ```
+    Args:
+        - workers (int): number of converting processes (one per core if None,
+        converting in the main process if 0).
+    Returns:
+        - n_converted (int): number of converted tracks.
+        - n_tracks (int): number of tracks in the store.
+    """
+    df = io_utils.metadata_from_csv(join(dataset_dir, "maestro-v3.0.0.csv"),
+                                    split=split,
+                                    year=year,
+                                    **kwargs)
+    # Drop unreadable entries of an interrupted run
+    manifest = store_utils.read_manifest(out_dir)
+    store_utils.write_manifest(out_dir, manifest)
+
+    rows = {row['audio_filename']: row for row in df.to_dict('records')}
+    tasks = []
+    for audio_filename, row in rows.items():
+        audio_out, midi_out = store_utils.get_store_filenames(audio_filename, row['midi_filename'])
+        tasks.append((join(dataset_dir, audio_filename),
+                      join(dataset_dir, row['midi_filename']),
+                      out_dir,
+                      audio_out,
+                      midi_out,
+                      manifest.get(audio_filename)))
+
+    n_converted, n_done, hours = 0, 0, 0.
+    start_time = time.time()
+    for task, hashes in imap_unordered(store_utils.update_track, tasks, workers):
+        n_done += 1
+        if hashes is None:
+            continue
+        audio_filename = task[0][len(join(dataset_dir, '')):]
+        entry = dict(hashes,
+                     source=audio_filename,
+                     row=dict(rows[audio_filename], audio_filename=task[3], midi_filename=task[4]))
+        store_utils.append_manifest(out_dir, entry)
+        manifest[audio_filename] = entry
+
+        n_converted += 1
+        hours += rows[audio_filename]['duration'] / 3600
+        elapsed = time.time() - start_time
+        logging.info(f"Converted {audio_filename} ({n_done}/{len(tasks)}): "
+                     f"{n_converted / elapsed:.2f} tracks/s, {60 * hours / elapsed:.2f} hours of audio/min")
+    logging.info(f"{n_converted} tracks converted, {len(tasks) - n_converted} up to date, "
+                 f"in {time.time() - start_time:.1f}s")
+
+    # Tracks metadata, with the ones of previous runs
+    with tf.io.gfile.GFile(join(out_dir, "maestro-v3.0.0.csv"), 'w') as f:
+        pd.DataFrame([entry['row'] for entry in manifest.values()]).to_csv(f, index=False)
+    return n_converted, len(manifest)
@@ -46,44 +46,180 @@ def get_inharmonic_freq(f0_hz, inharm_coef, n_harmonics):
     return inharmonic_freq, harmonic_shifts
 
 
+def get_frame_rate_phases(frequencies, n_samples, sample_rate=16000, initial_phase=None):
+    """Phases of oscillators with frequencies linearly interpolated between
+    frames, as by core.resample(). The phase is accumulated at frame rate in
+    float64 and evaluated in closed form within frames, instead of a
+    cumulative sum over all samples.
+    Args:
+        - frequencies (b, n_frames, n_sins): frame-wise oscillators
+        frequencies.
+        - n_samples (int): number of audio samples, a multiple of n_frames.
+        - sample_rate (int)
+        - initial_phase (b, 1, n_sins): phase before the first sample.
+    Returns:
+        - phases (b, n_samples, n_sins): accumulated phases.
+    """
+    n_frames = int(frequencies.shape[1])
+    if n_samples % n_frames != 0:
+        raise ValueError(f"Frame rate phases need a whole number of samples per frame "
+                         f"({n_samples} samples, {n_frames} frames).")
+    upsampling = n_samples // n_frames
+
+    # Angular frequency at each frame and its increment until the next one,
+    # the last frame being held (rad / sample)
+    omegas = tf.cast(frequencies, tf.float64) * (2.0 * pi / sample_rate)
+    deltas = tf.concat([omegas[:, 1:] - omegas[:, :-1], tf.zeros_like(omegas[:, :1])], axis=1)
+
+    # Phase at the start of each frame
+    frame_phases = tf.cumsum(upsampling * omegas + (upsampling - 1) / 2 * deltas, axis=1, exclusive=True)
+    if initial_phase is not None:
+        frame_phases += tf.cast(initial_phase, tf.float64)
+    frame_phases = tf.cast(frame_phases % (2.0 * pi), tf.float32)
+
+    # Phase within each frame, after r + 1 samples
+    steps = tf.range(1., upsampling + 1.)[:, tf.newaxis]
+    ramps = steps * (steps - 1.) / (2. * upsampling)
+    phases = frame_phases[:, :, tf.newaxis] + \
+        tf.cast(omegas, tf.float32)[:, :, tf.newaxis] * steps + \
+        tf.cast(deltas, tf.float32)[:, :, tf.newaxis] * ramps
+    return tf.reshape(phases, [-1, n_samples, phases.shape[-1]])
+
+
 def cos_oscillator_bank(frequency_envelopes,
                         amplitude_envelopes,
                         sample_rate=16000,
                         sum_sinusoids=True,
-                        use_angular_cumsum=False):
+                        use_angular_cumsum=False,
+                        phases=None):
     """Bank of additive cosine oscillators. Contrary to sinuses, harmonic
     cosinuses are synchronized at peaks.
     Args:
         - frequency_envelopes (b, n_samples, n_sins): oscillators frequencies
-        - amplitude_envelopes (b, n_samples, n_sins): oscillators amplitudes
+        - amplitude_envelopes (b, n_samples, n_sins): oscillators amplitudes,
+        or (b, n_samples, n_sins / n_groups) amplitudes shared by groups of
+        oscillators (e.g. partials of substrings) which are summed.
         - sample_rate (int)
         - sum_sinusoids (bool): reduce sum all oscillators signals.
         - use_angular_cumsum (book): enables chunk-wise cumsum to avoid ac-
         cumulationn errors.
+        - phases (b, n_samples, n_sins): precomputed oscillators phases,
+        accumulated from the frequencies if None.
     """
-    # Don't exceed Nyquist.
-    amplitude_envelopes = core.remove_above_nyquist(frequency_envelopes,
-                                                    amplitude_envelopes,
-                                                    sample_rate)
-    # Angular frequency, Hz -> radians per sample.
-    omegas = frequency_envelopes * (2.0 * pi)  # rad / sec
-    omegas = omegas / float(sample_rate)  # rad / sample
-
-    # Accumulate phase and synthesize.
-    if use_angular_cumsum:
-        # Avoids accumulation errors.
-        phases = core.angular_cumsum(omegas)
-    else:
-        phases = tf.cumsum(omegas, axis=1)
+    n_groups = int(frequency_envelopes.shape[-1]) // int(amplitude_envelopes.shape[-1])
+    if n_groups > 1 and not sum_sinusoids:
+        raise ValueError("Groups of oscillators sharing amplitudes are always summed.")
+    if n_groups == 1:
+        # Don't exceed Nyquist.
+        amplitude_envelopes = core.remove_above_nyquist(frequency_envelopes,
+                                                        amplitude_envelopes,
+                                                        sample_rate)
+    if phases is None:
+        # Angular frequency, Hz -> radians per sample.
+        omegas = frequency_envelopes * (2.0 * pi)  # rad / sec
+        omegas = omegas / float(sample_rate)  # rad / sample
+
+        # Accumulate phase and synthesize.
+        if use_angular_cumsum:
+            # Avoids accumulation errors.
+            phases = core.angular_cumsum(omegas)
+        else:
+            # Groups are accumulated separately, as cumulative sums over
+            # many channels are slower than over each group on CPU
+            phases = tf.concat([tf.cumsum(x, axis=1) for x in tf.split(omegas, n_groups, axis=-1)],
+                               axis=-1)
 
     # Convert to waveforms.
     wavs = tf.cos(phases)
+    if n_groups > 1:
+        # Don't exceed Nyquist and sum groups before applying their amplitudes
+        wavs = core.remove_above_nyquist(frequency_envelopes, wavs, sample_rate)
+        wavs = tf.reshape(wavs, tf.concat([tf.shape(wavs)[:2], [n_groups, -1]], axis=0))
+        wavs = tf.reduce_sum(wavs, axis=2)
     audio = amplitude_envelopes * wavs  # [b, n_samples, n_sinusoids]
     if sum_sinusoids:
         audio = tf.reduce_sum(audio, axis=-1)  # [b, n_samples]
     return audio
 
 
+def chunked_oscillator_bank(frequencies,
+                            amplitudes,
+                            n_samples=64000,
+                            sample_rate=16000,
+                            amp_resample_method='window',
+                            chunk_frames=50,
+                            frame_rate_phase=False):
+    """Bank of additive cosine oscillators synthesized by chunks of frames,
+    carrying the phase between chunks. Sample-wise envelopes are only created
+    for one chunk at a time, and recomputed for the gradients, so that memory
+    is bounded by the chunk size instead of the signal length.
+    Args:
+        - frequencies (b, n_frames, n_sins): frame-wise oscillators
+        frequencies.
+        - amplitudes (b, n_frames, n_sins): frame-wise oscillators amplitudes,
+        shared by groups of frequencies if they have fewer oscillators.
+        - n_samples (int): number of audio samples, a multiple of n_frames.
+        - sample_rate (int)
+        - amp_resample_method (str): mode with which to resample envelopes.
+        - chunk_frames (int): number of frames per chunk.
+        - frame_rate_phase (bool): accumulate phase with
+        get_frame_rate_phases() instead of a cumulative sum over samples.
+    Returns:
+        - audio (b, n_samples): sum of all oscillators signals.
+    """
+    n_frames = int(frequencies.shape[1])
+    if n_samples % n_frames != 0:
+        raise ValueError(f"Chunked synthesis needs a whole number of samples per frame "
+                         f"({n_samples} samples, {n_frames} frames).")
+    upsampling = n_samples // n_frames
+    chunk_samples = chunk_frames * upsampling
+    n_chunks = -(-n_frames // chunk_frames)
+
+    def frame_chunks(x):
+        # Envelopes are interpolated from the next frame, the last one being
+        # held at the end, hence chunks of frames overlapping by one frame
+        n_padding = n_chunks * chunk_frames + 1 - n_frames
+        x = tf.concat([x, tf.repeat(x[:, -1:], n_padding, axis=1)], axis=1)
+        x = tf.signal.frame(x, chunk_frames + 1, chunk_frames, axis=1)
+        return tf.transpose(x, [1, 0, 2, 3])  # [n_chunks, b, chunk_frames + 1, n_sins]
+
+    @tf.recompute_grad
+    def synthesize_chunk(phase, frequencies, amplitudes):
+        frequency_envelopes = core.resample(frequencies, chunk_samples + upsampling)
+        amplitude_envelopes = core.resample(amplitudes, chunk_samples + upsampling,
+                                            method=amp_resample_method)
+        frequency_envelopes = frequency_envelopes[:, :chunk_samples]
+        amplitude_envelopes = amplitude_envelopes[:, :chunk_samples]
+
+        # Accumulate phase from the end of the previous chunk.
+        if frame_rate_phase:
+            phases = get_frame_rate_phases(frequencies, chunk_samples + upsampling,
+                                           sample_rate=sample_rate,
+                                           initial_phase=phase)[:, :chunk_samples]
+        else:
+            omegas = frequency_envelopes * (2.0 * pi) / float(sample_rate)
+            phases = phase + tf.cumsum(omegas, axis=1)
+
+        audio = cos_oscillator_bank(frequency_envelopes,
+                                    amplitude_envelopes,
+                                    sample_rate=sample_rate,
+                                    phases=phases)
+        return audio, phases[:, -1:] % (2.0 * pi)
+
+    def step(carry, chunk):
+        return synthesize_chunk(carry[1], *chunk)
+
+    initializer = (tf.zeros([tf.shape(frequencies)[0], chunk_samples]),
+                   tf.zeros_like(frequencies[:, :1]))
+    audio, _ = tf.scan(step,
+                       (frame_chunks(frequencies), frame_chunks(amplitudes)),
+                       initializer=initializer,
+                       parallel_iterations=1)
+    # Stitch chunks back together [b, n_samples]
+    audio = tf.reshape(tf.transpose(audio, [1, 0, 2]), [-1, n_chunks * chunk_samples])
+    return audio[:, :n_samples]
+
+
 def harmonic_synthesis(frequencies,
                        amplitudes,
                        harmonic_shifts=None,
@@ -92,7 +228,9 @@ def harmonic_synthesis(frequencies,
                        sample_rate=16000,
                        amp_resample_method='window',
                        sum_sinusoids=True,
-                       use_angular_cumsum=False):
+                       use_angular_cumsum=False,
+                       chunk_frames=None,
+                       frame_rate_phase=False):
     frequencies = core.tf_float32(frequencies)
     amplitudes = core.tf_float32(amplitudes)
 
@@ -102,10 +240,14 @@ def harmonic_synthesis(frequencies,
     else:
         n_harmonics = 1
 
-    # Create harmonic frequencies [batch_size, n_frames, n_harmonics].
-    harmonic_frequencies = core.get_harmonic_frequencies(frequencies, n_harmonics)
+    # Create harmonic frequencies of all substrings, stacked along the
+    # partials axis [batch_size, n_frames, n_substrings * n_harmonics].
+    n_substrings = int(frequencies.shape[-1])
+    harmonic_frequencies = core.get_harmonic_frequencies(frequencies[..., tf.newaxis], n_harmonics)
     if harmonic_shifts is not None:
-        harmonic_frequencies *= (1.0 + harmonic_shifts)
+        harmonic_frequencies *= (1.0 + harmonic_shifts[:, :, tf.newaxis])
+    harmonic_frequencies = tf.reshape(harmonic_frequencies,
+                                      tf.concat([tf.shape(frequencies)[:2], [n_substrings * n_harmonics]], axis=0))
 
     # Create harmonic amplitudes [batch_size, n_frames, n_harmonics].
     if harmonic_distribution is not None:
@@ -113,17 +255,33 @@ def harmonic_synthesis(frequencies,
     else:
         harmonic_amplitudes = amplitudes
 
+    # Synthesize by chunks of frames [batch_size, n_samples].
+    if chunk_frames is not None:
+        if not sum_sinusoids:
+            raise ValueError("Chunked synthesis only returns the sum of all oscillators.")
+        return chunked_oscillator_bank(harmonic_frequencies,
+                                       harmonic_amplitudes,
+                                       n_samples=n_samples,
+                                       sample_rate=sample_rate,
+                                       amp_resample_method=amp_resample_method,
+                                       chunk_frames=chunk_frames,
+                                       frame_rate_phase=frame_rate_phase)
+
     # Create sample-wise envelopes.
     frequency_envelopes = core.resample(harmonic_frequencies, n_samples)  # cycles/sec
     amplitude_envelopes = core.resample(harmonic_amplitudes, n_samples,
                                         method=amp_resample_method)
+    phases = None
+    if frame_rate_phase:
+        phases = get_frame_rate_phases(harmonic_frequencies, n_samples, sample_rate=sample_rate)
 
     # Synthesize from harmonics [batch_size, n_samples].
     audio = cos_oscillator_bank(frequency_envelopes,
                                 amplitude_envelopes,
                                 sample_rate=sample_rate,
                                 sum_sinusoids=sum_sinusoids,
-                                use_angular_cumsum=use_angular_cumsum)
+                                use_angular_cumsum=use_angular_cumsum,
+                                phases=phases)
     return audio
 
 
@@ -140,6 +298,10 @@ class InHarmonic(processors.Processor):
         - normalize_below_nyquist (bool): set amplitude of frequencies abow
         Nyquist to 0.
         - inference (bool): use angular cumsum (for inference only).
+        - chunk_frames (int): synthesize audio by chunks of this number of
+        frames, which bounds memory usage (None to synthesize at once).
+        - frame_rate_phase (bool): accumulate phase at frame rate in float64,
+        which is faster and more accurate than angular cumsum.
     """
 
     def __init__(self,
@@ -150,6 +312,8 @@ class InHarmonic(processors.Processor):
                  normalize_after_nyquist_cut=True,
                  normalize_below_nyquist=True,
                  inference=False,
+                 chunk_frames=None,
+                 frame_rate_phase=False,
                  name='inharmonic'):
         self.frame_rate = frame_rate
         self.sample_rate = sample_rate
@@ -158,6 +322,8 @@ class InHarmonic(processors.Processor):
         self.scale_fn = scale_fn
         self.normalize_below_nyquist = normalize_below_nyquist
         self.inference = inference
+        self.chunk_frames = chunk_frames
+        self.frame_rate_phase = frame_rate_phase
         super(InHarmonic, self).__init__(name=name)
 
     @property
@@ -230,7 +396,8 @@ class InHarmonic(processors.Processor):
             relative amplitudes (sums to 1).
             - harmonic_shifts (batch, time, n_harmonics): harmonic shifts
             from perfect harmonic frequencies.
-            - f0_hz (batch, time, 1): fundamental frequency, in Hz.
+            - f0_hz (batch, time, n_substrings): fundamental frequency of each
+            substring, in Hz.
         """
         signal = harmonic_synthesis(
             frequencies=f0_hz,
@@ -239,14 +406,17 @@ class InHarmonic(processors.Processor):
             harmonic_distribution=harmonic_distribution,
             n_samples=self.upsampling * f0_hz.shape[1],
             sample_rate=self.sample_rate,
-            use_angular_cumsum=self.inference
+            use_angular_cumsum=self.inference,
+            chunk_frames=self.chunk_frames,
+            frame_rate_phase=self.frame_rate_phase
         )
         return signal
 
 
 @gin.register
 class MultiInharmonic(InHarmonic):
-    """Inharmonic synthesizer with multiple F0 controls."""
+    """Inharmonic synthesizer with multiple F0 controls. The partials of all
+    substrings are synthesized by a single oscillator bank."""
 
     def __init__(self, name="multi_inharmonic", **kwargs):
         super(MultiInharmonic, self).__init__(name=name, **kwargs)
@@ -269,29 +439,6 @@ class MultiInharmonic(InHarmonic):
         controls['amplitudes'] /= core.tf_float32(f0_hz.shape[-1])
         return controls
 
-    def get_signal(self,
-                   amplitudes,
-                   harmonic_distribution,
-                   harmonic_shifts,
-                   f0_hz):
-        n_substrings = f0_hz.shape[-1]
-        # Audio from the first substring
-        audio = super(MultiInharmonic, self).get_signal(
-            amplitudes,
-            harmonic_distribution,
-            harmonic_shifts,
-            f0_hz[..., 0:1]
-        )
-        # Add other substrings signals
-        for substring in range(1, n_substrings):
-            audio += super(MultiInharmonic, self).get_signal(
-                amplitudes,
-                harmonic_distribution,
-                harmonic_shifts,
-                f0_hz[..., substring: substring + 1]
-            )
-        return audio
-
 
 @gin.register
 class MultiAdd(processors.Processor):
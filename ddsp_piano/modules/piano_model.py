@@ -2,6 +2,7 @@ import gin
 import tensorflow as tf
 import ddsp
 from ddsp.training.models.model import Model
+from ddsp_piano.modules.polyphonic_dag import select_voices
 
 
 def exists(x):
@@ -139,13 +140,40 @@ class PianoModel(Model):
 
         return features
 
+    def pad_voices(self, conditioning):
+        """Pad the voices axis of the conditioning up to n_synths."""
+        n_voices = conditioning.shape[2]
+        return tf.pad(conditioning,
+                      [[0, 0], [0, 0], [0, self.n_synths - n_voices], [0, 0]])
+
+    def run_processor_group(self, features, n_voices):
+        """Processor group call, synthesizing only the first n_voices."""
+        # Stacked controls are already sized after the voices
+        if n_voices == self.n_synths or not self.parallelizer.split_voices:
+            return self.processor_group(features, return_outputs_dict=True)
+
+        dag = self.processor_group.dag
+        self.processor_group.dag = select_voices(dag, n_voices, self.n_synths)
+        try:
+            return self.processor_group(features, return_outputs_dict=True)
+        finally:
+            self.processor_group.dag = dag
+
     def get_audio_from_outputs(self, outputs):
         """Extract audio output tensor from outputs dict of call()."""
         return outputs['audio_synth']
 
     def call(self, features, training=False):
+        # Batches of polyphony buckets hold fewer voices than n_synths
+        conditioning = features['conditioning']
+        n_voices = conditioning.shape[2] if self.parallelizer else self.n_synths
+        if n_voices < self.n_synths:
+            # Global features are computed over the whole polyphonic capacity
+            features['conditioning'] = self.pad_voices(conditioning)
+
         # Compute global features
         features = self.compute_global_features(features, training=training)
+        features['conditioning'] = conditioning
 
         # Merge batch axis with polyphony axis for parallelized computation
         features = self.parallelizer(features, parallelize=True)
@@ -157,7 +185,7 @@ class PianoModel(Model):
         features = self.parallelizer(features, parallelize=False)
 
         # Processor group call
-        pg_out = self.processor_group(features, return_outputs_dict=True)
+        pg_out = self.run_processor_group(features, n_voices)
 
         # Parse outputs
         outputs = pg_out['controls']
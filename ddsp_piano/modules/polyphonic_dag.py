@@ -1,6 +1,11 @@
 import gin
+import tensorflow as tf
+from ddsp import processors
 from ddsp_piano.modules.inharm_synth import MultiAdd
 
+# Number of dag nodes synthesizing each voice: additive, noise and sum
+NODES_PER_VOICE = 3
+
 
 @gin.register
 def polyphonic_dag(additive, noise, reverb=None,
@@ -40,3 +45,88 @@ def polyphonic_dag(additive, noise, reverb=None,
         dag.append((reverb, ['add/signal'] + reverb_controls))
 
     return dag
+
+
+def merge_voices(x):
+    """Merge the voice axis of stacked controls (n_voices, batch, ...) into
+    the batch axis."""
+    shape = tf.shape(x)
+    return tf.reshape(x, tf.concat([[shape[0] * shape[1]], shape[2:]], axis=0))
+
+
+def split_voices(x, n_voices):
+    """Inverse of merge_voices()."""
+    shape = tf.shape(x)
+    return tf.reshape(x, tf.concat([[n_voices, shape[0] // n_voices], shape[1:]], axis=0))
+
+
+@gin.register
+class PolyphonicSynth(processors.Processor):
+    """Synthesize all voices with a single call of an additive and a noise
+    synthesizer and sum them. Controls are stacked along a first voice axis
+    (n_voices, batch, ...), as given by a Parallelizer with split_voices=False.
+    Args:
+        - additive (ddsp.processors.Processor): a Harmonic synthesizer
+        - noise (ddsp.processors.Processor): filtered noise synthesizer.
+        - n_additive_controls (int): number of inputs of the additive
+        synthesizer, the following ones being the noise inputs.
+    """
+    def __init__(self, additive, noise, n_additive_controls=3, name='polyphonic'):
+        super(PolyphonicSynth, self).__init__(name=name)
+        self.additive = additive
+        self.noise = noise
+        self.n_additive_controls = n_additive_controls
+
+    def get_controls(self, *controls):
+        n_voices = tf.shape(controls[0])[0]
+        controls = [merge_voices(c) for c in controls]
+        additive = self.additive.get_controls(*controls[:self.n_additive_controls])
+        noise = self.noise.get_controls(*controls[self.n_additive_controls:])
+        return {'additive': {k: split_voices(v, n_voices) for k, v in additive.items()},
+                'noise': {k: split_voices(v, n_voices) for k, v in noise.items()}}
+
+    def get_signal(self, additive, noise):
+        n_voices = tf.shape(next(iter(additive.values())))[0]
+        signal = self.additive.get_signal(**{k: merge_voices(v) for k, v in additive.items()})
+        signal += self.noise.get_signal(**{k: merge_voices(v) for k, v in noise.items()})
+        return tf.reduce_sum(split_voices(signal, n_voices), axis=0)
+
+
+@gin.register
+def vectorized_polyphonic_dag(additive, noise, reverb=None,
+                              additive_controls=['amps', 'harmonic_distribution', 'f0_hz'],
+                              noise_controls=['noise_magnitudes'],
+                              reverb_controls=[]):
+    """Return a DAG for a Processor Group synthesizing all voices at once with
+    a PolyphonicSynth, as an alternative to polyphonic_dag() for a Parallelizer
+    with split_voices=False. Arguments are the same as for polyphonic_dag().
+    """
+    polyphonic = PolyphonicSynth(additive, noise, n_additive_controls=len(additive_controls))
+
+    dag = [(polyphonic, list(additive_controls) + list(noise_controls))]
+    # Apply reverb
+    if reverb is not None:
+        dag.append((reverb, [polyphonic.name + '/signal'] + reverb_controls))
+
+    return dag
+
+
+def select_voices(dag, n_voices, n_synths=16):
+    """Nodes of a polyphonic_dag() synthesizing only its first voices.
+    Args:
+        - dag (list): dag built by polyphonic_dag().
+        - n_voices (int): number of voices to synthesize.
+        - n_synths (int): polyphonic capacity of the dag.
+    Returns:
+        - dag (list): nodes of the first n_voices voices and of the reverb.
+    """
+    # Check that the dag has the polyphonic_dag() layout
+    n_voice_nodes = NODES_PER_VOICE * n_synths
+    for i in range(n_synths):
+        for node in dag[NODES_PER_VOICE * i: NODES_PER_VOICE * i + 2]:
+            if not all(key.endswith(f'_{i}') for key in node[1]):
+                raise ValueError("Only a polyphonic_dag() can synthesize fewer voices than n_synths.")
+    if len(dag) - n_voice_nodes not in (0, 1):
+        raise ValueError("Only a polyphonic_dag() can synthesize fewer voices than n_synths.")
+
+    return dag[:NODES_PER_VOICE * n_voices] + dag[n_voice_nodes:]
@@ -527,11 +527,18 @@ class MonophonicDeepNetwork(MonophonicNetwork):
 @gin.register
 class Parallelizer(tfkl.Layer):
     """Module for merging and unmerging the batch and polyphony axis of
-    given features dictionary.
+    given features dictionary. The polyphony axis is sized after the voices of
+    the conditioning, which can be fewer than n_synths.
     Args:
         - n_synths (int): size of polyphony axis.
         - global_keys (list(string)): list of global features keys.
         - mono_keys (list(string)): list of monophonic features keys.
+        - compact (bool): only compute monophonic features of the voices
+        playing a note in the segment. Silent voices share the features of a
+        single silent voice per batch element.
+        - split_voices (bool): distribute monophonic features as one control
+        per voice ('f0_hz_0', 'f0_hz_1', ...) for a polyphonic_dag(), otherwise
+        only keep them stacked along the polyphony axis.
     """
     def __init__(self,
                  n_synths=16,
@@ -544,21 +551,25 @@ class Parallelizer(tfkl.Layer):
                             'amplitudes',
                             'harmonic_distribution',
                             'magnitudes'),
+                 compact=False,
+                 split_voices=True,
                  **kwargs):
         super().__init__(**kwargs)
-        self.n_synths    = n_synths
-        self.global_keys = global_keys
-        self.mono_keys   = mono_keys
+        self.n_synths     = n_synths
+        self.global_keys  = global_keys
+        self.mono_keys    = mono_keys
+        self.compact      = compact
+        self.split_voices = split_voices
 
     def build(self, input_shape):
         self.batch_size = input_shape['conditioning'][0]
         super().build(input_shape)
 
-    def put_polyphony_axis_at_first(self, x):
+    def put_polyphony_axis_at_first(self, x, n_voices):
         """Reshape feature before calling parallelize"""
         if 2 <= len(x.shape) <= 3:
             # Create the polyphony axis and share value over all mono channels
-            x = tf.repeat(x[tf.newaxis, ...], repeats=self.n_synths, axis=0)
+            x = tf.repeat(x[tf.newaxis, ...], repeats=n_voices, axis=0)
 
         elif len(x.shape) == 4:
             # Put polyphony axis as the first dimension
@@ -566,33 +577,71 @@ class Parallelizer(tfkl.Layer):
 
         return x
 
-    def parallelize_feature(self, x):
+    def parallelize_feature(self, x, n_voices):
         # Merge the polyphony and batch axis (which are the first two axis)
         shape = tf.shape(x)
-        new_shape = tf.concat([[self.n_synths * self.batch_size], shape[2:]],
+        new_shape = tf.concat([[n_voices * self.batch_size], shape[2:]],
                               axis=0)
         return tf.reshape(x, new_shape)
 
-    def unparallelize_feature(self, x):
+    def unparallelize_feature(self, x, n_voices):
         # Disentangle batch and polyphony axis
         shape = tf.shape(x)
-        new_shape = tf.concat([[self.n_synths,  self.batch_size], shape[1:]],
+        new_shape = tf.concat([[n_voices,  self.batch_size], shape[1:]],
                               axis=0)
         return tf.reshape(x, new_shape)
 
+    def compact_features(self, features):
+        """Gather the rows of voices playing a note in the segment, followed by
+        the first voice of each batch element with a silent conditioning.
+        Release tails only follow notes of the segment, so the features of all
+        silent voices of a batch element are the same.
+        Returns:
+            - features (dict): compacted global features, with the full
+            conditioning and the row of each voice in the compact batch.
+        """
+        conditioning = features['conditioning']
+        active = tf.reduce_any(conditioning != 0., axis=[1, 2])
+        n_active = tf.reduce_sum(tf.cast(active, tf.int32))
+        rows = tf.range(tf.shape(active)[0])
+        features['voice_rows'] = tf.where(active,
+                                          tf.cumsum(tf.cast(active, tf.int32), exclusive=True),
+                                          n_active + rows % self.batch_size)
+        features['full_conditioning'] = conditioning
+
+        active_rows = tf.boolean_mask(rows, active)
+        for k in self.global_keys:
+            silent = features[k][:self.batch_size]
+            if k == 'conditioning':
+                silent = tf.zeros_like(silent)
+            features[k] = tf.concat([tf.gather(features[k], active_rows), silent], axis=0)
+        return features
+
     def parallelize(self, features):
+        n_voices = features['conditioning'].shape[2]
         for k in self.global_keys:
-            features[k] = self.put_polyphony_axis_at_first(features[k])
-            features[k] = self.parallelize_feature(features[k])
+            features[k] = self.put_polyphony_axis_at_first(features[k], n_voices)
+            features[k] = self.parallelize_feature(features[k], n_voices)
+        if self.compact:
+            features = self.compact_features(features)
         return features
 
     def unparallelize(self, features):
         """Disentangle batch and polyphony axis and distribute features as
         monophonic controls."""
+        if self.compact:
+            # Scatter back the features of the compact batch to all voices
+            features['conditioning'] = features.pop('full_conditioning')
+            voice_rows = features.pop('voice_rows')
+            for k in self.mono_keys:
+                features[k] = tf.gather(features[k], voice_rows)
+
+        n_voices = features['conditioning'].shape[0] // self.batch_size
         for k in self.mono_keys:
-            features[k] = self.unparallelize_feature(features[k])
-            for i in range(self.n_synths):
-                features[k + f'_{i}'] = features[k][i]
+            features[k] = self.unparallelize_feature(features[k], n_voices)
+            if self.split_voices:
+                for i in range(n_voices):
+                    features[k + f'_{i}'] = features[k][i]
         return features
 
     def call(self, features, parallelize=True):
@@ -0,0 +1,211 @@
+import os
+import uuid
+import shutil
+import hashlib
+import threading
+import numpy as np
+import tensorflow as tf
+
+
+def hash_file(path, chunk_size=2 ** 20):
+    """SHA-1 digest of a file content."""
+    digest = hashlib.sha1()
+    with tf.io.gfile.GFile(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArrayCache(object):
+    """On-disk cache of NumPy arrays, with a size budget and least recently
+    used eviction. Each entry is a folder of .npy files, which are read back as
+    memory-mapped arrays. Entries are shared between processes using the same
+    cache folder.
+    Args:
+        - cache_dir (path): cache folder.
+        - max_size (int): size budget (in bytes), unlimited if None.
+    Params:
+        - hits (int): number of entries found in the cache.
+        - misses (int): number of entries not found in the cache.
+        - size (int): size of the stored entries (in bytes).
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        super(ArrayCache, self).__init__()
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(self.entry_size(key) for key in self.keys())
+
+    @staticmethod
+    def get_key(*args, **kwargs):
+        """Digest of the arguments, used as an entry key."""
+        # Same description for NumPy and Python scalars
+        args = [a.item() if isinstance(a, np.generic) else a for a in args]
+        kwargs = {k: v.item() if isinstance(v, np.generic) else v
+                  for k, v in kwargs.items()}
+        description = repr(args) + repr(sorted(kwargs.items()))
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def keys(self):
+        return [k for k in os.listdir(self.cache_dir)
+                if os.path.isdir(self.entry_path(k)) and '.tmp' not in k]
+
+    def entry_size(self, key):
+        path = self.entry_path(key)
+        try:
+            return sum(os.path.getsize(os.path.join(path, f))
+                       for f in os.listdir(path))
+        except FileNotFoundError:
+            return 0
+
+    def get(self, key):
+        """Retrieve the arrays stored under `key`.
+        Returns:
+            - arrays (dict): memory-mapped arrays, or None if missing.
+        """
+        path = self.entry_path(key)
+        try:
+            arrays = {f[:-len('.npy')]: np.load(os.path.join(path, f), mmap_mode='r')
+                      for f in os.listdir(path) if f.endswith('.npy')}
+            # Mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            arrays = None
+
+        with self.lock:
+            if arrays is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return arrays
+
+    def put(self, key, arrays):
+        """Store a dict of arrays under `key`, then evict least recently used
+        entries exceeding the size budget."""
+        path = self.entry_path(key)
+        tmp_path = path + f'.tmp{uuid.uuid4().hex}'
+        os.makedirs(tmp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(array))
+        size = self.entry_size(os.path.basename(tmp_path))
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Entry already written by another worker
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+
+        with self.lock:
+            self.size += size
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict()
+
+    def get_or_compute(self, key, compute_fn):
+        """Retrieve the arrays stored under `key`, or compute and store them.
+        Args:
+            - key (str): entry key.
+            - compute_fn (callable): function returning a dict of arrays.
+        """
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = compute_fn()
+            self.put(key, arrays)
+        return arrays
+
+    def evict(self):
+        """Remove least recently used entries until within the size budget."""
+        with self.lock:
+            entries = []
+            for key in self.keys():
+                try:
+                    entries.append((os.path.getmtime(self.entry_path(key)), key))
+                except FileNotFoundError:
+                    continue
+            self.size = sum(self.entry_size(key) for _, key in entries)
+
+            for _, key in sorted(entries):
+                if self.size <= self.max_size:
+                    break
+                self.size -= self.entry_size(key)
+                shutil.rmtree(self.entry_path(key), ignore_errors=True)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': self.size,
+                    'n_entries': len(self.keys())}
+
+
+class AudioCache(ArrayCache):
+    """On-disk cache of decoded and resampled audio tracks, keyed by file path,
+    modification time, sample rate and resampler.
+    Args:
+        - cache_dir (path): cache folder.
+        - max_size (int): size budget (in bytes), unlimited if None.
+        - dtype ('float32' or 'int16'): storage format, int16 halves the cache
+        size but is lossy: audio is already resampled, so it is requantized
+        with an error around -96 dBFS.
+    """
+
+    def __init__(self, cache_dir, max_size=None, dtype='float32'):
+        super(AudioCache, self).__init__(cache_dir, max_size=max_size)
+        if dtype not in ('float32', 'int16'):
+            raise ValueError(f"Unsupported audio cache dtype: {dtype}")
+        self.dtype = np.dtype(dtype)
+
+    def audio_key(self, audio_path, sample_rate, resampler='pydub'):
+        mtime = tf.io.gfile.stat(audio_path).mtime_nsec
+        # Same keys as before the resampler choice for pydub resampling
+        if resampler == 'pydub':
+            return self.get_key(audio_path, mtime, sample_rate, self.dtype.name)
+        return self.get_key(audio_path, mtime, sample_rate, self.dtype.name, resampler)
+
+    def encode(self, audio):
+        if self.dtype == np.int16:
+            audio = np.round(np.clip(audio, -1., 1.) * np.iinfo(np.int16).max)
+        return audio.astype(self.dtype)
+
+    def decode(self, audio):
+        if self.dtype == np.int16:
+            return audio.astype(np.float32) / np.iinfo(np.int16).max
+        return audio
+
+    def load(self, audio_path, sample_rate, decode_fn, resampler='pydub'):
+        """Retrieve a cached audio track, or decode and store it.
+        Args:
+            - audio_path (path): path to audio file.
+            - sample_rate (int): number of audio samples per second.
+            - decode_fn (callable): function returning the (n_samples,) float32
+            audio track.
+            - resampler (str): resampler used by decode_fn.
+        Returns:
+            - audio (n_samples,): audio in np.float32.
+        """
+        return self.load_segment(audio_path, sample_rate, decode_fn, resampler=resampler)
+
+    def load_segment(self, audio_path, sample_rate, decode_fn, start=0,
+                     n_samples=None, resampler='pydub'):
+        """Retrieve a window of a cached audio track, or decode and store the
+        full track. Only the requested samples are read from disk.
+        Args:
+            - start (int): index of the first sample.
+            - n_samples (int): window length, up to the track end if None.
+        Returns:
+            - audio (n_samples,): audio in np.float32, shorter if the window
+            goes beyond the track end.
+        """
+        arrays = self.get_or_compute(
+            self.audio_key(audio_path, sample_rate, resampler),
+            lambda: {'audio': self.encode(decode_fn())})
+        stop = None if n_samples is None else start + n_samples
+        return self.decode(arrays['audio'][start: stop])
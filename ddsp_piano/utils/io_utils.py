@@ -1,15 +1,26 @@
 import gc
+import wave
 import pydub
 import note_seq
 import numpy as np
+import scipy.signal
 import tensorflow as tf
 
+from functools import lru_cache, partial
 from pandas import read_csv
 from ddsp.spectral_ops import pad_or_trim_to_expected_length
-from ddsp_piano.utils.midi_encoders import MIDIRoll2Conditioning
+from ddsp_piano.utils.cache_utils import hash_file
+from ddsp_piano.utils.midi_encoders import EventMIDIRoll2Conditioning
+from ddsp_piano.utils.pianoroll_utils import load_midi_as_pianoroll
 
 seq_lib = note_seq.sequences_lib
 
+# Zero crossings of the resampling filter on each side
+RESAMPLING_ZEROS = 10
+# Context resampled around audio windows (in s), spanning the resampling
+# filter for rates above 250Hz, and aligned with the grids of common rates
+RESAMPLING_MARGIN = 0.04
+
 
 def decode_tfstring(x):
     return x.numpy().decode('utf-8') if tf.is_tensor(x) else x
@@ -19,12 +30,10 @@ def tf_to_np(x):
     return x.numpy() if tf.is_tensor(x) else x
 
 
-def dataset_from_csv(csv_path, split=None, year=None, **kwargs):
-    """Load dataset from a csv file.
+def metadata_from_csv(csv_path, split=None, year=None, **kwargs):
+    """Load dataset metadata from a csv file.
     Returns:
-        - dataset (tf.data.Dataset): tensorflow dataset from .csv
-        - n_samples (int): number of dataset entries.
-        - piano_models (list): list of different piano models in the dataset.
+        - df (pandas.DataFrame): metadata of the selected tracks.
     """
     # .csv reading in pandas dataframe
     df = read_csv(csv_path, **kwargs)
@@ -34,6 +43,17 @@ def dataset_from_csv(csv_path, split=None, year=None, **kwargs):
         df = df[df.split == split]
     if year:
         df = df[df.year == year]
+    return df
+
+
+def dataset_from_csv(csv_path, split=None, year=None, **kwargs):
+    """Load dataset from a csv file.
+    Returns:
+        - dataset (tf.data.Dataset): tensorflow dataset from .csv
+        - n_samples (int): number of dataset entries.
+        - piano_models (list): list of different piano models in the dataset.
+    """
+    df = metadata_from_csv(csv_path, split=split, year=year, **kwargs)
 
     # Convert dataframe to tf.data.Dataset
     dataset = (
@@ -47,7 +67,62 @@ def dataset_from_csv(csv_path, split=None, year=None, **kwargs):
     return dataset, n_samples, piano_models
 
 
-def load_audio_as_signal(audio_path, sample_rate=16000):
+@lru_cache(maxsize=None)
+def get_resampling_filter(up, down):
+    """Low-pass FIR filter of a polyphase resampler by a factor up / down,
+    designed once per rate ratio (same design as scipy.signal.resample_poly).
+    """
+    max_rate = max(up, down)
+    return scipy.signal.firwin(2 * RESAMPLING_ZEROS * max_rate + 1, 1. / max_rate,
+                               window=('kaiser', 5.0))
+
+
+def resample_audio(audio, orig_rate, sample_rate):
+    """Resample audio with a polyphase filter.
+    Args:
+        - audio (n_samples,): audio signal.
+        - orig_rate (int): original sample rate.
+        - sample_rate (int): desired sample rate.
+    Returns:
+        - audio (n_samples * sample_rate / orig_rate,): resampled audio in
+        np.float32.
+    """
+    gcd = np.gcd(orig_rate, sample_rate)
+    up, down = sample_rate // gcd, orig_rate // gcd
+    if up == down:
+        return audio.astype(np.float32)
+    return scipy.signal.resample_poly(audio.astype(np.float32), up, down,
+                                      window=get_resampling_filter(up, down)).astype(np.float32)
+
+
+def audio_segment_to_array(audio_segment):
+    """Convert a mono pydub.AudioSegment into float32 samples."""
+    sample_arr = audio_segment.get_array_of_samples()
+    audio = np.array(sample_arr).astype(np.float32)
+    # Convert from int to float representation.
+    return audio / np.iinfo(sample_arr.typecode).max
+
+
+def resample_audio_segment(audio_segment, sample_rate, resampler='pydub'):
+    """Resample a mono pydub.AudioSegment into float32 samples.
+    Args:
+        - audio_segment (pydub.AudioSegment): mono audio.
+        - sample_rate (int): desired sample rate.
+        - resampler ('pydub' or 'polyphase'): pydub resampling, or the
+        polyphase filter of resample_audio().
+    Returns:
+        - audio (n_samples,): resampled audio in np.float32.
+    """
+    if resampler == 'polyphase':
+        return resample_audio(audio_segment_to_array(audio_segment),
+                              audio_segment.frame_rate,
+                              sample_rate)
+    if resampler != 'pydub':
+        raise ValueError(f"Unsupported resampler: {resampler}")
+    return audio_segment_to_array(audio_segment.set_frame_rate(sample_rate))
+
+
+def load_audio_as_signal(audio_path, sample_rate=16000, audio_cache=None, resampler='pydub'):
     """Load audio file at specified sample rate and return an array.
     In order to not use/install apache-beam, we've copied the function from
     ddsp.training.data_preparation.prepare_tfrecord_lib._load_audio_as_array
@@ -55,25 +130,114 @@ def load_audio_as_signal(audio_path, sample_rate=16000):
         audio_path (path): path to audio file.
         sample_rate (int): desired sample rate (can be different from
         original sample rate).
+        audio_cache (AudioCache): optional cache of decoded audio files.
+        resampler ('pydub' or 'polyphase'): pydub resampling, or the
+        polyphase filter of resample_audio().
     Returns:
         audio (n_samples,): audio in np.float32.
     """
+    if audio_cache is not None:
+        audio_path = decode_tfstring(audio_path)
+        return audio_cache.load(
+            audio_path, sample_rate,
+            lambda: load_audio_as_signal(audio_path, sample_rate, resampler=resampler),
+            resampler=resampler)
+
     with tf.io.gfile.GFile(decode_tfstring(audio_path), 'rb') as f:
         # Load audio at original SR
         audio_segment = (pydub.AudioSegment.from_file(f).set_channels(1))
         # Compute expected length at given `sample_rate`
         expected_len = int(audio_segment.duration_seconds * sample_rate)
         # Resample to `sample_rate`
-        audio_segment = audio_segment.set_frame_rate(sample_rate)
-        sample_arr = audio_segment.get_array_of_samples()
-        audio = np.array(sample_arr).astype(np.float32)
+        audio = resample_audio_segment(audio_segment, sample_rate, resampler)
         # Zero pad missing samples, if any
         audio = pad_or_trim_to_expected_length(audio, expected_len)
-    # Convert from int to float representation.
-    audio /= np.iinfo(sample_arr.typecode).max
     return audio
 
 
+def read_audio_window(f, start, duration):
+    """Read a [start, start + duration) window of an audio file. WAV files are
+    read by seeking to the window, other formats are cut by ffmpeg.
+    Args:
+        - f (file object): opened audio file.
+        - start (float): window beginning (in s).
+        - duration (float): window length (in s).
+    Returns:
+        - audio_segment (pydub.AudioSegment): audio window at original SR.
+    """
+    try:
+        with wave.open(f, 'rb') as wav:
+            rate = wav.getframerate()
+            wav.setpos(min(int(round(start * rate)), wav.getnframes()))
+            return pydub.AudioSegment(data=wav.readframes(int(round(duration * rate))),
+                                      sample_width=wav.getsampwidth(),
+                                      frame_rate=rate,
+                                      channels=wav.getnchannels())
+    except (wave.Error, EOFError):
+        # Not a PCM .wav file
+        f.seek(0)
+        return pydub.AudioSegment.from_file(f, start_second=start, duration=duration)
+
+
+def load_audio_segment(audio_path, start, duration, sample_rate=16000, audio_cache=None,
+                       resampler='pydub'):
+    """Load a [start, start + duration) window of an audio file, without
+    decoding the full track. Without cache, the window is resampled on its own
+    (along with some context for the polyphase resampler), which matches the
+    full track resampling when `start` falls on both the original and target
+    sample grids.
+    Args:
+        - audio_path (path): path to audio file.
+        - start (float): window beginning (in s).
+        - duration (float): window length (in s).
+        - sample_rate (int): desired sample rate.
+        - audio_cache (AudioCache): optional cache of decoded audio files, only
+        the window samples are read from it.
+        - resampler ('pydub' or 'polyphase'): pydub resampling, or the
+        polyphase filter of resample_audio().
+    Returns:
+        - audio (n_samples,): audio in np.float32, zero-padded beyond the track
+        end.
+    """
+    audio_path = decode_tfstring(audio_path)
+    n_samples = int(duration * sample_rate)
+
+    if audio_cache is not None:
+        audio = audio_cache.load_segment(
+            audio_path, sample_rate,
+            lambda: load_audio_as_signal(audio_path, sample_rate, resampler=resampler),
+            start=int(round(start * sample_rate)),
+            n_samples=n_samples,
+            resampler=resampler)
+
+    elif resampler == 'polyphase':
+        # Window with resampling context, zero-padded before the track
+        window_start = max(start - RESAMPLING_MARGIN, 0.)
+        with tf.io.gfile.GFile(audio_path, 'rb') as f:
+            audio_segment = read_audio_window(f, window_start,
+                                              start + duration + RESAMPLING_MARGIN - window_start)
+            audio_segment = audio_segment.set_channels(1)
+        orig_rate = audio_segment.frame_rate
+        samples = audio_segment_to_array(audio_segment)
+        n_zeros = int(round((window_start - start + RESAMPLING_MARGIN) * orig_rate))
+        audio = np.concatenate([np.zeros(n_zeros, dtype=np.float32), samples])
+        # Resample to `sample_rate` and remove the context
+        audio = resample_audio(audio, orig_rate, sample_rate)
+        audio = audio[int(round(RESAMPLING_MARGIN * sample_rate)):]
+        # Same length as the resampled full track, if the window reaches its end
+        n_requested = int(round((start + duration + RESAMPLING_MARGIN - window_start) * orig_rate))
+        if len(samples) < n_requested:
+            n_track_samples = int(round(window_start * orig_rate)) + len(samples)
+            audio = audio[:n_track_samples * sample_rate // orig_rate - int(round(start * sample_rate))]
+
+    else:
+        with tf.io.gfile.GFile(audio_path, 'rb') as f:
+            audio_segment = read_audio_window(f, start, duration).set_channels(1)
+        audio = resample_audio_segment(audio_segment, sample_rate, resampler)
+
+    return ensure_sequence_length(audio, n_samples)
+
+
 def load_midi_as_note_sequence(mid_path):
     # Read MIDI file
     note_sequence = note_seq.midi_io.midi_file_to_note_sequence(mid_path)
@@ -86,7 +250,9 @@ def load_midi_as_conditioning(mid_path,
                               n_synths=16,
                               frame_rate=250,
                               duration=None,
-                              warm_up_duration=0.):
+                              warm_up_duration=0.,
+                              midi_cache=None,
+                              lowest_free_voice=False):
     """Load MIDI file as conditioning and pedal inputs for inference.
     Args:
         - mid_path (path): path to .mid file.
@@ -94,30 +260,39 @@ def load_midi_as_conditioning(mid_path,
         - frame_rate (int): number of frames per second.
         - duration (float): crop file reading to this duration.
         - warm_up_duration (float): zero-pad for this amount of time at beginning
+        - midi_cache (ArrayCache): optional cache of converted MIDI files.
+        - lowest_free_voice (bool): assign new notes to the lowest free channel
+        (see EventMIDIRoll2Conditioning).
     Returns:
         - conditioning (1, n_frames, n_synths, 2): polyphonic note activity and
         onset inputs.
         - pedal (1, n_frames, 4): pedal information.
         - duration (float): length of the sequence (in s).
     """
-    # File reading
-    note_sequence = load_midi_as_note_sequence(mid_path)
-    # Convert to pianoroll
-    roll = seq_lib.sequence_to_pianoroll(note_sequence,
-                                         frames_per_second=frame_rate,
-                                         min_pitch=21,
-                                         max_pitch=108)
+    if midi_cache is not None:
+        key = midi_cache.get_key(hash_file(mid_path), 'conditioning', n_synths,
+                                 frame_rate, duration, warm_up_duration, lowest_free_voice)
+        inputs = midi_cache.get_or_compute(
+            key,
+            lambda: load_midi_as_conditioning(mid_path, n_synths, frame_rate,
+                                              duration, warm_up_duration,
+                                              lowest_free_voice=lowest_free_voice))
+        return dict(inputs, duration=float(inputs['duration']))
+
+    # File reading and conversion to pianoroll
+    active, onset_velocities, control_changes, total_time = \
+        load_midi_as_pianoroll(mid_path, frame_rate=frame_rate)
     # Retrieve activity and onset velocities and pedals signals
-    midi_roll = np.stack((roll.active, roll.onset_velocities), axis=-1)
-    pedals = roll.control_changes[:, 64: 68] / 128.
+    midi_roll = np.stack((active, onset_velocities), axis=-1)
+    pedals = control_changes[:, 64: 68] / 128.
 
     # Reduce pianoroll to conditioning while managing polyphonic information
-    polyphony_manager = MIDIRoll2Conditioning(n_synths)
+    polyphony_manager = EventMIDIRoll2Conditioning(n_synths, lowest_free_voice)
     conditioning, _ = polyphony_manager(midi_roll)
 
     # Set target length to an integer number of seconds
     if duration is None:
-        target_n_frames = int(np.ceil(note_sequence.total_time) * frame_rate)
+        target_n_frames = int(np.ceil(total_time) * frame_rate)
     else:
         target_n_frames = int(duration * frame_rate)
 
@@ -137,11 +312,60 @@ def load_midi_as_conditioning(mid_path,
             'duration': target_n_frames / frame_rate + warm_up_duration}
 
 
+def load_midi_data(mid_path, max_polyphony=None, frame_rate=250, midi_cache=None,
+                   lowest_free_voice=False):
+    """Load MIDI file as full-length conditioning sequences.
+    Args:
+        - mid_path (path): path to .mid file.
+        - max_polyphony (int): number of monophonic channels for the conditio-
+        ning vector (return the piano roll if None).
+        - frame_rate (int): number of conditioning vectors per second.
+        - midi_cache (ArrayCache): optional cache of converted MIDI files.
+        - lowest_free_voice (bool): assign new notes to the lowest free channel
+        (see EventMIDIRoll2Conditioning).
+    Returns:
+        - inputs (dict): 'conditioning' (n_frames, max_polyphony, 2), 'pedal'
+        (n_frames, 4) and 'polyphony' (n_frames,), or 'roll' (n_frames, 88, 2)
+        and 'pedal' if max_polyphony is None.
+    """
+    if midi_cache is not None:
+        key = midi_cache.get_key(hash_file(mid_path), 'midi_data',
+                                 max_polyphony, frame_rate, lowest_free_voice)
+        return midi_cache.get_or_compute(
+            key,
+            lambda: load_midi_data(mid_path, max_polyphony, frame_rate,
+                                   lowest_free_voice=lowest_free_voice))
+
+    # Read MIDI file and convert to pianoroll
+    active, onset_velocities, control_changes, _ = \
+        load_midi_as_pianoroll(mid_path, frame_rate=frame_rate)
+    # Retrieve activity and onset velocities
+    midi_roll = np.stack((active, onset_velocities), axis=-1)
+
+    # Pedals are CC64, 66 and 67
+    pedals = control_changes[:, 64: 68] / 128.0
+
+    if max_polyphony is not None:
+        polyphony_manager = EventMIDIRoll2Conditioning(max_polyphony, lowest_free_voice)
+        conditioning, polyphony = polyphony_manager(midi_roll)
+
+        return {'conditioning': conditioning,
+                'pedal': pedals,
+                'polyphony': polyphony}
+
+    else:
+        return {'roll': midi_roll, 'pedal': pedals}
+
+
 def load_data(audio_path,
               mid_path,
               max_polyphony=None,
               sample_rate=16000,
-              frame_rate=250):
+              frame_rate=250,
+              midi_cache=None,
+              audio_cache=None,
+              lowest_free_voice=False,
+              resampler='pydub'):
     """Load aligned audio and MIDI data (as conditioning sequence), then split
     into segments.
     Args:
@@ -151,6 +375,12 @@ def load_data(audio_path,
         ning vector (return the piano rolls if None).
         - sample_rate (int): number of audio samples per second.
         - frame_rate (int): number of conditioning vectors per second.
+        - midi_cache (ArrayCache): optional cache of converted MIDI files.
+        - audio_cache (AudioCache): optional cache of decoded audio files.
+        - lowest_free_voice (bool): assign new notes to the lowest free channel
+        (see EventMIDIRoll2Conditioning).
+        - resampler ('pydub' or 'polyphase'): pydub resampling, or the
+        polyphase filter of resample_audio().
     Returns:
         - segment_audio (list [n_samples,]): list of audio segments.
         - segment_rolls (list [n_frames, max_polyphony, 2]): list of segments
@@ -161,37 +391,49 @@ def load_data(audio_path,
         original piano roll.
     """
     # Read audio file
-    audio = load_audio_as_signal(decode_tfstring(audio_path), tf_to_np(sample_rate))
+    audio = load_audio_as_signal(decode_tfstring(audio_path),
+                                 int(tf_to_np(sample_rate)),
+                                 audio_cache=audio_cache,
+                                 resampler=resampler)
 
     # Read MIDI file
-    note_sequence = load_midi_as_note_sequence(decode_tfstring(mid_path))
-
-    # Convert to pianoroll
-    roll = seq_lib.sequence_to_pianoroll(note_sequence,
-                                         frames_per_second=tf_to_np(frame_rate),
-                                         min_pitch=21,
-                                         max_pitch=108)
-    # Retrieve activity and onset velocities
-    midi_roll = np.stack((roll.active, roll.onset_velocities), axis=-1)
-
-    # Pedals are CC64, 66 and 67
-    pedals = roll.control_changes[:, 64: 68] / 128.0
-
     if max_polyphony is not None:
-        polyphony_manager = MIDIRoll2Conditioning(max_polyphony)
-        conditioning, polyphony = polyphony_manager(midi_roll)
+        max_polyphony = int(tf_to_np(max_polyphony))
+    midi = load_midi_data(decode_tfstring(mid_path),
+                          max_polyphony=max_polyphony,
+                          frame_rate=tf_to_np(frame_rate),
+                          midi_cache=midi_cache,
+                          lowest_free_voice=lowest_free_voice)
 
-        return audio, conditioning, pedals, polyphony
+    if max_polyphony is not None:
+        return audio, midi['conditioning'], midi['pedal'], midi['polyphony']
 
     else:
-        return audio, midi_roll, pedals
+        return audio, midi['roll'], midi['pedal']
 
 
 @tf.function
-def load_data_tf(audio_path, mid_path, max_polyphony, sample_rate, frame_rate):
-    """tf.function wrapper for the load_and_split_data function."""
+def load_data_tf(audio_path, mid_path, max_polyphony, sample_rate, frame_rate,
+                 midi_cache=None, audio_cache=None, decode_pool=None, lowest_free_voice=False,
+                 resampler='pydub'):
+    """tf.function wrapper for the load_and_split_data function. Decoding is
+    delegated to the worker processes of decode_pool (DecodePool) if given."""
+    if decode_pool is not None:
+        load_fn = lambda *args: decode_pool.load_data(
+            decode_tfstring(args[0]),
+            decode_tfstring(args[1]),
+            *[tf_to_np(x).item() for x in args[2:]],
+            lowest_free_voice=lowest_free_voice,
+            resampler=resampler)
+    else:
+        load_fn = partial(load_data,
+                          midi_cache=midi_cache,
+                          audio_cache=audio_cache,
+                          lowest_free_voice=lowest_free_voice,
+                          resampler=resampler)
+
     audio, conditioning, pedal, polyphony = tf.py_function(
-        load_data,
+        load_fn,
         [audio_path, mid_path, max_polyphony, sample_rate, frame_rate],
         Tout=(tf.float32, tf.float32, tf.float32, tf.int32)
     )
@@ -201,6 +443,171 @@ def load_data_tf(audio_path, mid_path, max_polyphony, sample_rate, frame_rate):
             "polyphony": polyphony}
 
 
+def load_midi_segment(mid_path,
+                      start,
+                      duration,
+                      max_polyphony,
+                      frame_rate=250,
+                      midi_cache=None,
+                      lowest_free_voice=False):
+    """Load a [start, start + duration) segment of MIDI conditioning.
+    Args:
+        - start (float): segment beginning (in s).
+        - duration (float): segment length (in s).
+        Other arguments are the same as for load_data().
+    Returns:
+        - conditioning (n_frames, max_polyphony, 2): conditioning segment.
+        - pedal (n_frames, 4): pedals segment.
+        - polyphony (n_frames,): polyphony segment.
+    """
+    start, duration = float(tf_to_np(start)), float(tf_to_np(duration))
+    frame_rate = int(tf_to_np(frame_rate))
+
+    midi = load_midi_data(decode_tfstring(mid_path),
+                          max_polyphony=int(tf_to_np(max_polyphony)),
+                          frame_rate=frame_rate,
+                          midi_cache=midi_cache,
+                          lowest_free_voice=lowest_free_voice)
+    # Crop conditioning signals to the segment
+    first_frame, n_frames = int(round(start * frame_rate)), int(duration * frame_rate)
+    return [ensure_sequence_length(midi[k][first_frame: first_frame + n_frames],
+                                   n_frames)
+            for k in ('conditioning', 'pedal', 'polyphony')]
+
+
+def load_segment_data(audio_path,
+                      mid_path,
+                      start,
+                      duration,
+                      max_polyphony,
+                      sample_rate=16000,
+                      frame_rate=250,
+                      midi_cache=None,
+                      audio_cache=None,
+                      resampler='pydub',
+                      lowest_free_voice=False):
+    """Load a [start, start + duration) segment of aligned audio and MIDI data,
+    so that memory use depends on the segment length instead of the track one.
+    Args:
+        - start (float): segment beginning (in s).
+        - duration (float): segment length (in s).
+        Other arguments are the same as for load_data().
+    Returns:
+        - audio (n_samples,): audio segment.
+        - conditioning (n_frames, max_polyphony, 2): conditioning segment.
+        - pedal (n_frames, 4): pedals segment.
+        - polyphony (n_frames,): polyphony segment.
+    """
+    audio = load_audio_segment(audio_path,
+                               float(tf_to_np(start)),
+                               float(tf_to_np(duration)),
+                               int(tf_to_np(sample_rate)),
+                               audio_cache=audio_cache,
+                               resampler=resampler)
+    return [audio] + load_midi_segment(mid_path, start, duration, max_polyphony,
+                                       frame_rate=frame_rate,
+                                       midi_cache=midi_cache,
+                                       lowest_free_voice=lowest_free_voice)
+
+
+@tf.function
+def load_segment_data_tf(audio_path, mid_path, start, duration, max_polyphony,
+                         sample_rate, frame_rate, midi_cache=None, audio_cache=None,
+                         resampler='pydub', lowest_free_voice=False):
+    """tf.function wrapper for the load_segment_data function."""
+    audio, conditioning, pedal, polyphony = tf.py_function(
+        partial(load_segment_data, midi_cache=midi_cache, audio_cache=audio_cache,
+                resampler=resampler, lowest_free_voice=lowest_free_voice),
+        [audio_path, mid_path, start, duration, max_polyphony, sample_rate,
+         frame_rate],
+        Tout=(tf.float32, tf.float32, tf.float32, tf.int32)
+    )
+    return {"audio": audio,
+            "conditioning": conditioning,
+            "pedal": pedal,
+            "polyphony": polyphony}
+
+
+@tf.function
+def load_midi_segment_tf(mid_path, start, duration, max_polyphony, frame_rate,
+                         midi_cache=None, lowest_free_voice=False):
+    """tf.function wrapper for the load_midi_segment function."""
+    conditioning, pedal, polyphony = tf.py_function(
+        partial(load_midi_segment, midi_cache=midi_cache, lowest_free_voice=lowest_free_voice),
+        [mid_path, start, duration, max_polyphony, frame_rate],
+        Tout=(tf.float32, tf.float32, tf.int32)
+    )
+    return {"conditioning": conditioning,
+            "pedal": pedal,
+            "polyphony": polyphony}
+
+
+@tf.function
+def load_audio_segment_tf(audio_path, start, duration, sample_rate, audio_cache=None,
+                          resampler='pydub'):
+    """tf.function wrapper for the load_audio_segment function."""
+    return tf.py_function(
+        lambda path, start, duration, rate: load_audio_segment(
+            path, float(start), float(duration), int(rate), audio_cache=audio_cache,
+            resampler=resampler),
+        [audio_path, start, duration, sample_rate],
+        Tout=tf.float32
+    )
+
+
+def get_segment_properties(conditioning, polyphony, frame_offsets=(0, ), n_frames=None):
+    """Properties of conditioning segments, for filtering segments out before
+    loading any audio.
+    Args:
+        - conditioning (n_frames, n_synths, 2): track conditioning.
+        - polyphony (n_frames,): track polyphony.
+        - frame_offsets (n_segments,): first frame of each segment.
+        - n_frames (int): segments length (full track if None).
+    Returns:
+        - properties (dict): 'max_polyphony' (n_segments,) maximum number of
+        simultaneous notes, 'n_notes' (n_segments,) number of note onsets,
+        'active_frames' (n_segments,) number of frames where a note is held,
+        and 'silent' (n_segments,) whether no note is played.
+    """
+    frame_offsets = np.asarray(frame_offsets, dtype=np.int64)
+    n_frames = len(polyphony) if n_frames is None else n_frames
+    length = max(len(polyphony), int(frame_offsets.max()) + n_frames)
+    polyphony = ensure_sequence_length(np.asarray(polyphony), length)
+
+    # First frames of onset windows
+    onsets = ensure_sequence_length(np.asarray(conditioning[..., 1]) > 0, length)
+    starts = onsets & ~np.concatenate([np.zeros_like(onsets[:1]), onsets[:-1]])
+    n_starts = np.concatenate([[0], np.cumsum(starts.sum(axis=-1))])
+
+    n_active = np.concatenate([[0], np.cumsum(polyphony > 0)])
+
+    max_polyphony = np.lib.stride_tricks.sliding_window_view(
+        polyphony, n_frames)[frame_offsets].max(axis=-1)
+    return {'max_polyphony': max_polyphony,
+            'n_notes': n_starts[frame_offsets + n_frames] - n_starts[frame_offsets],
+            'active_frames': n_active[frame_offsets + n_frames] - n_active[frame_offsets],
+            'silent': max_polyphony == 0}
+
+
+def get_audio_rms(audio, sample_offsets=(0, ), n_samples=None):
+    """Root mean square of audio segments.
+    Args:
+        - audio (n_samples,): track audio.
+        - sample_offsets (n_segments,): first sample of each segment.
+        - n_samples (int): segments length (full track if None).
+    Returns:
+        - rms (n_segments,): RMS amplitude of each segment.
+    """
+    sample_offsets = np.asarray(sample_offsets, dtype=np.int64)
+    n_samples = len(audio) if n_samples is None else n_samples
+    length = max(len(audio), int(sample_offsets.max()) + n_samples)
+    audio = ensure_sequence_length(np.asarray(audio, dtype=np.float64), length)
+
+    energy = np.concatenate([[0.], np.cumsum(audio ** 2)])
+    mean_square = (energy[sample_offsets + n_samples] - energy[sample_offsets]) / n_samples
+    return np.sqrt(np.maximum(mean_square, 0.)).astype(np.float32)
+
+
 def ensure_sequence_length(sequence, length, right=True):
     """Zero-pad or crop sequence to fit desired length.
     Args:
@@ -224,22 +631,34 @@ def ensure_sequence_length(sequence, length, right=True):
         return np.pad(sequence, pad_width=pad_width)
 
 
+def get_n_segments(length, segment_duration, rate, overlap=0.5):
+    """Number of segments fitting entirely in a sequence of `length` steps."""
+    n_samples = int(segment_duration * rate)
+    hop_size  = int(n_samples * (1 - overlap))
+    return tf.maximum((length - n_samples) // hop_size + 1, 0)
+
+
 @tf.function
-def split_sequence_tf(x, segment_duration, rate, overlap=0.5):
+def split_sequence_tf(x, segment_duration, rate, overlap=0.5, n_segments=None):
+    """Split a sequence into overlapping segments, as strided frames of its
+    first axis. Trailing steps not filling a segment are dropped.
+    Args:
+        - x (time, ...): sequence to split.
+        - segment_duration (float): duration of segments (in s).
+        - rate (int): number of sequence steps per second.
+        - overlap (float): overlap ratio between consecutive segments.
+        - n_segments (int): only keep the first segments (all if None).
+    Returns:
+        - segments (n_segments, segment_duration * rate, ...): segments.
+    """
     n_samples = int(segment_duration * rate)
     hop_size  = int(n_samples * (1 - overlap))
 
-    segments = tf.TensorArray(dtype=x.dtype, size=1, dynamic_size=True)
-
-    timestep, segment_idx = 0, 0
-    while timestep + n_samples <= tf.shape(x)[0]:
-        segments = segments.write(segment_idx,
-                                  x[timestep: timestep + n_samples, ...])
-        timestep += hop_size
-        segment_idx += 1
-    stacked_segments = segments.stack()
-    _ = segments.close()
-    return stacked_segments
+    if n_segments is None:
+        n_segments = get_n_segments(tf.shape(x)[0], segment_duration, rate, overlap)
+    # Crop to the span of the kept segments
+    x = x[:tf.maximum((n_segments - 1) * hop_size + n_samples, 0)]
+    return tf.signal.frame(x, n_samples, hop_size, axis=0)
 
 
 def normalize_audio(audio_file, volume=-20):
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 
 
@@ -20,6 +21,23 @@ class MIDIRoll2Conditioning(object):
         self.assigner = 0
         self.assigned_pitch = np.zeros(n_synths)
 
+    def reset(self):
+        """Free all channels, as before the first call."""
+        self.set_state({'assigned_pitch': np.zeros(self.n_synths),
+                        'assigner': 0,
+                        'reorder': np.arange(self.n_synths)})
+
+    def get_state(self):
+        """Copy of the channel assignment state, for resuming a conversion."""
+        return {'assigned_pitch': self.assigned_pitch.copy(),
+                'assigner': self.assigner,
+                'reorder': self.reorder.copy()}
+
+    def set_state(self, state):
+        self.assigned_pitch = np.array(state['assigned_pitch'], dtype=float)
+        self.assigner = int(state['assigner'])
+        self.reorder = np.array(state['reorder'], dtype=int)
+
     def update_assigner(self):
         # Incremente assigner to next available channel
         self.assigner = (self.assigner + 1) % self.n_synths
@@ -102,3 +120,355 @@ class MIDIRoll2Conditioning(object):
             t += 1
 
         return np.stack([note_activity, velocity], axis=-1), polyphony
+
+
+class EventMIDIRoll2Conditioning(MIDIRoll2Conditioning):
+    """Event-driven counterpart of MIDIRoll2Conditioning.
+    Channels are only (re)assigned at frames where the set of active notes
+    changes (note-on/note-off events), and each note is then written to its
+    channel as a contiguous slice of frames. Outputs are identical to those of
+    MIDIRoll2Conditioning, provided that onset velocities are only set on
+    active notes (as in note_seq pianorolls).
+    Params:
+        - lowest_free_voice (bool): assign new notes to the lowest free channel
+        instead of the next one in round-robin order, so that the highest
+        channels are only used under high polyphony.
+    """
+
+    def __init__(self, n_synths=16, lowest_free_voice=False):
+        super(EventMIDIRoll2Conditioning, self).__init__(n_synths)
+        self.lowest_free_voice = lowest_free_voice
+
+    def update_assigner(self):
+        if not self.lowest_free_voice:
+            return super(EventMIDIRoll2Conditioning, self).update_assigner()
+        free = np.flatnonzero(self.assigned_pitch == 0)
+        self.assigner = int(free[0]) if len(free) > 0 else -1
+
+    def get_events(self, note_activity):
+        """Return the indices of frames where note activity changes.
+        Args:
+            - note_activity (n_frames, 88): active pianoroll.
+        Returns:
+            - events (n_events,): frame indices, starting with frame 0.
+        """
+        changes = np.any(note_activity[1:] != note_activity[:-1], axis=-1)
+        return np.flatnonzero(np.concatenate([[len(note_activity) > 0], changes]))
+
+    def assign(self, pitches):
+        """Update the channel assignment given the notes active at an event.
+        Args:
+            - pitches (n_notes,): sorted MIDI pitches of the active notes,
+            with at most n_synths entries.
+        Returns:
+            - released (list): channels of the notes which have ended.
+            - started (list): channels assigned to new notes.
+        """
+        assigned_pitch = self.assigned_pitch.tolist()
+        active_pitch = set(pitches.tolist())
+
+        # Free channels containing finished notes
+        released = [c for c, pitch in enumerate(assigned_pitch)
+                    if pitch != 0 and pitch not in active_pitch]
+        self.assigned_pitch[released] = 0
+        if len(released) > 0 and (self.assigner == -1 or self.lowest_free_voice):
+            self.update_assigner()
+
+        # Assign new notes to unassigned channels
+        started = []
+        for pitch in sorted(active_pitch.difference(assigned_pitch)):
+            self.assigned_pitch[self.assigner] = pitch
+            started.append(self.assigner)
+            self.update_assigner()
+
+        return released, started
+
+    def __call__(self, roll):
+        """ Convert active and onset veloctiy pianorolls into polyphonic
+        conditioning vector.
+        Args:
+            - roll (n_frames, 88, 2): stacked active and onset velocity
+            pianorolls.
+        Returns:
+            - conditioning (n_frames, n_synths, 2): stacked conditioning
+            polyphonic vector.
+            - polyphony (n_frames): number of simultaneous notes at each
+            frame in the uncompressed MIDI roll.
+        """
+        n_frames = roll.shape[0]
+        note_activity = roll[..., 0]
+        polyphony = np.sum(note_activity, axis=-1)
+
+        conditioning = np.zeros((n_frames, self.n_synths, 2), dtype=roll.dtype)
+
+        def write_note(c, pitch, start, end):
+            key = int(pitch) - self.pitch_mul[0]
+            conditioning[start: end, c, 0] = pitch
+            conditioning[start: end, c, 1] = roll[start: end, key, 1]
+
+        # Notes carried over from a previous call start at the first frame
+        note_start = np.zeros(self.n_synths, dtype=int)
+
+        for t in self.get_events(note_activity):
+            # Keep the n_synths highest active notes
+            pitches = self.pitch_mul[np.flatnonzero(note_activity[t])[-self.n_synths:]]
+
+            previous_pitch = self.assigned_pitch.copy()
+            released, started = self.assign(pitches)
+
+            # Write down ended notes as contiguous slices
+            for c in released:
+                write_note(c, previous_pitch[c], note_start[c], t)
+            note_start[started] = t
+
+        # Write down notes still active at the end of the roll
+        for c in np.flatnonzero(self.assigned_pitch):
+            write_note(c, self.assigned_pitch[c], note_start[c], n_frames)
+
+        return conditioning, polyphony
+
+
+# Event types, in their processing order at equal times (as in
+# note_seq.sequences_lib.apply_sustain_control_changes)
+SUSTAIN_ON, SUSTAIN_OFF, NOTE_ON, NOTE_OFF = range(4)
+
+
+class StreamedNote(object):
+    """Note of a MIDI stream.
+    Params:
+        - end_time (float): note-off time, or end time once released.
+        - released (bool): whether the end time is final (after sustain).
+        - deleted (bool): note replaced by a note with the same pitch and
+        onset time while sustained.
+    """
+
+    def __init__(self, pitch, velocity, start_time):
+        super(StreamedNote, self).__init__()
+        self.pitch = pitch
+        self.velocity = velocity
+        self.start_time = start_time
+        self.end_time = None
+        self.released = False
+        self.deleted = False
+
+
+class MIDIStream2Conditioning(object):
+    """Push-based conversion of MIDI events or pianoroll chunks into
+    polyphonic conditioning, block by block.
+    Either feed pianoroll chunks with `push_roll`, or MIDI events with
+    `note_on`, `note_off` and `control_change` followed by calls to `advance`,
+    which outputs the frames that upcoming events can no longer modify.
+    Sustain pedal and pianoroll conversion follow note_seq, so that the
+    concatenated outputs are identical to the conversion of the full
+    pianoroll. Memory only depends on the number of sounding notes.
+    Args:
+        - n_synths (int): supported number of simultaneous notes.
+        - frame_rate (int): number of frames per second.
+        - max_velocity (int): velocity normalization factor.
+        - lowest_free_voice (bool): assign new notes to the lowest free channel
+        (see EventMIDIRoll2Conditioning).
+    """
+
+    def __init__(self, n_synths=16, frame_rate=250, max_velocity=127, lowest_free_voice=False):
+        super(MIDIStream2Conditioning, self).__init__()
+        self.frame_rate = frame_rate
+        self.max_velocity = max_velocity
+        self.polyphony_manager = EventMIDIRoll2Conditioning(n_synths, lowest_free_voice)
+        self.reset()
+
+    @property
+    def n_synths(self):
+        return self.polyphony_manager.n_synths
+
+    def reset(self):
+        self.polyphony_manager.reset()
+        # Index of the next frame to output
+        self.frame = 0
+        # Events before this time have been processed
+        self.horizon = 0.
+        # Time of the last processed event
+        self.time = 0.
+        self.total_time = 0.
+        self.sustain = False
+        # Notes which can still affect upcoming frames
+        self.notes = []
+        # Notes extended by the sustain pedal or not released yet
+        self.active_notes = []
+        # Pending (time, event type, note) events
+        self.events = []
+        # Pedal values per frame index
+        self.pedals = {}
+
+    def frames_from_times(self, start_time, end_time):
+        """Same frame quantization as note_seq.sequence_to_pianoroll."""
+        start_frame = int(start_time * self.frame_rate)
+        end_frame = int(math.ceil(end_time * self.frame_rate))
+        return start_frame, max(start_frame + 1, end_frame)
+
+    def push_event(self, time, event_type, note=None):
+        if time < self.horizon:
+            raise ValueError(f"Event at {time} s pushed after advancing to {self.horizon} s.")
+        self.events.append((time, event_type, note))
+
+    def note_on(self, time, pitch, velocity):
+        if velocity == 0:
+            return self.note_off(time, pitch)
+        self.push_event(time, NOTE_ON, StreamedNote(pitch, velocity, time))
+
+    def note_off(self, time, pitch):
+        # As in pretty_midi, end every held note with the same pitch
+        held_notes = [e[2] for e in self.events if e[1] == NOTE_ON] + self.active_notes
+        for note in held_notes:
+            if note.pitch == pitch and note.end_time is None \
+               and note.start_time != time:
+                note.end_time = time
+                self.total_time = max(self.total_time, time)
+                self.push_event(time, NOTE_OFF, note)
+
+    def control_change(self, time, number, value):
+        if number == 64:
+            self.push_event(time, SUSTAIN_ON if value >= 64 else SUSTAIN_OFF)
+        if 64 <= number < 68:
+            frame, _ = self.frames_from_times(time, 0)
+            pedal = self.pedals.setdefault(frame, np.zeros(4, dtype=np.int32))
+            pedal[number - 64] = value + 1
+
+    def release(self, note, time):
+        note.end_time = time
+        note.released = True
+        self.active_notes = [n for n in self.active_notes if n is not note]
+
+    def process_event(self, time, event_type, note):
+        """Apply sustain as note_seq.apply_sustain_control_changes."""
+        if event_type == SUSTAIN_ON:
+            self.sustain = True
+
+        elif event_type == SUSTAIN_OFF:
+            self.sustain = False
+            # End all notes extended by the sustain
+            for active_note in self.active_notes:
+                if active_note.end_time is not None and active_note.end_time < time:
+                    self.release(active_note, time)
+                    self.total_time = max(self.total_time, time)
+
+        elif event_type == NOTE_ON:
+            if self.sustain:
+                # End previous notes with the same pitch
+                for active_note in self.active_notes:
+                    if active_note.pitch == note.pitch:
+                        self.release(active_note, time)
+                        active_note.deleted = active_note.start_time == time
+            self.active_notes.append(note)
+            self.notes.append(note)
+
+        elif event_type == NOTE_OFF:
+            if not self.sustain and not note.released:
+                self.release(note, note.end_time)
+
+        self.time = time
+
+    def process_events(self, time=math.inf):
+        """Process pending events happening before `time`."""
+        self.events.sort(key=lambda event: event[:2])
+        while self.events and self.events[0][0] < time:
+            self.process_event(*self.events.pop(0))
+
+    def render(self, end_frame):
+        """Build the pianoroll from the current frame up to `end_frame`, and
+        convert it into conditioning."""
+        n_frames = max(end_frame - self.frame, 0)
+        active = np.zeros((n_frames, 88), dtype=np.float32)
+        velocities = np.zeros_like(active)
+        onsets = np.zeros_like(active)
+
+        def crop(start, end):
+            return max(start - self.frame, 0), max(min(end, end_frame) - self.frame, 0)
+
+        remaining_notes = []
+        for note in self.notes:
+            if note.deleted or not 21 <= note.pitch <= 108:
+                continue
+            start_frame, note_end_frame = self.frames_from_times(
+                note.start_time,
+                note.end_time if note.released else note.start_time)
+            # Notes not released yet last beyond the rendered frames
+            if not note.released:
+                note_end_frame = end_frame
+
+            start, end = crop(start_frame, note_end_frame)
+            active[start: end, note.pitch - 21] = 1.
+            velocities[start: end, note.pitch - 21] = note.velocity / self.max_velocity
+            # Onset window around the onset frame
+            start, end = crop(start_frame - 1, start_frame + 2)
+            onsets[start: end, note.pitch - 21] = 1.
+
+            if not note.released or max(note_end_frame, start_frame + 2) > end_frame:
+                remaining_notes.append(note)
+        self.notes = remaining_notes
+
+        pedal = np.zeros((n_frames, 4), dtype=np.int32)
+        for frame in [f for f in self.pedals if f < end_frame]:
+            if frame >= self.frame:
+                pedal[frame - self.frame] = self.pedals[frame]
+            del self.pedals[frame]
+
+        roll = np.stack((active, velocities * onsets), axis=-1)
+        conditioning, polyphony = self.polyphony_manager(roll)
+        self.frame += n_frames
+
+        return {'conditioning': conditioning,
+                'pedal': pedal / 128.,
+                'polyphony': polyphony}
+
+    def advance(self, time):
+        """Process events before `time` and output the frames which can no
+        longer be modified by upcoming events.
+        Args:
+            - time (float): no more events will be pushed before this time (in s).
+        Returns:
+            - outputs (dict): newly available conditioning (n_frames, n_synths,
+            2), pedal (n_frames, 4) and polyphony (n_frames,).
+        """
+        self.process_events(time)
+        self.horizon = max(self.horizon, time)
+        # Upcoming notes can set onset velocities one frame before their onset
+        end_frame = int(time * self.frame_rate) - 1
+        # Notes only extended by the sustain pedal end with the last event if
+        # the stream is flushed before the pedal is released
+        if any(note.end_time is not None for note in self.active_notes):
+            end_frame = min(end_frame, int(math.ceil(self.time * self.frame_rate)))
+        return self.render(end_frame)
+
+    def flush(self):
+        """Process all pending events and output the remaining frames of the
+        pianoroll, up to the last note end. As in note_seq, notes still
+        sustained end with the last processed event, so `advance` holds back
+        the frames after this event while the sustain pedal extends a released
+        note. Frames already output by advancing the stream past the last note
+        end are silent, and make the concatenated outputs longer than the full
+        pianoroll conversion."""
+        self.process_events()
+        if self.active_notes:
+            for note in self.active_notes:
+                self.release(note, self.time)
+            self.total_time = self.time
+
+        return self.render(int(self.total_time * self.frame_rate + 1))
+
+    def push_roll(self, roll, pedal=None):
+        """Convert a chunk of pianoroll into conditioning frames.
+        Args:
+            - roll (n_frames, 88, 2): stacked active and onset velocity
+            pianorolls.
+            - pedal (n_frames, 4): optional pedal signals passed through.
+        Returns:
+            - outputs (dict): conditioning (n_frames, n_synths, 2), pedal
+            (n_frames, 4) and polyphony (n_frames,) of the chunk.
+        """
+        conditioning, polyphony = self.polyphony_manager(roll)
+        self.frame += roll.shape[0]
+        if pedal is None:
+            pedal = np.zeros((roll.shape[0], 4))
+        return {'conditioning': conditioning,
+                'pedal': pedal,
+                'polyphony': polyphony}
@@ -0,0 +1,284 @@
+import pretty_midi
+import numpy as np
+
+# Event types, in their processing order at equal times (same as note_seq)
+SUSTAIN_ON, SUSTAIN_OFF, NOTE_ON, NOTE_OFF = range(4)
+# Suffix of MIDI events files, written by save_midi_events()
+EVENTS_SUFFIX = '.events.npz'
+
+
+def read_midi_arrays(mid_path):
+    """Read notes and control changes of a MIDI file as flat arrays, in the
+    same order as note_seq.midi_io.midi_file_to_note_sequence.
+    Args:
+        - mid_path (path): path to .mid file.
+    Returns:
+        - notes (dict): 'pitch', 'velocity', 'start', 'end', 'instrument' and
+        'is_drum' arrays of shape (n_notes,).
+        - control_changes (dict): 'number', 'value', 'time' and 'instrument'
+        arrays of shape (n_control_changes,).
+    """
+    midi = pretty_midi.PrettyMIDI(mid_path)
+
+    notes = {k: [] for k in ('pitch', 'velocity', 'start', 'end', 'instrument', 'is_drum')}
+    control_changes = {k: [] for k in ('number', 'value', 'time', 'instrument')}
+    for i, instrument in enumerate(midi.instruments):
+        notes['pitch'] += [n.pitch for n in instrument.notes]
+        notes['velocity'] += [n.velocity for n in instrument.notes]
+        notes['start'] += [n.start for n in instrument.notes]
+        notes['end'] += [n.end for n in instrument.notes]
+        notes['instrument'] += [i] * len(instrument.notes)
+        notes['is_drum'] += [instrument.is_drum] * len(instrument.notes)
+
+        control_changes['number'] += [cc.number for cc in instrument.control_changes]
+        control_changes['value'] += [cc.value for cc in instrument.control_changes]
+        control_changes['time'] += [cc.time for cc in instrument.control_changes]
+        control_changes['instrument'] += [i] * len(instrument.control_changes)
+
+    notes = {k: np.array(v, dtype=bool if k == 'is_drum' else float if k in ('start', 'end') else int)
+             for k, v in notes.items()}
+    control_changes = {k: np.array(v, dtype=float if k == 'time' else int)
+                       for k, v in control_changes.items()}
+    return notes, control_changes
+
+
+def apply_sustain(notes, control_changes, sustain_control_number=64):
+    """Extend note offsets with the sustain pedal, with the exact behavior of
+    note_seq.apply_sustain_control_changes, but computed on whole arrays.
+    Notes released while the pedal is down last until the next pedal release
+    or the next onset of the same pitch, whichever comes first. Notes shortened
+    to a zero duration by a same-pitch onset are deleted.
+    Args:
+        - notes (dict): note arrays, as returned by read_midi_arrays().
+        - control_changes (dict): control change arrays.
+        - sustain_control_number (int): MIDI control number of the pedal.
+    Returns:
+        - notes (dict): note arrays with extended offsets.
+        - total_time (float): sequence duration after extension (in s).
+    """
+    end = notes['end'].copy()
+    keep = np.ones(len(end), dtype=bool)
+    total_time = float(notes['end'].max()) if len(end) else 0.
+
+    # Time of the last processed event, which ends notes still sustained
+    is_sustain = control_changes['number'] == sustain_control_number
+    not_drum = ~notes['is_drum']
+    event_times = np.concatenate([notes['start'][not_drum],
+                                  notes['end'][not_drum],
+                                  control_changes['time'][is_sustain]])
+    last_time = event_times.max() if len(event_times) else 0.
+
+    for instrument in np.unique(notes['instrument'][not_drum]):
+        note_idx = np.flatnonzero(not_drum & (notes['instrument'] == instrument))
+        cc_idx = np.flatnonzero(is_sustain & (control_changes['instrument'] == instrument))
+        n_notes = len(note_idx)
+
+        pitch = notes['pitch'][note_idx]
+        start, note_end = notes['start'][note_idx], notes['end'][note_idx]
+        cc_time = control_changes['time'][cc_idx]
+        cc_type = np.where(control_changes['value'][cc_idx] >= 64, SUSTAIN_ON, SUSTAIN_OFF)
+
+        # Position of each event in the (time, type) stable ordering
+        times = np.concatenate([start, note_end, cc_time])
+        types = np.concatenate([np.full(n_notes, NOTE_ON), np.full(n_notes, NOTE_OFF), cc_type])
+        order = np.lexsort((np.arange(len(times)), types, times))
+        position = np.empty(len(times), dtype=np.int64)
+        position[order] = np.arange(len(times))
+        on_pos, off_pos = position[:n_notes], position[n_notes: 2 * n_notes]
+        cc_pos = position[2 * n_notes:]
+
+        # Pedal state before each note event
+        cc_order = np.argsort(cc_pos)
+        cc_pos, cc_time, cc_type = cc_pos[cc_order], cc_time[cc_order], cc_type[cc_order]
+
+        def pedal_down(pos):
+            # Pedal stays up without any sustain event
+            if len(cc_pos) == 0:
+                return np.zeros(len(pos), dtype=bool)
+            last_cc = np.searchsorted(cc_pos, pos) - 1
+            return (last_cc >= 0) & (cc_type[np.maximum(last_cc, 0)] == SUSTAIN_ON)
+
+        # Next same-pitch onset with pedal down, which cuts the note. Sorted
+        # (pitch, position) keys end with a sentinel matching no pitch.
+        n_events = len(times) + 1
+        cutting = np.flatnonzero(pedal_down(on_pos))
+        cutting = cutting[np.argsort(pitch[cutting] * n_events + on_pos[cutting])]
+        cut_keys = np.append(pitch[cutting] * n_events + on_pos[cutting], np.iinfo(np.int64).max)
+        next_cut = np.searchsorted(cut_keys, pitch * n_events + on_pos, side='right')
+        has_cut = cut_keys[next_cut] // n_events == pitch
+        cut_pos = np.where(has_cut, cut_keys[next_cut] % n_events, np.inf)
+        cut_time = np.append(start[cutting], 0.)[next_cut]
+
+        # Release at note off if the pedal is up, else at the next pedal
+        # release, or at the last event if the pedal is never released
+        sustained = pedal_down(off_pos)
+        releases = cc_type == SUSTAIN_OFF
+        release_pos = np.append(cc_pos[releases], np.inf)
+        release_time = np.append(cc_time[releases], last_time)
+        next_release = np.searchsorted(release_pos, off_pos)
+        has_release = next_release < len(release_pos) - 1
+        pedal_release_pos = release_pos[next_release]
+        pedal_release_time = release_time[next_release]
+
+        end_pos = np.where(sustained, pedal_release_pos, off_pos)
+        end_time = np.where(sustained, pedal_release_time, note_end)
+
+        is_cut = cut_pos < end_pos
+        end[note_idx] = np.where(is_cut, cut_time, end_time)
+        keep[note_idx] = ~(is_cut & (cut_time == start))
+
+        # Sequence duration update
+        extended = sustained & ~is_cut
+        if np.any(extended & ~has_release):
+            total_time = last_time
+        elif np.any(extended):
+            total_time = max(total_time, pedal_release_time[extended].max())
+
+    # Notes still sustained at the end set the duration in note_seq
+    notes = dict({k: v[keep] for k, v in notes.items()}, end=end[keep])
+    return notes, float(total_time)
+
+
+def save_midi_events(path, notes, control_changes, total_time):
+    """Save notes with sustain applied and control changes, from which
+    pianorolls can be painted at any frame rate.
+    Args:
+        - path (path): events file path, ending with EVENTS_SUFFIX.
+        - notes (dict): note arrays, as returned by apply_sustain().
+        - control_changes (dict): control change arrays.
+        - total_time (float): sequence duration (in s).
+    """
+    np.savez(path,
+             total_time=total_time,
+             **{'note_' + k: v for k, v in notes.items()},
+             **{'cc_' + k: v for k, v in control_changes.items()})
+
+
+def load_midi_events(path):
+    """Read back events saved by save_midi_events().
+    Returns:
+        - notes (dict): note arrays with sustain applied.
+        - control_changes (dict): control change arrays.
+        - total_time (float): sequence duration (in s).
+    """
+    with np.load(path) as events:
+        notes = {k[len('note_'):]: events[k] for k in events.files if k.startswith('note_')}
+        control_changes = {k[len('cc_'):]: events[k] for k in events.files if k.startswith('cc_')}
+        return notes, control_changes, float(events['total_time'])
+
+
+def read_midi_events(path):
+    """Notes with sustain applied, control changes and duration of a MIDI or
+    events file."""
+    if path.endswith(EVENTS_SUFFIX):
+        return load_midi_events(path)
+    notes, control_changes = read_midi_arrays(path)
+    notes, total_time = apply_sustain(notes, control_changes)
+    return notes, control_changes, total_time
+
+
+def notes_to_pianoroll(notes,
+                       control_changes,
+                       total_time,
+                       frame_rate=250,
+                       min_pitch=21,
+                       max_pitch=108,
+                       max_velocity=127,
+                       onset_window=1):
+    """Same active, onset velocity and control change rolls as
+    note_seq.sequences_lib.sequence_to_pianoroll, painted on whole arrays.
+    Args:
+        - notes (dict): note arrays, as returned by apply_sustain().
+        - control_changes (dict): control change arrays.
+        - total_time (float): sequence duration (in s).
+        - frame_rate (int): number of frames per second.
+        - min_pitch, max_pitch (int): pitch range of the pianoroll.
+        - max_velocity (int): velocity normalization.
+        - onset_window (int): number of frames labeled around onsets.
+    Returns:
+        - active (n_frames, n_pitches): note activity pianoroll.
+        - onset_velocities (n_frames, n_pitches): onset velocities pianoroll.
+        - control_changes (n_frames, 128): control values + 1 at their frames.
+    """
+    n_frames = int(total_time * frame_rate + 1)
+    n_pitches = max_pitch - min_pitch + 1
+
+    # Notes painted in increasing start time, the last one wins on overlaps
+    in_range = (notes['pitch'] >= min_pitch) & (notes['pitch'] <= max_pitch)
+    order = np.flatnonzero(in_range)[np.argsort(notes['start'][in_range], kind='stable')]
+    pitch = notes['pitch'][order] - min_pitch
+    velocity = (notes['velocity'][order] / max_velocity).astype(np.float32)
+
+    start_frame = (notes['start'][order] * frame_rate).astype(np.int64)
+    end_frame = np.maximum(start_frame + 1,
+                           np.ceil(notes['end'][order] * frame_rate).astype(np.int64))
+    end_frame = np.minimum(end_frame, n_frames)
+    start_frame = np.minimum(start_frame, end_frame)
+
+    # Flat indices of all (frame, pitch) cells covered by notes
+    lengths = end_frame - start_frame
+    first_cell = (start_frame - np.cumsum(lengths) + lengths) * n_pitches + pitch
+    active = np.zeros((n_frames, n_pitches), dtype=np.float32)
+    active.flat[np.repeat(first_cell, lengths) + np.arange(lengths.sum()) * n_pitches] = 1.
+
+    # Onset windows cells
+    onset_frame = (notes['start'][order] * frame_rate).astype(np.int64)
+    frame = (onset_frame[:, np.newaxis] + np.arange(-onset_window, onset_window + 1)).ravel()
+    onset_pitch = np.repeat(pitch, 2 * onset_window + 1)
+    valid = (frame >= 0) & (frame < n_frames)
+    cells = np.unique(frame[valid] * n_pitches + onset_pitch[valid])
+    frame, onset_pitch = cells // n_pitches, cells % n_pitches
+
+    # Velocity of the last painted note covering each onset cell: starting
+    # from the last same-pitch note started before, step back to the notes
+    # still covering the cell.
+    by_pitch = np.lexsort((np.arange(len(order)), pitch))
+    keys = pitch[by_pitch] * (n_frames + 1) + start_frame[by_pitch]
+    note = np.searchsorted(keys, onset_pitch * (n_frames + 1) + frame, side='right') - 1
+    onset_velocities = np.zeros(len(cells), dtype=np.float32)
+    searching = np.ones(len(cells), dtype=bool)
+    while True:
+        searching &= (note >= 0) & (pitch[by_pitch[note]] == onset_pitch)
+        if not np.any(searching):
+            break
+        found = searching & (end_frame[by_pitch[note]] > frame)
+        onset_velocities[found] = velocity[by_pitch[note[found]]]
+        searching &= ~found
+        note -= searching
+
+    velocities = np.zeros((n_frames, n_pitches), dtype=np.float32)
+    velocities.flat[cells] = onset_velocities
+
+    # Control changes, the last one wins on a same frame
+    cc_rolls = np.zeros((n_frames, 128), dtype=np.int32)
+    cc_frame = (control_changes['time'] * frame_rate).astype(np.int64)
+    valid = np.flatnonzero(cc_frame < n_frames)
+    cc_cells = cc_frame[valid] * 128 + control_changes['number'][valid]
+    cc_cells, last = np.unique(cc_cells[::-1], return_index=True)
+    cc_rolls.flat[cc_cells] = control_changes['value'][valid][::-1][last] + 1
+
+    return active, velocities, cc_rolls
+
+
+def load_midi_as_pianoroll(mid_path, frame_rate=250, min_pitch=21, max_pitch=108):
+    """Read a MIDI file into pianorolls with sustain applied, without building
+    note_seq objects. Matches load_midi_as_note_sequence() followed by
+    note_seq.sequences_lib.sequence_to_pianoroll().
+    Args:
+        - mid_path (path): path to .mid file, or to an events file saved by
+        save_midi_events().
+        - frame_rate (int): number of frames per second.
+        - min_pitch, max_pitch (int): pitch range of the pianoroll.
+    Returns:
+        - active (n_frames, n_pitches): note activity pianoroll.
+        - onset_velocities (n_frames, n_pitches): onset velocities pianoroll.
+        - control_changes (n_frames, 128): control values + 1 at their frames.
+        - total_time (float): sequence duration (in s).
+    """
+    notes, control_changes, total_time = read_midi_events(mid_path)
+    active, onset_velocities, control_changes = notes_to_pianoroll(
+        notes, control_changes, total_time,
+        frame_rate=frame_rate,
+        min_pitch=min_pitch,
+        max_pitch=max_pitch)
+    return active, onset_velocities, control_changes, total_time
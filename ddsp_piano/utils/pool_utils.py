@@ -0,0 +1,152 @@
+import atexit
+import numpy as np
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+# Caches of the current worker process
+_worker_caches = (None, None)
+# Decoding pools of the main process, by configuration
+_decode_pools = {}
+
+
+def to_shared_memory(arrays):
+    """Copy arrays into new shared memory blocks.
+    Returns:
+        - descriptors (list): (block name, shape, dtype) of each array.
+    """
+    descriptors = []
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        descriptors.append((block.name, array.shape, array.dtype.str))
+        block.close()
+    return descriptors
+
+
+def from_shared_memory(descriptors):
+    """Read back and release arrays written by to_shared_memory()."""
+    arrays = []
+    for name, shape, dtype in descriptors:
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            arrays.append(np.ndarray(shape, dtype=dtype, buffer=block.buf).copy())
+        finally:
+            block.close()
+            block.unlink()
+    return arrays
+
+
+def init_worker(cache_dir, cache_max_size, cache_audio_dtype):
+    global _worker_caches
+    # Imported here to avoid a circular import with the data pipeline
+    from ddsp_piano.data_pipeline import get_caches
+    _worker_caches = get_caches(cache_dir, cache_max_size, cache_audio_dtype)
+
+
+def load_data_worker(audio_path, mid_path, max_polyphony, sample_rate, frame_rate,
+                     lowest_free_voice=False, resampler='pydub'):
+    from ddsp_piano.utils.io_utils import load_data
+    midi_cache, audio_cache = _worker_caches
+    return to_shared_memory(load_data(audio_path, mid_path,
+                                      max_polyphony=max_polyphony,
+                                      sample_rate=sample_rate,
+                                      frame_rate=frame_rate,
+                                      midi_cache=midi_cache,
+                                      audio_cache=audio_cache,
+                                      lowest_free_voice=lowest_free_voice,
+                                      resampler=resampler))
+
+
+def imap_unordered(fn, args_list, n_workers=None):
+    """Apply a function to several argument tuples in worker processes.
+    Args:
+        - fn (callable): picklable function.
+        - args_list (list): argument tuples of each call.
+        - n_workers (int): number of worker processes (number of cores if None,
+        calls run in the calling process if 0).
+    Yields:
+        - args (tuple), result: arguments and result of each call, in
+        completion order.
+    """
+    if n_workers == 0:
+        for args in args_list:
+            yield args, fn(*args)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers or multiprocessing.cpu_count(),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(fn, *args): args for args in args_list}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+class DecodePool(object):
+    """Pool of processes decoding audio and MIDI files outside of the main
+    process, hence without contention on its GIL. Decoded arrays are sent
+    back through shared memory instead of being pickled.
+    Args:
+        - n_workers (int): number of worker processes (number of cores if
+        None).
+        - cache_dir (path): folder of the converted MIDI and decoded audio
+        caches shared by the workers (no caching if None).
+        - cache_max_size (int): size budget of each cache (in bytes).
+        - cache_audio_dtype ('float32' or 'int16'): decoded audio storage.
+    """
+
+    def __init__(self, n_workers=None, cache_dir=None, cache_max_size=None,
+                 cache_audio_dtype='float32'):
+        super(DecodePool, self).__init__()
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        # Forking a process running Tensorflow is unsafe
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(cache_dir, cache_max_size, cache_audio_dtype))
+
+    def load_data(self, audio_path, mid_path, max_polyphony=None,
+                  sample_rate=16000, frame_rate=250, lowest_free_voice=False,
+                  resampler='pydub'):
+        """Same as io_utils.load_data(), computed by a worker process. Blocks
+        the calling thread only, so that concurrent calls are run in parallel.
+        """
+        descriptors = self.executor.submit(load_data_worker,
+                                           audio_path,
+                                           mid_path,
+                                           max_polyphony,
+                                           sample_rate,
+                                           frame_rate,
+                                           lowest_free_voice,
+                                           resampler).result()
+        return from_shared_memory(descriptors)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def get_decode_pool(n_workers=None, cache_dir=None, cache_max_size=None,
+                    cache_audio_dtype='float32'):
+    """DecodePool shared by all the datasets built with the same configuration,
+    so that building datasets repeatedly does not start new worker processes.
+    Pools run until close_decode_pools() is called, or until the process exits.
+    Args:
+        Same as for DecodePool.
+    Returns:
+        - decode_pool (DecodePool): pool of this configuration.
+    """
+    key = (n_workers or multiprocessing.cpu_count(), cache_dir, cache_max_size, cache_audio_dtype)
+    if key not in _decode_pools:
+        _decode_pools[key] = DecodePool(*key)
+    return _decode_pools[key]
+
+
+@atexit.register
+def close_decode_pools():
+    """Stop the worker processes of all pools from get_decode_pool(). Datasets
+    using them cannot be iterated anymore."""
+    for decode_pool in _decode_pools.values():
+        decode_pool.close()
+    _decode_pools.clear()
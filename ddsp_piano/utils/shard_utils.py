@@ -0,0 +1,184 @@
+import io
+import json
+import numpy as np
+import tensorflow as tf
+
+from os.path import join
+
+METADATA_FILENAME = 'metadata.json'
+INDEX_FILENAME = 'segment_index.npz'
+SHARD_PATTERN = 'segments-{:05d}.tfrecord'
+INDEX_KEYS = ('max_polyphony', 'n_notes', 'active_frames', 'rms', 'silent')
+
+
+def bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def int64_feature(value):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[int(value)]))
+
+
+def quantize_segment(segment):
+    """Compact storage of a segment: MIDI pitch and velocity as uint8 in the
+    conditioning, pedals as uint8 CC values + 1, and int16 PCM audio.
+    Returns:
+        - segment (dict): 'audio' (int16), 'conditioning' and 'pedal' (uint8)
+        arrays, and 'max_polyphony' clipped to a byte.
+    """
+    conditioning = np.round(segment['conditioning'] * [1., 127.])
+    return dict(
+        segment,
+        audio=np.round(np.clip(segment['audio'], -1., 1.) * 32767).astype(np.int16),
+        conditioning=conditioning.astype(np.uint8),
+        pedal=np.round(segment['pedal'] * 128).astype(np.uint8),
+        max_polyphony=min(int(segment['max_polyphony']), 255))
+
+
+def dequantize_segment(segment):
+    """In-graph decoding of quantize_segment() outputs to float tensors."""
+    conditioning = tf.cast(segment['conditioning'], tf.float32)
+    return dict(
+        segment,
+        audio=tf.cast(segment['audio'], tf.float32) / 32767.,
+        conditioning=tf.stack([conditioning[..., 0], conditioning[..., 1] / 127.], axis=-1),
+        pedal=tf.cast(segment['pedal'], tf.float32) / 128.)
+
+
+def segment_to_example(segment):
+    """Quantize and serialize a segment into a tf.train.Example.
+    Args:
+        - segment (dict): 'audio', 'conditioning', 'pedal' arrays, and
+        'piano_model', 'max_polyphony' and 'filename' scalars.
+    Returns:
+        - example (bytes): serialized example.
+    """
+    segment = quantize_segment(segment)
+    feature = {
+        k: bytes_feature(segment[k].astype(segment[k].dtype.newbyteorder('<')).tobytes())
+        for k in ('audio', 'conditioning', 'pedal')
+    }
+    feature['piano_model'] = int64_feature(np.ravel(segment['piano_model'])[0])
+    # Varint encoded, hence a single byte for usual polyphonies
+    feature['max_polyphony'] = int64_feature(segment['max_polyphony'])
+    feature['filename'] = bytes_feature(np.ravel(segment['filename'])[0])
+    return tf.train.Example(
+        features=tf.train.Features(feature=feature)).SerializeToString()
+
+
+def parse_segment(serialized, n_samples, n_frames, n_synths):
+    """Parse and decode a serialized segment example, in graph mode.
+    Returns:
+        - segment (dict): 'audio' (n_samples,), 'conditioning' (n_frames,
+        n_synths, 2), 'pedal' (n_frames, 4), 'piano_model' (1,),
+        'max_polyphony' () and 'filename' (1,).
+    """
+    features = tf.io.parse_single_example(serialized, {
+        'audio': tf.io.FixedLenFeature([], tf.string),
+        'conditioning': tf.io.FixedLenFeature([], tf.string),
+        'pedal': tf.io.FixedLenFeature([], tf.string),
+        'piano_model': tf.io.FixedLenFeature([], tf.int64),
+        'max_polyphony': tf.io.FixedLenFeature([], tf.int64),
+        'filename': tf.io.FixedLenFeature([], tf.string)
+    })
+    return dequantize_segment({
+        'audio': tf.reshape(
+            tf.io.decode_raw(features['audio'], tf.int16, little_endian=True), [n_samples]),
+        'conditioning': tf.reshape(
+            tf.io.decode_raw(features['conditioning'], tf.uint8), [n_frames, n_synths, 2]),
+        'pedal': tf.reshape(
+            tf.io.decode_raw(features['pedal'], tf.uint8), [n_frames, 4]),
+        'piano_model': features['piano_model'][tf.newaxis],
+        'max_polyphony': features['max_polyphony'],
+        'filename': features['filename'][tf.newaxis]
+    })
+
+
+class ShardWriter(object):
+    """Write segments into fixed-size TFRecord shards, along with a metadata
+    file describing the segments format, and an index of per-segment
+    properties (max polyphony, note count, active frames, audio RMS and silence
+    flag) in writing order.
+    Args:
+        - out_dir (path): folder of the shards.
+        - segments_per_shard (int): number of segments in each shard.
+        - metadata (dict): segments format description.
+    """
+
+    def __init__(self, out_dir, segments_per_shard=512, metadata=None):
+        super(ShardWriter, self).__init__()
+        self.out_dir = out_dir
+        self.segments_per_shard = segments_per_shard
+        self.metadata = dict(metadata or {})
+        self.n_segments = 0
+        self.n_shards = 0
+        self.writer = None
+        self.index = {k: [] for k in INDEX_KEYS}
+
+        tf.io.gfile.makedirs(out_dir)
+
+    def write(self, segment):
+        if self.n_segments % self.segments_per_shard == 0:
+            self.close_shard()
+            self.writer = tf.io.TFRecordWriter(
+                join(self.out_dir, SHARD_PATTERN.format(self.n_shards)))
+            self.n_shards += 1
+        self.writer.write(segment_to_example(segment))
+        self.n_segments += 1
+        for k in INDEX_KEYS:
+            self.index[k].append(segment[k])
+
+    def close_shard(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        """Close the last shard and write the metadata and index files."""
+        self.close_shard()
+        write_index(self.out_dir, self.index)
+        write_metadata(self.out_dir, dict(self.metadata,
+                                          n_segments=self.n_segments,
+                                          n_shards=self.n_shards,
+                                          segments_per_shard=self.segments_per_shard))
+
+
+def write_metadata(shards_dir, metadata):
+    with tf.io.gfile.GFile(join(shards_dir, METADATA_FILENAME), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+
+def read_metadata(shards_dir):
+    with tf.io.gfile.GFile(join(shards_dir, METADATA_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+def write_index(shards_dir, index):
+    # Zip archives need a seekable file, which GFile writers are not
+    buffer = io.BytesIO()
+    np.savez(buffer,
+             max_polyphony=np.clip(index['max_polyphony'], 0, 255).astype(np.uint8),
+             n_notes=np.array(index['n_notes'], dtype=np.int32),
+             active_frames=np.array(index['active_frames'], dtype=np.int32),
+             rms=np.array(index['rms'], dtype=np.float32),
+             silent=np.array(index['silent'], dtype=bool))
+    with tf.io.gfile.GFile(join(shards_dir, INDEX_FILENAME), 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def read_index(shards_dir):
+    """Per-segment properties of a sharded dataset (None if missing)."""
+    path = join(shards_dir, INDEX_FILENAME)
+    if not tf.io.gfile.exists(path):
+        return None
+    with tf.io.gfile.GFile(path, 'rb') as f:
+        return dict(np.load(io.BytesIO(f.read())))
+
+
+def is_sharded_dataset(path):
+    return tf.io.gfile.exists(join(path, METADATA_FILENAME))
+
+
+def list_shards(shards_dir):
+    """Shard files of a sharded dataset, in a deterministic order."""
+    return sorted(tf.io.gfile.glob(join(shards_dir, SHARD_PATTERN.replace('{:05d}', '*'))))
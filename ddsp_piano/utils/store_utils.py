@@ -0,0 +1,111 @@
+import io
+import json
+import wave
+import pydub
+import tensorflow as tf
+
+from os.path import join, splitext, dirname
+from ddsp_piano.utils.cache_utils import hash_file
+from ddsp_piano.utils.pianoroll_utils import EVENTS_SUFFIX, read_midi_events, save_midi_events
+
+# Entries of the converted tracks, appended as soon as each track is done
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+
+def get_store_filenames(audio_filename, midi_filename):
+    """Relative paths of the PCM audio and MIDI events files of a track."""
+    return splitext(audio_filename)[0] + '.wav', splitext(midi_filename)[0] + EVENTS_SUFFIX
+
+
+def write_pcm(path, audio_segment):
+    """Write a pydub.AudioSegment as a mono PCM .wav file, at its original
+    sample rate and sample width, which is read back by seeking to windows."""
+    audio_segment = audio_segment.set_channels(1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(audio_segment.sample_width)
+        wav.setframerate(audio_segment.frame_rate)
+        wav.writeframes(audio_segment.raw_data)
+    with tf.io.gfile.GFile(path, 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def write_events(path, mid_path):
+    """Convert a MIDI file into notes with sustain applied and control changes.
+    """
+    notes, control_changes, total_time = read_midi_events(mid_path)
+    buffer = io.BytesIO()
+    save_midi_events(buffer, notes, control_changes, total_time)
+    with tf.io.gfile.GFile(path, 'wb') as f:
+        f.write(buffer.getvalue())
+
+
+def convert_track(audio_path, mid_path, store_dir, audio_filename, midi_filename):
+    """Write the PCM audio and MIDI events files of a track into a store.
+    Args:
+        - audio_path (path): source audio file.
+        - mid_path (path): source .mid file.
+        - store_dir (path): store folder.
+        - audio_filename, midi_filename (str): relative paths of the files in
+        the store, as returned by get_store_filenames().
+    """
+    for filename in (audio_filename, midi_filename):
+        tf.io.gfile.makedirs(dirname(join(store_dir, filename)))
+
+    with tf.io.gfile.GFile(audio_path, 'rb') as f:
+        write_pcm(join(store_dir, audio_filename), pydub.AudioSegment.from_file(f))
+    write_events(join(store_dir, midi_filename), mid_path)
+
+
+def update_track(audio_path, mid_path, store_dir, audio_filename, midi_filename, entry=None):
+    """Convert a track into a store, unless its manifest entry shows that the
+    same source files were already converted.
+    Args:
+        - entry (dict): manifest entry of the track from a previous run.
+        Other arguments are the same as for convert_track().
+    Returns:
+        - entry (dict): new manifest entry with the source files SHA-1, or None
+        if the track is up to date.
+    """
+    hashes = {'audio_sha1': hash_file(audio_path), 'midi_sha1': hash_file(mid_path)}
+    if entry is not None and all(entry.get(k) == v for k, v in hashes.items()) and \
+            all(tf.io.gfile.exists(join(store_dir, f)) for f in (audio_filename, midi_filename)):
+        return None
+
+    convert_track(audio_path, mid_path, store_dir, audio_filename, midi_filename)
+    return hashes
+
+
+def is_store(dataset_dir):
+    """Whether a folder is a store written by preprocess_data_into_store()."""
+    return tf.io.gfile.exists(join(dataset_dir, MANIFEST_FILENAME))
+
+
+def read_manifest(store_dir):
+    """Manifest entries of the converted tracks, by source audio filename. An
+    incomplete last line, left by an interrupted run, is ignored."""
+    path = join(store_dir, MANIFEST_FILENAME)
+    manifest = {}
+    if not tf.io.gfile.exists(path):
+        return manifest
+    with tf.io.gfile.GFile(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            manifest[entry['source']] = entry
+    return manifest
+
+
+def write_manifest(store_dir, manifest):
+    tf.io.gfile.makedirs(store_dir)
+    with tf.io.gfile.GFile(join(store_dir, MANIFEST_FILENAME), 'w') as f:
+        f.write(''.join(json.dumps(entry) + '\n' for entry in manifest.values()))
+
+
+def append_manifest(store_dir, entry):
+    tf.io.gfile.makedirs(store_dir)
+    with tf.io.gfile.GFile(join(store_dir, MANIFEST_FILENAME), 'a') as f:
+        f.write(json.dumps(entry) + '\n')
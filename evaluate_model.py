@@ -22,6 +22,10 @@ def process_args():
                         help="Warm-up duration (in s, default: %(default)s)")
     parser.add_argument('--get_wav', '-w', action='store_true',
                         help="Generate wav files.")
+    parser.add_argument('--lowest_free_voice', action='store_true',
+                        help="Assign new notes to the lowest free conditioning voice instead of the next one \
+                        in round-robin order, as for a model trained with --lowest_free_voice or \
+                        --polyphony_buckets.")
     parser.add_argument('maestro_dir', type=str,
                         help="Path to the MAESTRO dataset.")
     parser.add_argument('out_dir', type=str,
@@ -68,7 +72,8 @@ def main(args):
     test_dataset = get_test_dataset(filename=args.maestro_dir,
                                     batch_size=1,
                                     duration=10.0,
-                                    sample_rate=model.sample_rate)
+                                    sample_rate=model.sample_rate,
+                                    lowest_free_voice=args.lowest_free_voice)
     test_dataset = trainer.distribute_dataset(test_dataset)
 
     # Init
@@ -1,12 +1,13 @@
 import argparse
 from absl import logging
 from os.path import join as osjoin
-from ddsp_piano.data_pipeline import preprocess_data_into_tfrecord
+from ddsp_piano.data_pipeline import preprocess_data_into_shards, preprocess_data_into_store
 
 
 def process_args():
     parser = argparse.ArgumentParser(
-        description="Preprocess MAESTRO dataset into TFRecord format."
+        description="Preprocess MAESTRO dataset into shards of TFRecord segments, or into a \
+        rate-agnostic store read by any sample rate and frame rate."
     )
     parser.add_argument('-sr', '--sample_rate', type=int, default=24000,
                         help="Sample rate for audio files. (default: %(default)s)")
@@ -14,6 +15,23 @@ def process_args():
                         help="Frame rate for conditioning. (default: %(default)s)")
     parser.add_argument('-p', '--polyphony', type=int, default=16,
                         help="Maximum polyphony for conditioning. (default: %(default)s)")
+    parser.add_argument('-d', '--duration', type=float, default=3,
+                        help="Duration of segments (in s). (default: %(default)s)")
+    parser.add_argument('-o', '--overlap', type=float, default=0.5,
+                        help="Overlap ratio between training segments. (default: %(default)s)")
+    parser.add_argument('-n', '--segments_per_shard', type=int, default=512,
+                        help="Number of segments in each shard. (default: %(default)s)")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help="Number of decoding or converting processes, 0 to run in the main process \
+                        (default: one per core)")
+    parser.add_argument('--lowest_free_voice', action='store_true',
+                        help="Assign new notes to the lowest free conditioning voice instead of the next one \
+                        in round-robin order, as required for training with polyphony buckets.")
+    parser.add_argument('--store', action='store_true',
+                        help="Convert all tracks into PCM audio at their original sample rate and MIDI \
+                        events, which are resampled and rendered at read time, instead of shards. \
+                        Only new or changed tracks are converted into an existing store, which also \
+                        resumes interrupted runs.")
     parser.add_argument('maestro_dir', type=str)
     parser.add_argument('out_dir', type=str)
     return parser.parse_args()
@@ -22,26 +40,29 @@ def process_args():
 def main(args):
     logging.set_verbosity(logging.INFO)
 
-    # Preprocess validation data
-    logging.info("Preprocessing validation data...")
-    preprocess_data_into_tfrecord(osjoin(args.out_dir, "maestro_validation.tfrecord"),
-                                  dataset_dir=args.maestro_dir,
-                                  split='validation',
-                                  sample_rate=args.sample_rate,
-                                  frame_rate=args.frame_rate,
-                                  max_polyphony=args.polyphony)
-    logging.info(f"Finished. TFrecord file stored at {args.out_dir}/maestro_validation.tfrecord")
-
-    # Preprocess training data
-    logging.info("Preprocessing training data...")
-    preprocess_data_into_tfrecord(osjoin(args.out_dir, "maestro_train.tfrecord"),
-                                  dataset_dir=args.maestro_dir,
-                                  split='train',
-                                  sample_rate=args.sample_rate,
-                                  frame_rate=args.frame_rate,
-                                  max_polyphony=args.polyphony)
-    logging.info("Finished. TFrecord file stored at {args.out_dir}/maestro_train.tfrecord")
+    if args.store:
+        logging.info("Converting tracks into a rate-agnostic store...")
+        _, n_tracks = preprocess_data_into_store(args.out_dir,
+                                                 dataset_dir=args.maestro_dir,
+                                                 workers=args.workers)
+        logging.info(f"Finished. {n_tracks} tracks stored at {args.out_dir}/")
+        return
+
+    for split in ['validation', 'train']:
+        logging.info(f"Preprocessing {split} data...")
+        n_segments = preprocess_data_into_shards(osjoin(args.out_dir, split),
+                                                 dataset_dir=args.maestro_dir,
+                                                 split=split,
+                                                 duration=args.duration,
+                                                 overlap=args.overlap,
+                                                 sample_rate=args.sample_rate,
+                                                 frame_rate=args.frame_rate,
+                                                 max_polyphony=args.polyphony,
+                                                 segments_per_shard=args.segments_per_shard,
+                                                 decode_workers=args.workers,
+                                                 lowest_free_voice=args.lowest_free_voice)
+        logging.info(f"Finished. {n_segments} segments stored at {args.out_dir}/{split}/")
 
 
 if __name__ == '__main__':
-    preprocess_data_into_tfrecord(process_args())
+    main(process_args())
@@ -43,6 +43,11 @@ Examples:
                         help="Normalize to dBFS (default: -3.0)")
     parser.add_argument('-u', '--unreverbed', action='store_true',
                         help="Also generate dry audio")
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="Folder for caching converted MIDI files")
+    parser.add_argument('--lowest_free_voice', action='store_true',
+                        help="Assign new notes to the lowest free voice, as for a model trained "
+                             "with --lowest_free_voice or --polyphony_buckets")
     parser.add_argument('midi_file', type=str, help="Input MIDI file")
     parser.add_argument('out_file', type=str, help="Output WAV file")
     
@@ -30,6 +30,10 @@ def process_args():
                               (default: %(default)s)")
     parser.add_argument('--decompose', '-dc', action='store_true',
                         help="Generate isolated piano elements audio.")
+    parser.add_argument('--lowest_free_voice', action='store_true',
+                        help="Assign new notes to the lowest free conditioning voice instead of the next one \
+                              in round-robin order, as for a model trained with --lowest_free_voice or \
+                              --polyphony_buckets.")
     parser.add_argument('maestro_dir', type=str,
                         help="Path to the maestro dataset directory.")
     parser.add_argument('csv_file', type=str,
@@ -66,7 +70,8 @@ def main(args):
         inputs = load_midi_as_conditioning(
             osjoin(args.maestro_dir, row['mid_file']),
             duration=args.duration,
-            warm_up_duration=args.warm_up
+            warm_up_duration=args.warm_up,
+            lowest_free_voice=args.lowest_free_voice
         )
         # Add piano model conditioning
         piano_model = row['piano_model']
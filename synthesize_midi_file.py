@@ -5,7 +5,7 @@ from absl import logging
 from soundfile import write
 from ddsp.training import trainers, train_util
 from ddsp.training.models import get_model
-from ddsp_piano.data_pipeline import get_dummy_data
+from ddsp_piano.data_pipeline import get_caches, get_dummy_data
 from ddsp_piano.utils.io_utils import load_midi_as_conditioning, normalize_audio
 
 
@@ -28,6 +28,13 @@ def process_args():
                               (default: %(default)s)")
     parser.add_argument('-u', '--unreverbed', action='store_true',
                         help="Also generates dry piano audio, without reverb.")
+    parser.add_argument('--lowest_free_voice', action='store_true',
+                        help="Assign new notes to the lowest free conditioning voice instead of the next one \
+                              in round-robin order, as for a model trained with --lowest_free_voice or \
+                              --polyphony_buckets.")
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="Folder for caching converted MIDI files, shared with the training data \
+                              pipeline. (default: %(default)s)")
     parser.add_argument('midi_file', type=str,
                         help="Piano MIDI file to synthesize.")
     parser.add_argument('out_file', type=str,
@@ -38,9 +45,14 @@ def process_args():
 def main(args):
     # Load MIDI data
     logging.info("Loading midi file...")
+    midi_cache, _ = get_caches(args.cache_dir)
     inputs = load_midi_as_conditioning(args.midi_file,
                                        duration=args.duration,
-                                       warm_up_duration=args.warm_up)
+                                       warm_up_duration=args.warm_up,
+                                       midi_cache=midi_cache,
+                                       lowest_free_voice=args.lowest_free_voice)
+    if midi_cache is not None:
+        logging.info(f"MIDI cache stats: {midi_cache.stats()}")
     # Add piano model conditioning
     inputs['piano_model'] = tf.convert_to_tensor([[args.piano_type]])
     logging.info(
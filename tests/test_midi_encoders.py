@@ -0,0 +1,179 @@
+import numpy as np
+import pytest
+import pretty_midi
+import tensorflow as tf
+
+from ddsp_piano.data_pipeline import batch_by_polyphony
+from ddsp_piano.utils.midi_encoders import MIDIRoll2Conditioning, EventMIDIRoll2Conditioning, MIDIStream2Conditioning
+from ddsp_piano.utils.pianoroll_utils import load_midi_as_pianoroll
+
+FRAME_RATE = 250
+
+
+def write_random_midi(path, seed, n_notes=200, duration=10., pedal_held_at_end=False):
+    """Random piano MIDI file with sustain and other pedal events."""
+    rng = np.random.default_rng(seed)
+    midi = pretty_midi.PrettyMIDI()
+    instrument = pretty_midi.Instrument(0)
+    for _ in range(n_notes):
+        start = np.round(rng.uniform(0., duration), 3)
+        end = start + max(0.005, np.round(rng.exponential(0.3), 3))
+        instrument.notes.append(
+            pretty_midi.Note(int(rng.integers(15, 110)), int(rng.integers(21, 109)), start, end))
+    for time in np.sort(np.round(rng.uniform(0., duration + 1., size=20), 3)):
+        instrument.control_changes.append(pretty_midi.ControlChange(64, int(rng.integers(0, 128)), time))
+        instrument.control_changes.append(pretty_midi.ControlChange(67, int(rng.integers(0, 128)), time))
+    if pedal_held_at_end:
+        # Press the pedal before the last note-off and never release it
+        last_end = max(note.end for note in instrument.notes)
+        instrument.control_changes = [cc for cc in instrument.control_changes if cc.time < last_end - 0.5]
+        instrument.control_changes.append(pretty_midi.ControlChange(64, 127, last_end - 0.5))
+    midi.instruments.append(instrument)
+    midi.write(str(path))
+
+
+def load_roll(path):
+    active, onset_velocities, control_changes, _ = load_midi_as_pianoroll(str(path), FRAME_RATE)
+    return np.stack((active, onset_velocities), axis=-1), control_changes[:, 64: 68] / 128.
+
+
+def stream_midi(path, seed, n_synths=16, lowest_free_voice=False, overrun=1.):
+    """Push the events of a MIDI file into a stream, advancing at random times
+    up to `overrun` seconds after the last event before flushing."""
+    midi = pretty_midi.PrettyMIDI(str(path))
+    events = []
+    for instrument in midi.instruments:
+        events += [(note.start, 'note_on', (note.pitch, note.velocity)) for note in instrument.notes]
+        events += [(note.end, 'note_off', (note.pitch, )) for note in instrument.notes]
+        events += [(cc.time, 'control_change', (cc.number, cc.value)) for cc in instrument.control_changes]
+    events.sort(key=lambda event: event[0])
+
+    rng = np.random.default_rng(seed)
+    stream = MIDIStream2Conditioning(n_synths, FRAME_RATE, lowest_free_voice=lowest_free_voice)
+    outputs = []
+    next_time = rng.uniform(0., 0.2)
+    for time, method, args in events + [(events[-1][0] + overrun, None, None)]:
+        while next_time <= time:
+            outputs.append(stream.advance(next_time))
+            next_time += rng.uniform(0., 0.2)
+        if method is not None:
+            getattr(stream, method)(time, *args)
+    outputs.append(stream.flush())
+
+    return {k: np.concatenate([output[k] for output in outputs]) for k in outputs[0]}
+
+
+def assert_same_as_batch(path, seed, n_synths=16, lowest_free_voice=False):
+    roll, pedal = load_roll(path)
+    conditioning, polyphony = EventMIDIRoll2Conditioning(n_synths, lowest_free_voice)(roll)
+    outputs = stream_midi(path, seed, n_synths, lowest_free_voice)
+
+    # Frames output past the last note end are silent
+    n_frames = len(conditioning)
+    assert len(outputs['conditioning']) >= n_frames
+    assert not outputs['conditioning'][n_frames:].any()
+    np.testing.assert_array_equal(outputs['conditioning'][:n_frames], conditioning)
+    np.testing.assert_array_equal(outputs['polyphony'][:n_frames], polyphony)
+    np.testing.assert_array_equal(outputs['pedal'][:n_frames], pedal)
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('lowest_free_voice', [False, True])
+def test_stream_same_as_batch(tmp_path, seed, lowest_free_voice):
+    write_random_midi(tmp_path / 'random.mid', seed)
+    assert_same_as_batch(tmp_path / 'random.mid', seed, lowest_free_voice=lowest_free_voice)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_stream_with_pedal_held_at_end(tmp_path, seed):
+    write_random_midi(tmp_path / 'random.mid', seed, pedal_held_at_end=True)
+    assert_same_as_batch(tmp_path / 'random.mid', seed)
+
+
+def test_stream_holds_back_sustained_frames():
+    stream = MIDIStream2Conditioning(4, FRAME_RATE)
+    stream.control_change(0.5, 64, 127)
+    stream.note_on(1., 60, 100)
+    stream.note_off(1.5, 60)
+    # The note may last until the pedal release, or end with the last event
+    assert len(stream.advance(3.)['conditioning']) == 375
+    stream.control_change(3., 64, 0)
+    assert len(stream.advance(4.)['conditioning']) == 624
+    assert not stream.flush()['conditioning'].any()
+
+
+def test_push_roll_same_as_batch(tmp_path):
+    write_random_midi(tmp_path / 'random.mid', 0)
+    roll, _ = load_roll(tmp_path / 'random.mid')
+    conditioning, polyphony = EventMIDIRoll2Conditioning(16)(roll.copy())
+
+    stream = MIDIStream2Conditioning(16, FRAME_RATE)
+    outputs = [stream.push_roll(chunk) for chunk in np.split(roll, [1, 100, 101, 1000, 1700])]
+    np.testing.assert_array_equal(np.concatenate([o['conditioning'] for o in outputs]), conditioning)
+    np.testing.assert_array_equal(np.concatenate([o['polyphony'] for o in outputs]), polyphony)
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('n_synths', [4, 16])
+def test_event_same_as_frame_wise(tmp_path, seed, n_synths):
+    write_random_midi(tmp_path / 'random.mid', seed, n_notes=100 + 200 * seed)
+    roll, _ = load_roll(tmp_path / 'random.mid')
+    expected = MIDIRoll2Conditioning(n_synths)(roll.copy())
+    outputs = EventMIDIRoll2Conditioning(n_synths)(roll.copy())
+
+    np.testing.assert_array_equal(outputs[0], expected[0])
+    np.testing.assert_array_equal(outputs[1], expected[1])
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('n_synths', [4, 16])
+def test_lowest_free_voice(tmp_path, seed, n_synths):
+    write_random_midi(tmp_path / 'random.mid', seed, n_notes=100 + 200 * seed)
+    roll, _ = load_roll(tmp_path / 'random.mid')
+    round_robin, polyphony = EventMIDIRoll2Conditioning(n_synths)(roll.copy())
+    conditioning, lowest_polyphony = EventMIDIRoll2Conditioning(n_synths, lowest_free_voice=True)(roll.copy())
+
+    # Same notes on each frame, only their channels change
+    np.testing.assert_array_equal(lowest_polyphony, polyphony)
+    np.testing.assert_array_equal(np.sort(conditioning, axis=1), np.sort(round_robin, axis=1))
+
+    # Notes start on the lowest channel free at their onset
+    pitch = conditioning[..., 0]
+    onsets = np.argwhere((pitch != 0) & (pitch != np.pad(pitch, ((1, 0), (0, 0)))[:-1]))
+    for t, c in onsets:
+        assert np.all(pitch[t, :c] != 0)
+
+
+def get_bucket_sizes(conditioning, buckets, n_frames):
+    """Sizes of the polyphony buckets of the consecutive segments of a
+    conditioning."""
+    segments = np.stack(np.split(conditioning, len(conditioning) // n_frames))
+    dataset = tf.data.Dataset.from_tensor_slices({'conditioning': segments})
+    dataset = batch_by_polyphony(dataset, 1, buckets, conditioning.shape[1],
+                                 padded_shapes={'conditioning': segments.shape[1:]})
+    sizes = np.array([batch['conditioning'].shape[2] for batch in dataset.as_numpy_iterator()])
+
+    # Cropped voices never hold any note
+    n_voices = [np.max(np.flatnonzero(segment[..., 0].any(axis=0)), initial=-1) + 1 for segment in segments]
+    np.testing.assert_array_equal(sizes, [min(b for b in buckets if b >= n) for n in n_voices])
+    return sizes
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_polyphony_buckets(tmp_path, seed):
+    write_random_midi(tmp_path / 'random.mid', seed, n_notes=300, duration=60.)
+    roll, _ = load_roll(tmp_path / 'random.mid')
+    n_frames = 750
+    roll = roll[: len(roll) // n_frames * n_frames]
+    buckets = (2, 4, 8, 16)
+    round_robin = get_bucket_sizes(EventMIDIRoll2Conditioning(16)(roll.copy())[0], buckets, n_frames)
+    conditioning, polyphony = EventMIDIRoll2Conditioning(16, lowest_free_voice=True)(roll.copy())
+    lowest_free = get_bucket_sizes(conditioning, buckets, n_frames)
+
+    # Segments only use as many voices as the polyphony since the last silence
+    silences = np.flatnonzero(polyphony == 0)
+    for i, size in enumerate(lowest_free):
+        start = silences[silences <= i * n_frames].max(initial=0)
+        max_polyphony = polyphony[start: (i + 1) * n_frames].max()
+        assert size <= min(b for b in buckets if b >= min(max_polyphony, 16))
+    assert lowest_free.mean() < round_robin.mean()
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import pretty_midi
+
+from ddsp_piano.utils.pianoroll_utils import load_midi_as_pianoroll
+
+note_seq = pytest.importorskip('note_seq')
+
+
+def write_random_midi(path, seed, n_notes=200, duration=10., sustain=True, n_instruments=1):
+    """Random piano MIDI file, with sustain pedal events or without any."""
+    rng = np.random.default_rng(seed)
+    midi = pretty_midi.PrettyMIDI()
+    instruments = [pretty_midi.Instrument(0) for _ in range(n_instruments)]
+    for _ in range(n_notes):
+        start = np.round(rng.uniform(0., duration), 2)
+        end = start + max(0.01, np.round(rng.exponential(0.5), 2))
+        instruments[rng.integers(n_instruments)].notes.append(
+            pretty_midi.Note(int(rng.integers(21, 109)), int(rng.integers(15, 110)), start, end))
+    if sustain:
+        for instrument in instruments:
+            for time in np.sort(np.round(rng.uniform(0., duration + 2., size=20), 2)):
+                instrument.control_changes.append(pretty_midi.ControlChange(64, int(rng.integers(0, 128)), time))
+    midi.instruments += instruments
+    midi.write(str(path))
+
+
+def assert_same_as_note_seq(path, frame_rate=250):
+    sequence = note_seq.apply_sustain_control_changes(note_seq.midi_io.midi_file_to_note_sequence(str(path)))
+    expected = note_seq.sequences_lib.sequence_to_pianoroll(sequence,
+                                                            frames_per_second=frame_rate,
+                                                            min_pitch=21,
+                                                            max_pitch=108)
+    active, onset_velocities, control_changes, total_time = load_midi_as_pianoroll(str(path), frame_rate)
+
+    np.testing.assert_array_equal(active, expected.active)
+    np.testing.assert_array_equal(onset_velocities, expected.onset_velocities)
+    np.testing.assert_array_equal(control_changes[:, 64], expected.control_changes[:, 64])
+    assert total_time == sequence.total_time
+
+
+def test_single_note_without_pedal(tmp_path):
+    midi = pretty_midi.PrettyMIDI()
+    instrument = pretty_midi.Instrument(0)
+    instrument.notes.append(pretty_midi.Note(60, 80, 0.5, 1.2))
+    midi.instruments.append(instrument)
+    midi.write(str(tmp_path / 'note.mid'))
+
+    assert_same_as_note_seq(tmp_path / 'note.mid')
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('sustain', [False, True])
+def test_random_files(tmp_path, seed, sustain):
+    write_random_midi(tmp_path / 'random.mid', seed, sustain=sustain, n_instruments=1 + seed % 2)
+    assert_same_as_note_seq(tmp_path / 'random.mid')
+
+
+def test_instrument_without_pedal(tmp_path):
+    write_random_midi(tmp_path / 'random.mid', 0, n_instruments=2)
+    midi = pretty_midi.PrettyMIDI(str(tmp_path / 'random.mid'))
+    midi.instruments[1].control_changes = []
+    midi.write(str(tmp_path / 'random.mid'))
+
+    assert_same_as_note_seq(tmp_path / 'random.mid')
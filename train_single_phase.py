@@ -1,5 +1,6 @@
 import os
 import gin
+import json
 import argparse
 import tensorflow as tf
 
@@ -10,8 +11,9 @@ from ddsp.training.models import get_model
 from tensorflow.summary import create_file_writer, scalar
 
 from ddsp_piano.data_pipeline \
-    import get_dummy_data, get_training_dataset, get_validation_dataset
+    import get_dummy_data, get_training_dataset, get_validation_dataset, get_service_dataset
 from ddsp_piano.utils.io_utils import collect_garbage
+from ddsp_piano.utils.pool_utils import close_decode_pools
 
 osjoin = os.path.join
 
@@ -55,6 +57,68 @@ def process_args():
                         help="Path to the validation data (if different from maestro_path).\
                         (default: %(default)s)")
 
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help="Folder for caching converted MIDI files and decoded audio across epochs.\
+                        (default: %(default)s)")
+
+    parser.add_argument('--cache_audio_dtype', type=str, default='float32',
+                        choices=['float32', 'int16'],
+                        help="Storage format of the decoded audio cache, int16 halves its size but \
+                        requantizes the resampled audio (error around -96 dBFS). (default: %(default)s)")
+
+    parser.add_argument('--segment_index', action='store_true',
+                        help="Read segments lazily from an index instead of splitting full tracks.")
+
+    parser.add_argument('--random_offsets', action='store_true',
+                        help="Draw training segments at random offsets (requires --segment_index).")
+
+    parser.add_argument('--drop_silent', action='store_true',
+                        help="Skip training segments where no note is played.")
+
+    parser.add_argument('--silent_weight', type=float, default=1.,
+                        help="Probability of drawing near-silent training segments in an epoch, 0 to drop\
+                        them. (default: %(default)s)")
+
+    parser.add_argument('--min_active_ratio', type=float, default=0.1,
+                        help="Segments holding notes over a smaller ratio of their frames are near-silent.\
+                        (default: %(default)s)")
+
+    parser.add_argument('--min_rms', type=float, default=None,
+                        help="Segments with a lower audio RMS are near-silent. (default: %(default)s)")
+
+    parser.add_argument('--shuffle_buffer_mb', type=int, default=512,
+                        help="Memory budget of the training segments shuffle buffer, in MB.\
+                        (default: %(default)s)")
+
+    parser.add_argument('--open_tracks', type=int, default=8,
+                        help="Number of tracks interleaved when shuffling training segments.\
+                        (default: %(default)s)")
+
+    parser.add_argument('--decode_workers', type=int, default=0,
+                        help="Number of processes decoding full tracks, 0 to decode in the main process.\
+                        (default: %(default)s)")
+
+    parser.add_argument('--polyphony_buckets', type=int, nargs='+', default=None,
+                        help="Batch training segments by number of voices, with these bucket sizes.\
+                        (default: %(default)s)")
+
+    parser.add_argument('--lowest_free_voice', action='store_true',
+                        help="Assign new notes to the lowest free conditioning voice instead of the next one\
+                        in round-robin order, in training and validation data (always on with \
+                        --polyphony_buckets). Synthesis with the trained model needs the same option.")
+
+    parser.add_argument('--val_cache', type=str, default=None,
+                        help="Keep validation batches after the first epoch, 'memory' or a cache folder.\
+                        (default: %(default)s)")
+
+    parser.add_argument('--data_service', type=str, default=None,
+                        help="Read training batches from a data service dispatcher (see data_service.py).\
+                        (default: %(default)s)")
+
+    parser.add_argument('--trainer_id', type=str, default=None,
+                        help="Unique id of this trainer, to read all batches of the data service along\
+                        with other trainers instead of splitting them. (default: %(default)s)")
+
     parser.add_argument('maestro_path', type=str,
                         help="Path to the MAESTRO dataset folder.")
 
@@ -115,6 +179,10 @@ def main(args):
     """
     _ = [lock_gpu() for _ in range(args.n_gpus)]
 
+    # Voice allocation of the conditioning, which the model inputs depend on
+    args.lowest_free_voice = args.lowest_free_voice or bool(args.polyphony_buckets)
+    logging.info(f"Run config: {vars(args)}")
+
     # Format training phase strategy
     first_phase_strat = ((args.phase % 2) == 1)
 
@@ -131,14 +199,37 @@ def main(args):
     # Dataset loading
     val_path = args.maestro_path if args.val_path is None else args.val_path
 
-    training_dataset = get_training_dataset(args.maestro_path,
-                                            batch_size=args.batch_size,
-                                            max_polyphony=model.n_synths,
-                                            sample_rate=model.sample_rate)
+    if args.data_service is not None:
+        training_dataset = get_service_dataset(args.data_service,
+                                               job_name='train',
+                                               trainer_id=args.trainer_id)
+    else:
+        training_dataset = get_training_dataset(args.maestro_path,
+                                                batch_size=args.batch_size,
+                                                max_polyphony=model.n_synths,
+                                                sample_rate=model.sample_rate,
+                                                cache_dir=args.cache_dir,
+                                                cache_audio_dtype=args.cache_audio_dtype,
+                                                segment_index=args.segment_index,
+                                                random_offsets=args.random_offsets,
+                                                drop_silent=args.drop_silent,
+                                                silent_weight=args.silent_weight,
+                                                min_active_ratio=args.min_active_ratio,
+                                                min_rms=args.min_rms,
+                                                shuffle_buffer_size=args.shuffle_buffer_mb * 2 ** 20,
+                                                open_tracks=args.open_tracks,
+                                                decode_workers=args.decode_workers,
+                                                polyphony_buckets=args.polyphony_buckets,
+                                                lowest_free_voice=args.lowest_free_voice)
     val_dataset = get_validation_dataset(val_path,
                                          batch_size=args.batch_size,
                                          max_polyphony=model.n_synths,
-                                         sample_rate=model.sample_rate)
+                                         sample_rate=model.sample_rate,
+                                         cache_dir=args.cache_dir,
+                                         cache_audio_dtype=args.cache_audio_dtype,
+                                         segment_index=args.segment_index,
+                                         batch_cache=args.val_cache,
+                                         lowest_free_voice=args.lowest_free_voice)
     # Dataset distribution
     training_dataset = trainer.distribute_dataset(training_dataset)
     val_dataset = trainer.distribute_dataset(val_dataset)
@@ -160,6 +251,8 @@ def main(args):
     os.makedirs(osjoin(exp_dir, "logs"), exist_ok=True)
     os.makedirs(osjoin(exp_dir, "last_iter"), exist_ok=True)
     os.makedirs(osjoin(exp_dir, "best_iter"), exist_ok=True)
+    with open(osjoin(exp_dir, "run_config.json"), 'w') as f:
+        json.dump(vars(args), f, indent=4)
 
     summary_writer = create_file_writer(osjoin(exp_dir, "logs"))
 
@@ -178,8 +271,10 @@ def main(args):
                 # =================
                 epoch_losses = {k: 0. for k in loss_keys}
                 for _ in tqdm(range(args.steps_per_epoch), ncols=64):
-                    # Train step
-                    losses = trainer.train_step(train_iterator)
+                    # Train step (on an eager batch with polyphony buckets, so
+                    # that the step is traced once per bucket size)
+                    losses = trainer.train_step(next(train_iterator) if args.polyphony_buckets
+                                                else train_iterator)
                     # Retrieve loss values
                     for k in loss_keys:
                         epoch_losses[k] += float(tf.debugging.check_numerics(
@@ -256,6 +351,10 @@ def main(args):
     except KeyboardInterrupt:
         trainer.save(osjoin(exp_dir, "stopped_iter"))
 
+    finally:
+        # Stop the track decoding processes of the datasets
+        close_decode_pools()
+
 
 if __name__ == '__main__':
     logging.set_verbosity(logging.INFO)